@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the ingestion of code annotation reports by the feature toggle report script.
+
+Run from the repository root:
+
+    python -m benchmarks.annotations --output annotations.json
+
+A synthetic annotation report is generated in a temporary directory. Results are printed as JSON, such that they can
+be compared across releases.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+
+import yaml
+
+from benchmarks.toggles import measure
+
+# Annotation tokens of each synthetic toggle, in the order in which they appear in the source code
+TOKENS = ("name", "implementation", "default", "description", "use_cases")
+
+
+def main():
+    """
+    Parse command line arguments, generate an annotation report and run the benchmarks.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timing runs per benchmark (default: 5)")
+    parser.add_argument(
+        "--annotations", type=int, default=100000, help="Number of annotations in the report (default: 100000)"
+    )
+    parser.add_argument(
+        "--files", type=int, default=20, help="Number of source files in the report (default: 20)"
+    )
+    args = parser.parse_args()
+
+    # Ingestion logs a few lines per source file
+    logging.getLogger("scripts").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        report_path = os.path.join(directory, "benchmark_annotations.yml")
+        write_annotation_report(report_path, args.annotations, args.files)
+        results = run_benchmarks(report_path, args)
+
+    report = json.dumps({"environment": get_environment(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+
+def write_annotation_report(path, annotation_count, file_count):
+    """
+    Write a code annotation report with ``annotation_count`` toggle annotations. Half of the annotations are in the
+    first source file, and the others are spread across the remaining files, such that both large and small files are
+    represented.
+    """
+    group_count = annotation_count // len(TOKENS)
+    contents = {}
+    for group_id in range(group_count):
+        file_index = 0 if group_id < group_count // 2 or file_count == 1 else 1 + group_id % (file_count - 1)
+        source_file = f"benchmark/module_{file_index}.py"
+        annotations = contents.setdefault(source_file, [])
+        for offset, token in enumerate(TOKENS):
+            if token == "implementation":
+                data = ["WaffleFlag" if group_id % 2 else "WaffleSwitch"]
+            elif token == "default":
+                data = bool(group_id % 3)
+            else:
+                data = f"benchmark.toggle_{group_id} {token}"
+            annotations.append({
+                "annotation_data": data,
+                "annotation_token": f".. toggle_{token}:",
+                "filename": source_file,
+                "found_by": "python",
+                "line_number": 10 * group_id + offset,
+                "report_group_id": group_id,
+            })
+    with open(path, "w", encoding="utf-8") as report_file:
+        yaml.dump(contents, report_file, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper))
+
+
+def run_benchmarks(report_path, args):
+    """
+    Run all benchmarks and return a list of result dicts.
+    """
+    # pylint: disable=import-outside-toplevel
+    from scripts.ida_toggles import IDA, group_annotation_file, load_annotation_file, load_annotation_groups
+
+    contents = load_annotation_file(report_path)
+    cache_dir = os.path.join(os.path.dirname(report_path), "cache")
+    # Populate the cache, such that only cache hits are measured
+    load_annotation_groups(report_path, cache_dir)
+
+    def ingest():
+        IDA("benchmark", {"github_url": "https://github.com/openedx/benchmark"})._add_annotation_data_to_toggle_state(
+            contents
+        )
+
+    results = [
+        measure(f"annotations.parse.{args.annotations}", lambda: load_annotation_file(report_path), args.repeat),
+        measure(
+            f"annotations.load_cached.{args.annotations}",
+            lambda: load_annotation_groups(report_path, cache_dir),
+            args.repeat,
+        ),
+        measure(f"annotations.group.{args.annotations}", lambda: group_annotation_file(contents), args.repeat),
+        measure(f"annotations.ingest.{args.annotations}", ingest, args.repeat),
+    ]
+    return results
+
+
+def get_environment():
+    """
+    Return the versions of the main components that affect the results.
+    """
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "pyyaml": yaml.__version__,
+        "libyaml": bool(getattr(yaml, "__with_libyaml__", False)),
+    }
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the toggle evaluation hot paths.
+
+Run from the repository root, against the SQLite test settings:
+
+    python -m benchmarks.toggles --output toggles.json
+
+Results are printed as JSON, such that they can be compared across releases.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "test_settings")
+
+
+def main():
+    """
+    Parse command line arguments, set up a test database and run the benchmarks.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="Write JSON results to this file instead of stdout")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timing runs per benchmark (default: 5)")
+    parser.add_argument(
+        "--instances", type=int, default=10000, help="Number of registered toggles for get_instances (default: 10000)"
+    )
+    parser.add_argument(
+        "--table-size", type=int, default=1000, help="Number of Flag and Switch rows for the report (default: 1000)"
+    )
+    args = parser.parse_args()
+
+    django.setup()
+    # pylint: disable=import-outside-toplevel
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results = run_benchmarks(args)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    report = json.dumps({"environment": get_environment(), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(report + "\n")
+    else:
+        print(report)
+
+
+def run_benchmarks(args):
+    """
+    Run all benchmarks and return a list of result dicts.
+    """
+    # pylint: disable=import-outside-toplevel
+    import crum
+    from django.contrib.auth.models import AnonymousUser
+    from django.test import override_settings
+    from django.test.client import RequestFactory
+    from edx_django_utils.cache import RequestCache
+    from waffle.models import Flag, Switch
+
+    from edx_toggles.toggles import SettingDictToggle, SettingToggle, WaffleFlag, WaffleSwitch
+    from edx_toggles.toggles.state import ToggleStateReport
+
+    # pylint: disable=toggle-missing-annotation
+    flag = WaffleFlag("benchmark.flag", __name__)
+    switch = WaffleSwitch("benchmark.switch", __name__)
+    setting_toggle = SettingToggle("BENCHMARK_SETTING", default=False, module_name=__name__)
+    setting_dict_toggle = SettingDictToggle("BENCHMARK_DICT_SETTING", "key", default=False, module_name=__name__)
+    Flag.objects.create(name=flag.name, everyone=True)
+    Switch.objects.create(name=switch.name, active=True)
+
+    request = RequestFactory().request()
+    request.user = AnonymousUser()
+
+    def clear_request_cache_and(func):
+        def wrapped():
+            RequestCache.clear_all_namespaces()
+            return func()
+        return wrapped
+
+    results = []
+    crum.set_current_request(request)
+    flag.is_enabled()
+    results.append(measure("waffle_flag.is_enabled.hit", flag.is_enabled, args.repeat))
+    results.append(measure("waffle_flag.is_enabled.miss", clear_request_cache_and(flag.is_enabled), args.repeat))
+    results.append(measure("request_cache.clear", RequestCache.clear_all_namespaces, args.repeat))
+    crum.set_current_request(None)
+    results.append(
+        measure("waffle_flag.is_enabled.no_request", clear_request_cache_and(flag.is_enabled), args.repeat)
+    )
+
+    switch.is_enabled()
+    results.append(measure("waffle_switch.is_enabled.hit", switch.is_enabled, args.repeat))
+    results.append(measure("waffle_switch.is_enabled.miss", clear_request_cache_and(switch.is_enabled), args.repeat))
+
+    with override_settings(BENCHMARK_SETTING=True, BENCHMARK_DICT_SETTING={"key": True}):
+        results.append(measure("setting_toggle.is_enabled", setting_toggle.is_enabled, args.repeat))
+        results.append(measure("setting_dict_toggle.is_enabled", setting_dict_toggle.is_enabled, args.repeat))
+        with override_settings(EDX_TOGGLES_SETTINGS_SNAPSHOT=True):
+            results.append(measure("setting_toggle.is_enabled.snapshot", setting_toggle.is_enabled, args.repeat))
+            results.append(
+                measure("setting_dict_toggle.is_enabled.snapshot", setting_dict_toggle.is_enabled, args.repeat)
+            )
+
+    instances = [SettingToggle(f"BENCHMARK_SETTING_{i}", module_name=__name__) for i in range(args.instances)]
+    results.append(measure(f"setting_toggle.get_instances.{len(instances)}", SettingToggle.get_instances, args.repeat))
+    del instances
+
+    Flag.objects.bulk_create(
+        Flag(name=f"benchmark.flag_{i}", everyone=bool(i % 2)) for i in range(args.table_size)
+    )
+    Switch.objects.bulk_create(Switch(name=f"benchmark.switch_{i}", active=bool(i % 2)) for i in range(args.table_size))
+    results.append(
+        measure(f"toggle_state_report.as_dict.{args.table_size}", ToggleStateReport().as_dict, args.repeat)
+    )
+    return results
+
+
+def measure(name, func, repeat):
+    """
+    Time a function and return a result dict. Durations are expressed in microseconds per call.
+    """
+    timer = timeit.Timer(func)
+    number, _duration = timer.autorange()
+    timings = [duration / number * 1e6 for duration in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "name": name,
+        "calls_per_run": number,
+        "runs": repeat,
+        "min_us": min(timings),
+        "median_us": statistics.median(timings),
+        "mean_us": statistics.mean(timings),
+        "stdev_us": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+    }
+
+
+def get_environment():
+    """
+    Return the versions of the main components that affect the results.
+    """
+    # pylint: disable=import-outside-toplevel
+    import waffle
+
+    import edx_toggles
+
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "django": django.get_version(),
+        "django_waffle": waffle.__version__,
+        "edx_toggles": edx_toggles.__version__,
+    }
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,3 +19,15 @@ class TogglesConfig(AppConfig):
             },
         },
     }
+
+    def ready(self):
+        """
+        Connect signal handlers, build the setting toggles snapshot and start receiving invalidation messages.
+        """
+        # pylint: disable=import-outside-toplevel
+        from edx_toggles.toggles.internal.setting_toggle import build_settings_snapshot
+        from edx_toggles.toggles.internal.waffle.invalidation import invalidation_bus
+        from edx_toggles.toggles.internal.waffle.signals import connect_signal_handlers
+        connect_signal_handlers()
+        build_settings_snapshot()
+        invalidation_bus.configure()
@@ -0,0 +1,3 @@
+"""
+Management of the edx_toggles app.
+"""
@@ -0,0 +1,3 @@
+"""
+Management commands of the edx_toggles app.
+"""
@@ -0,0 +1,56 @@
+"""
+Find out which call sites evaluate toggles most frequently while running another management command.
+"""
+import argparse
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from edx_toggles.toggles import get_top_call_sites, reset_toggle_stats
+from edx_toggles.toggles.internal.instrumentation import instrumentation
+
+
+class Command(BaseCommand):
+    """
+    Run a management command while sampling the call sites of toggle evaluations, then print the most frequent ones.
+
+    Example:
+
+        ./manage.py lms toggle_call_sites --sample-rate 0.1 --limit 20 -- my_command --my-option
+    """
+
+    help = __doc__
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sample-rate",
+            type=float,
+            default=1.0,
+            help="Fraction of the toggle evaluations whose call site is recorded (default: 1.0).",
+        )
+        parser.add_argument(
+            "--limit", type=int, default=20, help="Number of call sites to print (default: 20)."
+        )
+        parser.add_argument("command_name", help="Name of the management command to run.")
+        parser.add_argument("command_args", nargs=argparse.REMAINDER, help="Arguments of the management command.")
+
+    def handle(self, *args, **options):
+        sample_rate = options["sample_rate"]
+        if not 0 < sample_rate <= 1:
+            raise CommandError("The sample rate must be greater than 0 and at most 1.")
+        reset_toggle_stats()
+        previous_sample_rate = instrumentation.sample_rate
+        instrumentation.set_sample_rate(sample_rate)
+        try:
+            call_command(options["command_name"], *options["command_args"])
+        finally:
+            instrumentation.set_sample_rate(previous_sample_rate)
+        for call_site in get_top_call_sites(options["limit"]):
+            toggle_name = call_site["name"]
+            if call_site["key"] is not None:
+                toggle_name += f"[{call_site['key']!r}]"
+            self.stdout.write(
+                "{estimated_calls:>10} {kind:<12} {toggle_name} {module}:{lineno} ({function})".format(
+                    toggle_name=toggle_name, **call_site
+                )
+            )
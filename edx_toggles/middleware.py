@@ -0,0 +1,90 @@
+"""
+Middleware for edx_toggles.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from edx_toggles.toggles import WaffleFlag, WaffleSwitch
+from edx_toggles.toggles.internal.waffle.cache import process_cache, shared_cache, toggle_context
+from edx_toggles.toggles.internal.waffle.flag import _get_current_request
+
+
+class WafflePrefetchMiddleware:
+    """
+    Warm the waffle request cache at the start of each request.
+
+    Subsequent calls to ``is_enabled`` are then pure dict lookups. The values of all registered ``WaffleSwitch``
+    instances are loaded together. Flag values depend on the request user, so only the flags whose names are listed in
+    the ``EDX_TOGGLES_PREFETCH_FLAGS`` setting are loaded.
+
+    Values are prefetched from the process cache (see ``EDX_TOGGLES_PROCESS_CACHE_TIMEOUT``) or the shared cache (see
+    ``EDX_TOGGLES_SHARED_CACHE_ALIAS``), and only the objects that are missing from these caches are fetched from the
+    database, with a single query per model. This middleware does nothing unless one of these caches is enabled: it
+    would otherwise query all switches from the database on every request, bypassing waffle's own cache.
+
+    This middleware must be placed after the ``RequestCacheMiddleware`` from edx-django-utils, since that one clears the
+    request cache, and after the authentication middleware, since flag values depend on the current request user.
+    Flags are prefetched for the same request as the one that ``WaffleFlag.is_enabled`` uses: the request of the toggle
+    context (see ``ToggleContextMiddleware``) or, in its absence, the current request of django-crum. They are not
+    prefetched when neither of these middlewares is installed.
+    """
+
+    def __init__(self, get_response):
+        """
+        Middleware constructor.
+        """
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """
+        Prefetch toggle values, then process the request.
+        """
+        if process_cache.enabled or shared_cache.enabled:
+            WaffleSwitch.bulk_is_enabled(WaffleSwitch.get_instances())
+            prefetch_flag_names = set(getattr(settings, "EDX_TOGGLES_PREFETCH_FLAGS", []))
+            if prefetch_flag_names and _get_current_request() is not None:
+                WaffleFlag.bulk_is_enabled(
+                    [flag for flag in WaffleFlag.get_instances() if flag.name in prefetch_flag_names]
+                )
+        return self.get_response(request)
+
+
+class ToggleContextMiddleware:
+    """
+    Set a toggle context for the duration of each request.
+
+    The toggle context is required by the ``ais_enabled`` method of waffle toggles to cache values per request, and to
+    batch the evaluation of concurrent toggles. It also speeds up ``is_enabled``, which then reads cached values from
+    the context instead of thread-local storage.
+
+    This middleware supports both sync and async requests. It must be placed after the authentication middleware, since
+    flag values depend on the request user, and before ``WafflePrefetchMiddleware``, such that prefetched values are
+    stored in the context.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        """
+        Middleware constructor.
+        """
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        """
+        Process the request in a new toggle context.
+        """
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with toggle_context(request):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        """
+        Process the async request in a new toggle context.
+        """
+        with toggle_context(request):
+            return await self.get_response(request)
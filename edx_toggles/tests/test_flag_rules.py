@@ -0,0 +1,266 @@
+"""
+Differential tests of compiled waffle flags against waffle's ``Flag.is_active``.
+"""
+import itertools
+import os
+import random
+import subprocess
+import sys
+from decimal import Decimal
+from unittest.mock import patch
+
+import crum
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.client import RequestFactory
+from edx_django_utils.cache import RequestCache
+from waffle.models import Flag
+
+from edx_toggles.toggles import WaffleFlag
+from edx_toggles.toggles.internal.waffle.cache import process_cache
+from edx_toggles.toggles.internal.waffle.rules import CompiledFlag, compile_flag
+
+User = get_user_model()
+
+# Fields of the flag configurations of ``test_rules``
+CONFIGURATION_FIELDS = ("everyone", "testing", "superusers", "staff", "authenticated", "languages", "percent", "groups")
+
+# Request variants: (user, language, GET parameters, cookies, headers)
+USERS = ("none", "missing", "anonymous", "user", "staff", "superuser", "listed", "grouped")
+LANGUAGES = (None, "en", "fr")
+QUERIES = ({}, {"test.flag": "1"}, {"test.flag": "0"}, {"dwft_test.flag": "1"}, {"dwft_test.flag": "0"})
+COOKIES = ({}, {"dwf_test.flag": "True"}, {"dwf_test.flag": "False"}, {"dwft_test.flag": "True"})
+HEADERS = ({}, {"HTTP_DWFT_TEST.FLAG": "1"}, {"HTTP_DWFT_TEST.FLAG": "0"})
+
+
+class CompiledFlagDifferentialTests(TestCase):
+    """
+    Compare the values and side effects of compiled flags and waffle flags, for many flag configurations and requests.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.group = Group.objects.create(name="group")
+        cls.other_group = Group.objects.create(name="other")
+        cls.users = {
+            "user": User.objects.create(username="user"),
+            "staff": User.objects.create(username="staff", is_staff=True),
+            "superuser": User.objects.create(username="superuser", is_superuser=True),
+            "listed": User.objects.create(username="listed"),
+            "grouped": User.objects.create(username="grouped"),
+        }
+        cls.users["grouped"].groups.add(cls.group)
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def create_flag(self, **kwargs):
+        """
+        Create a waffle flag, with listed users and groups if requested.
+        """
+        users = kwargs.pop("users", False)
+        groups = kwargs.pop("groups", False)
+        flag = Flag.objects.create(name="test.flag", **kwargs)
+        if users:
+            flag.users.add(self.users["listed"])
+        if groups:
+            flag.groups.add(self.group if groups == "match" else self.other_group)
+        return flag
+
+    def make_request(self, user, language, query, cookies, headers):
+        """
+        Return a new request that matches a variant.
+        """
+        request = RequestFactory().get("/", query, **headers)
+        request.COOKIES.update(cookies)
+        if language is not None:
+            request.LANGUAGE_CODE = language
+        if user == "none":
+            request.user = None
+        elif user == "anonymous":
+            request.user = AnonymousUser()
+        elif user != "missing":
+            request.user = self.users[user]
+        return request
+
+    def assert_equivalent(self, flag, compiled_flag, variant, read_only=False, uniform=50.0):
+        """
+        Evaluate both flags for new requests of the given variant, and compare values and side effects.
+        """
+        waffle_request = self.make_request(*variant)
+        compiled_request = self.make_request(*variant)
+        with patch("random.uniform", return_value=uniform):
+            expected = flag.is_active(waffle_request, read_only=read_only)
+            actual = compiled_flag.is_active(compiled_request, read_only=read_only)
+        message = f"{flag.__dict__} {variant} read_only={read_only} uniform={uniform}"
+        self.assertIs(expected, actual, message)
+        self.assertEqual(getattr(waffle_request, "waffles", None), getattr(compiled_request, "waffles", None), message)
+        self.assertEqual(
+            getattr(waffle_request, "waffle_tests", None), getattr(compiled_request, "waffle_tests", None), message
+        )
+
+    def test_rules(self):
+        configurations = list(itertools.product(
+            (None, True, False),  # everyone
+            (False, True),  # testing
+            (False, True),  # superusers
+            (False, True),  # staff
+            (False, True),  # authenticated
+            ("", "fr", " fr, de "),  # languages
+            (None, Decimal("0"), Decimal("30.0")),  # percent
+            (False, "match", "other"),  # groups
+        ))
+        variants = list(itertools.product(USERS, LANGUAGES, QUERIES, COOKIES, HEADERS))
+        rng = random.Random(42)
+        for values in rng.sample(configurations, 300):
+            configuration = dict(zip(CONFIGURATION_FIELDS, values))
+            with self.subTest(**configuration):
+                flag = self.create_flag(**configuration, users=rng.random() < 0.5, rollout=rng.random() < 0.5)
+                compiled_flag = compile_flag(flag)
+                # A sample of the request variants is sufficient, given the number of flag configurations
+                for variant in rng.sample(variants, 20):
+                    self.assert_equivalent(flag, compiled_flag, variant, read_only=rng.random() < 0.2,
+                                           uniform=rng.choice((10.0, 30.0, 90.0)))
+                flag.delete()
+                cache.clear()
+
+    def test_all_request_variants(self):
+        flag = self.create_flag(
+            everyone=None, testing=True, staff=True, languages="fr", percent=Decimal("30.0"), users=True,
+            groups="match",
+        )
+        compiled_flag = compile_flag(flag)
+        for variant in itertools.product(USERS, LANGUAGES, QUERIES, COOKIES, HEADERS):
+            for uniform in (10.0, 90.0):
+                self.assert_equivalent(flag, compiled_flag, variant, uniform=uniform)
+
+    @override_settings(WAFFLE_OVERRIDE=True)
+    def test_override(self):
+        flag = self.create_flag(everyone=False)
+        compiled_flag = compile_flag(flag)
+        for variant in itertools.product(("anonymous",), LANGUAGES, QUERIES, COOKIES, ({},)):
+            self.assert_equivalent(flag, compiled_flag, variant)
+
+    def test_percent_cookie_is_reused(self):
+        flag = self.create_flag(percent=Decimal("50.0"), rollout=True)
+        compiled_flag = compile_flag(flag)
+        request = self.make_request("user", None, {}, {}, {})
+        with patch("random.uniform", return_value=10.0):
+            self.assertTrue(compiled_flag.is_active(request))
+        with patch("random.uniform", return_value=90.0):
+            self.assertTrue(compiled_flag.is_active(request))
+        self.assertEqual({"test.flag": [True, True]}, vars(request)["waffles"])
+
+    def test_user_groups_are_fetched_once_per_request(self):
+        flag = self.create_flag(groups="other")
+        compiled_flag = compile_flag(flag)
+        request = self.make_request("grouped", None, {}, {}, {})
+        with self.assertNumQueries(1):
+            self.assertFalse(compiled_flag.is_active(request))
+            self.assertFalse(compiled_flag.is_active(request))
+
+    def test_missing_flag_is_not_compiled(self):
+        self.assertIsNone(compile_flag(Flag(name="test.flag")))
+
+    def test_custom_model_is_not_compiled(self):
+        class CustomFlag(Flag):
+            """
+            Flag model with a custom evaluation method.
+            """
+
+            class Meta:
+                app_label = "waffle"
+                proxy = True
+
+            def is_active_for_user(self, user):
+                return True
+
+        flag = self.create_flag()
+        self.assertIsInstance(compile_flag(flag), CompiledFlag)
+        flag.__class__ = CustomFlag
+        self.assertIsNone(compile_flag(flag))
+
+
+@override_settings(EDX_TOGGLES_COMPILED_FLAGS=True, EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60)
+class CompiledWaffleFlagTests(TestCase):
+    """
+    Tests of waffle flags that are evaluated with compiled rules.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        process_cache.clear()
+        self.user = User.objects.create(username="user")
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        crum.set_current_request(self.request)
+        self.addCleanup(crum.set_current_request, None)
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        self.flag = WaffleFlag("test.flag", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+
+    def next_request(self):
+        """
+        Simulate the start of a new request.
+        """
+        RequestCache.clear_all_namespaces()
+        self.request = RequestFactory().get("/")
+        self.request.user = self.user
+        crum.set_current_request(self.request)
+
+    def test_no_queries_across_requests(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag = Flag.objects.create(name="test.flag", everyone=None)
+            waffle_flag.users.add(self.user)
+        self.assertTrue(self.flag.is_enabled())
+        self.next_request()
+        with self.assertNumQueries(0), patch.object(Flag, "get") as mock_get:
+            self.assertTrue(self.flag.is_enabled())
+            mock_get.assert_not_called()
+
+    def test_invalidation_on_relation_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag = Flag.objects.create(name="test.flag", everyone=None)
+        self.assertFalse(self.flag.is_enabled())
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag.users.add(self.user)
+        # Like waffle's flush on save, relation changes are only visible once waffle's cache is cleared
+        cache.clear()
+        self.next_request()
+        self.assertTrue(self.flag.is_enabled())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.flag_set.clear()
+        cache.clear()
+        self.next_request()
+        self.assertFalse(self.flag.is_enabled())
+
+    def test_bulk_is_enabled(self):
+        other_flag = WaffleFlag("test.other", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        with self.captureOnCommitCallbacks(execute=True):
+            Flag.objects.create(name="test.flag", everyone=None, authenticated=True)
+        self.assertEqual(
+            {"test.flag": True, "test.other": False}, WaffleFlag.bulk_is_enabled([self.flag, other_flag])
+        )
+        self.assertIsInstance(process_cache.get(("flag", "test.flag")), CompiledFlag)
+        self.assertIsInstance(process_cache.get(("flag", "test.other")), Flag)
+
+
+class ImportTests(SimpleTestCase):
+    """
+    Tests of the import of the toggles package.
+    """
+
+    def test_import_before_django_setup(self):
+        # Toggles are usually defined in modules that are imported before the app registry is ready
+        root_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE="test_settings", PYTHONPATH=root_dir)
+        subprocess.run(
+            [sys.executable, "-c", "import edx_toggles.toggles; from django.apps import apps; assert not apps.ready"],
+            check=True,
+            cwd=root_dir,
+            env=env,
+        )
@@ -0,0 +1,238 @@
+"""
+Unit tests for the instrumentation of toggle evaluations.
+"""
+from io import StringIO
+from unittest.mock import call, patch
+
+import crum
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+from edx_django_utils.cache import RequestCache
+
+from edx_toggles.toggles import (
+    SettingDictToggle,
+    SettingToggle,
+    WaffleFlag,
+    WaffleSwitch,
+    get_toggle_stats,
+    get_top_call_sites,
+    reset_toggle_stats
+)
+from edx_toggles.toggles.internal.instrumentation import LATENCY_BUCKETS, instrumentation
+from edx_toggles.toggles.internal.waffle.cache import process_cache
+
+
+@override_settings(EDX_TOGGLES_INSTRUMENTATION=True)
+class InstrumentationTests(TestCase):
+    """
+    Toggle instrumentation tests.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        process_cache.clear()
+        reset_toggle_stats()
+        self.addCleanup(RequestCache.clear_all_namespaces)
+
+    def get_stats(self, kind, name, key=None):
+        """
+        Return the statistics of a single toggle.
+        """
+        for stats in get_toggle_stats():
+            if (stats["kind"], stats["name"], stats["key"]) == (kind, name, key):
+                return stats
+        return None
+
+    def test_switch(self):
+        switch = WaffleSwitch("test.switch", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        for _ in range(3):
+            switch.is_enabled()
+        stats = self.get_stats("switch", "test.switch")
+        self.assertEqual(3, stats["evaluations"])
+        self.assertEqual(3, sum(stats["histogram"]))
+        self.assertEqual(len(LATENCY_BUCKETS) + 1, len(stats["histogram"]))
+        self.assertGreater(stats["total_seconds"], 0)
+        self.assertEqual({"request": {"hits": 2, "misses": 1}}, stats["cache"])
+
+    @override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60)
+    def test_process_cache(self):
+        switch = WaffleSwitch("test.switch", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        switch.is_enabled()
+        RequestCache.clear_all_namespaces()
+        switch.is_enabled()
+        self.assertEqual(
+            {"request": {"hits": 0, "misses": 2}, "process": {"hits": 1, "misses": 1}},
+            self.get_stats("switch", "test.switch")["cache"],
+        )
+
+    def test_flag_with_request(self):
+        flag = WaffleFlag("test.flag", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        request = RequestFactory().request()
+        request.user = AnonymousUser()
+        crum.set_current_request(request)
+        self.addCleanup(crum.set_current_request, None)
+        flag.is_enabled()
+        flag.is_enabled()
+        stats = self.get_stats("flag", "test.flag")
+        self.assertEqual(2, stats["evaluations"])
+        self.assertEqual(0, stats["no_request"])
+        self.assertEqual({"request": {"hits": 1, "misses": 1}}, stats["cache"])
+
+    @override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60, EDX_TOGGLES_CALL_SITE_SAMPLE_RATE=1)
+    def test_bulk_is_enabled_is_not_an_evaluation(self):
+        # pylint: disable=toggle-missing-annotation
+        switches = [WaffleSwitch("test.switch1", __name__), WaffleSwitch("test.switch2", __name__)]
+        flag = WaffleFlag("test.flag", __name__)
+        request = RequestFactory().request()
+        request.user = AnonymousUser()
+        crum.set_current_request(request)
+        self.addCleanup(crum.set_current_request, None)
+        for _ in range(3):
+            RequestCache.clear_all_namespaces()
+            WaffleSwitch.bulk_is_enabled(switches)
+            WaffleFlag.bulk_is_enabled([flag])
+        switches[0].is_enabled()
+        self.assertEqual(1, self.get_stats("switch", "test.switch1")["evaluations"])
+        self.assertEqual(0, self.get_stats("switch", "test.switch2")["evaluations"])
+        self.assertEqual(0, self.get_stats("flag", "test.flag")["evaluations"])
+        self.assertEqual([("switch", "test.switch1")], [(site["kind"], site["name"]) for site in get_top_call_sites()])
+
+    @override_settings(EDX_TOGGLES_NO_REQUEST_CACHE_TIMEOUT=60)
+    def test_flag_without_request(self):
+        flag = WaffleFlag("test.flag", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        flag.is_enabled()
+        flag.is_enabled()
+        stats = self.get_stats("flag", "test.flag")
+        self.assertEqual(2, stats["no_request"])
+        self.assertEqual({"hits": 1, "misses": 1}, stats["cache"]["no_request"])
+
+    def test_setting_toggles(self):
+        # pylint: disable=toggle-missing-annotation
+        SettingToggle("TEST_SETTING", module_name=__name__).is_enabled()
+        SettingDictToggle("TEST_SETTING_DICT", "key1", module_name=__name__).is_enabled()
+        SettingDictToggle("TEST_SETTING_DICT", "key2", module_name=__name__).is_enabled()
+        self.assertEqual(1, self.get_stats("setting", "TEST_SETTING")["evaluations"])
+        self.assertEqual(1, self.get_stats("setting_dict", "TEST_SETTING_DICT", "key1")["evaluations"])
+        self.assertEqual(1, self.get_stats("setting_dict", "TEST_SETTING_DICT", "key2")["evaluations"])
+
+    @override_settings(EDX_TOGGLES_INSTRUMENTATION=False)
+    def test_disabled(self):
+        WaffleSwitch("test.switch", __name__).is_enabled()  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        SettingToggle("TEST_SETTING", module_name=__name__).is_enabled()  # pylint: disable=toggle-missing-annotation
+        self.assertEqual([], get_toggle_stats())
+
+    @override_settings(EDX_TOGGLES_INSTRUMENTATION_CUSTOM_ATTRIBUTES=True)
+    def test_custom_attributes(self):
+        toggle = SettingToggle("TEST_SETTING", module_name=__name__)  # pylint: disable=toggle-missing-annotation
+        with patch("edx_toggles.toggles.internal.instrumentation.set_custom_attribute") as mock_set_custom_attribute:
+            toggle.is_enabled()
+            toggle.is_enabled()
+        self.assertEqual(4, mock_set_custom_attribute.call_count)
+        mock_set_custom_attribute.assert_any_call("edx_toggles.evaluations", 2)
+        self.assertEqual(call("edx_toggles.evaluations", 1), mock_set_custom_attribute.call_args_list[0])
+
+
+class ChildSettingToggle(SettingToggle):
+    """
+    Toggle class that overrides ``is_enabled``, like many toggle classes in edx-platform.
+    """
+
+    def is_enabled(self):  # pylint: disable=useless-parent-delegation
+        # The override adds a frame between the caller and the instrumented method
+        return super().is_enabled()
+
+
+@override_settings(EDX_TOGGLES_CALL_SITE_SAMPLE_RATE=1)
+class CallSiteSamplingTests(TestCase):
+    """
+    Tests for the sampling of toggle call sites.
+    """
+
+    def setUp(self):
+        super().setUp()
+        reset_toggle_stats()
+        # pylint: disable=toggle-missing-annotation
+        self.toggle = SettingToggle("TEST_SETTING", module_name=__name__)
+
+    def test_call_sites(self):
+        for _ in range(3):
+            self.toggle.is_enabled()
+        self.toggle.is_enabled()
+        call_sites = get_top_call_sites()
+        self.assertEqual(2, len(call_sites))
+        self.assertEqual(
+            {
+                "kind": "setting",
+                "name": "TEST_SETTING",
+                "key": None,
+                "module": __name__,
+                "function": "test_call_sites",
+                "samples": 3,
+                "estimated_calls": 3,
+            },
+            {key: value for key, value in call_sites[0].items() if key != "lineno"},
+        )
+        self.assertEqual(1, call_sites[1]["samples"])
+        self.assertEqual(1, call_sites[1]["lineno"] - call_sites[0]["lineno"])
+        # Statistics are not collected
+        self.assertEqual([], get_toggle_stats())
+
+    def test_child_class_frames_are_skipped(self):
+        toggle = ChildSettingToggle("TEST_SETTING", module_name=__name__)  # pylint: disable=toggle-missing-annotation
+        toggle.is_enabled()
+        self.assertEqual("test_child_class_frames_are_skipped", get_top_call_sites()[0]["function"])
+
+    @override_settings(EDX_TOGGLES_CALL_SITE_SAMPLE_RATE=0.5)
+    def test_sample_rate(self):
+        with patch("edx_toggles.toggles.internal.instrumentation.random.random", side_effect=[0.1, 0.9, 0.2]):
+            for _ in range(3):
+                self.toggle.is_enabled()
+        call_site = get_top_call_sites()[0]
+        self.assertEqual(2, call_site["samples"])
+        self.assertEqual(4, call_site["estimated_calls"])
+
+    def test_concurrent_sample_rate_change(self):
+        def disable_sampling():
+            # e.g: the toggle_call_sites command disables sampling in another thread
+            instrumentation.set_sample_rate(0)
+            return 0.1
+
+        self.addCleanup(instrumentation.configure)
+        with patch("edx_toggles.toggles.internal.instrumentation.random.random", side_effect=disable_sampling):
+            self.toggle.is_enabled()
+        self.assertEqual(1, get_top_call_sites()[0]["estimated_calls"])
+
+    @override_settings(EDX_TOGGLES_CALL_SITE_MAX_ENTRIES=2)
+    def test_bounded_size(self):
+        for _ in range(2):
+            self.toggle.is_enabled()
+        self.toggle.is_enabled()
+        self.toggle.is_enabled()
+        call_sites = get_top_call_sites()
+        self.assertEqual(2, len(call_sites))
+        self.assertEqual([2, 2], [call_site["samples"] for call_site in call_sites])
+
+    @override_settings(EDX_TOGGLES_CALL_SITE_SAMPLE_RATE=0)
+    def test_management_command(self):
+        stdout = StringIO()
+        call_command(
+            "toggle_call_sites",
+            "--limit=1",
+            "shell",
+            "-c",
+            "from edx_toggles.toggles import SettingToggle; SettingToggle('TEST_SETTING').is_enabled()",
+            stdout=stdout,
+        )
+        self.assertIn("TEST_SETTING", stdout.getvalue())
+        self.assertEqual(1, len(stdout.getvalue().splitlines()))
+        # Sampling is disabled again
+        self.toggle.is_enabled()
+        self.assertEqual(1, len(get_top_call_sites()))
+
+    def test_management_command_sample_rate(self):
+        with self.assertRaises(CommandError):
+            call_command("toggle_call_sites", "--sample-rate=2", "check")
@@ -0,0 +1,110 @@
+"""
+Tests for edx_toggles middleware.
+"""
+from unittest.mock import AsyncMock, Mock
+
+import crum
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.test.client import AsyncRequestFactory, RequestFactory
+from edx_django_utils.cache import RequestCache
+from waffle.models import Flag, Switch
+
+from edx_toggles.middleware import ToggleContextMiddleware, WafflePrefetchMiddleware
+from edx_toggles.toggles import WaffleFlag, WaffleSwitch
+from edx_toggles.toggles.internal.waffle.cache import get_toggle_context, process_cache, toggle_context
+
+
+@override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60)
+class WafflePrefetchMiddlewareTests(TestCase):
+    """
+    WafflePrefetchMiddleware tests.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        process_cache.clear()
+        self.addCleanup(crum.set_current_request, None)
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        with self.captureOnCommitCallbacks(execute=True):
+            Flag.objects.create(name="test.flag1", everyone=True)
+            Switch.objects.create(name="test.switch1", active=True)
+        # pylint: disable=toggle-missing-annotation
+        self.flag1 = WaffleFlag("test.flag1", __name__)
+        self.flag2 = WaffleFlag("test.flag2", __name__)
+        self.switch1 = WaffleSwitch("test.switch1", __name__)
+        self.switch2 = WaffleSwitch("test.switch2", __name__)
+        self.request = RequestFactory().request()
+        self.request.user = AnonymousUser()
+        self.get_response = Mock()
+        self.middleware = WafflePrefetchMiddleware(self.get_response)
+
+    @override_settings(EDX_TOGGLES_PREFETCH_FLAGS=["test.flag1"])
+    def test_prefetch(self):
+        crum.set_current_request(self.request)
+        with self.assertNumQueries(2):
+            self.middleware(self.request)
+        self.get_response.assert_called_once_with(self.request)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.flag1.is_enabled())
+            self.assertTrue(self.switch1.is_enabled())
+            self.assertFalse(self.switch2.is_enabled())
+        self.assertNotIn("test.flag2", WaffleFlag.cached_flags())
+
+        # The next requests are served by the process cache
+        RequestCache.clear_all_namespaces()
+        with self.assertNumQueries(0):
+            self.middleware(self.request)
+        self.assertEqual({"test.flag1": True}, WaffleFlag.cached_flags())
+
+    def test_no_flags(self):
+        crum.set_current_request(self.request)
+        with self.assertNumQueries(1):
+            self.middleware(self.request)
+        self.assertEqual({}, WaffleFlag.cached_flags())
+
+    @override_settings(EDX_TOGGLES_PREFETCH_FLAGS=["test.flag1"])
+    def test_no_current_request(self):
+        with self.assertNumQueries(1):
+            self.middleware(self.request)
+        self.assertEqual({}, WaffleFlag.cached_flags())
+
+    @override_settings(EDX_TOGGLES_PREFETCH_FLAGS=["test.flag1"])
+    def test_toggle_context_request(self):
+        with toggle_context(self.request) as context:
+            self.middleware(self.request)
+            self.assertEqual({"test.flag1": True}, context.flags)
+
+    @override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=None, EDX_TOGGLES_PREFETCH_FLAGS=["test.flag1"])
+    def test_disabled_without_caches(self):
+        crum.set_current_request(self.request)
+        with self.assertNumQueries(0):
+            self.middleware(self.request)
+        self.get_response.assert_called_once_with(self.request)
+        self.assertEqual({}, WaffleFlag.cached_flags())
+
+
+class ToggleContextMiddlewareTests(TestCase):
+    """
+    ToggleContextMiddleware tests.
+    """
+
+    def get_context_request(self, request):
+        """
+        Response callback that returns the request of the current toggle context.
+        """
+        return get_toggle_context().request
+
+    def test_sync(self):
+        request = RequestFactory().request()
+        middleware = ToggleContextMiddleware(Mock(side_effect=self.get_context_request))
+        self.assertIs(request, middleware(request))
+        self.assertIsNone(get_toggle_context())
+
+    async def test_async(self):
+        request = AsyncRequestFactory().get("/")
+        middleware = ToggleContextMiddleware(AsyncMock(side_effect=self.get_context_request))
+        self.assertIs(request, await middleware(request))
+        self.assertIsNone(get_toggle_context())
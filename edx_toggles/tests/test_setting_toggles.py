@@ -2,10 +2,13 @@
 """
 Unit tests that cover feature toggle functionalities.
 """
+from unittest.mock import patch
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from edx_toggles import toggles
+from edx_toggles.toggles.internal import setting_toggle as setting_toggle_module
+from edx_toggles.toggles.internal.registry import toggle_registry
 
 
 class SettingToggleTests(TestCase):
@@ -32,6 +35,13 @@ class SettingToggleTests(TestCase):
         toggle1 = toggles.SettingToggle("NAME1", 42)
         self.assertIs(True, toggle1.is_enabled())
 
+    async def test_ais_enabled(self):
+        toggle1 = toggles.SettingToggle("NAME1", False)
+
+        self.assertIs(False, await toggle1.ais_enabled())
+        with self.settings(NAME1=42):
+            self.assertIs(True, await toggle1.ais_enabled())
+
 
 class SettingDictToggleTests(TestCase):
     """
@@ -60,6 +70,13 @@ class SettingDictToggleTests(TestCase):
         with self.settings(NAME1={"key1": True}):
             self.assertFalse(toggle1.is_enabled())
 
+    async def test_ais_enabled(self):
+        toggle1 = toggles.SettingDictToggle("NAME1", "key1", False)
+
+        self.assertFalse(await toggle1.ais_enabled())
+        with self.settings(NAME1={"key1": True}):
+            self.assertTrue(await toggle1.ais_enabled())
+
 
 class ToggleInstancesTests(TestCase):
     """
@@ -78,3 +95,78 @@ class ToggleInstancesTests(TestCase):
         toggles.SettingToggle("NAME1", default=False, module_name="module1")
         instances = toggles.SettingToggle.get_instances()
         self.assertEqual([], instances)
+
+    def test_get_instance(self):
+        toggle1 = toggles.SettingToggle("NAME1", default=False, module_name="module1")
+        self.assertIs(toggle1, toggles.SettingToggle.get_instance("NAME1"))
+        self.assertIsNone(toggles.SettingToggle.get_instance("NAME2"))
+        del toggle1
+        self.assertIsNone(toggles.SettingToggle.get_instance("NAME1"))
+
+    def test_get_instances_by_module(self):
+        toggle1 = toggles.SettingToggle("NAME1", default=False, module_name="module1")
+        toggle2 = toggles.SettingToggle("NAME2", default=False, module_name="module1.submodule")
+        _toggle3 = toggles.SettingToggle("NAME3", default=False, module_name="module10")
+        self.assertEqual([toggle1, toggle2], toggles.SettingToggle.get_instances_by_module("module1"))
+        self.assertEqual([toggle2], toggles.SettingToggle.get_instances_by_module("module1.submodule"))
+
+    def test_duplicate_names(self):
+        toggle1 = toggles.SettingToggle("NAME1", default=False, module_name="module1")
+        toggle2 = toggles.SettingToggle("NAME1", default=True, module_name="module2")
+        _toggle3 = toggles.SettingToggle("NAME2", default=False, module_name="module1")
+        self.assertEqual({"NAME1": [toggle1, toggle2]}, toggles.SettingToggle.get_duplicate_names())
+        self.assertEqual(["NAME1", "NAME1", "NAME2"], [t.name for t in toggles.SettingToggle.get_instances()])
+        del toggle2
+        self.assertEqual({}, toggles.SettingToggle.get_duplicate_names())
+
+    def test_sorted_instances(self):
+        names = ["NAME3", "NAME1", "NAME4", "NAME2"]
+        created = [toggles.SettingToggle(name, default=False) for name in names]
+        self.assertEqual(sorted(names), [t.name for t in toggles.SettingToggle.get_instances()])
+        created.pop(0)
+        self.assertEqual(["NAME1", "NAME2", "NAME4"], [t.name for t in toggles.SettingToggle.get_instances()])
+        created.append(toggles.SettingToggle("NAME0", default=False))
+        self.assertEqual(
+            ["NAME0", "NAME1", "NAME2", "NAME4"], [t.name for t in toggles.SettingToggle.get_instances()]
+        )
+
+    def test_cross_class_registry(self):
+        toggle1 = toggles.SettingToggle("NAME1", default=False, module_name="module1")
+        toggle2 = toggles.SettingDictToggle("NAME1", "key", default=False, module_name="module1")
+        self.assertEqual([toggle1, toggle2], toggle_registry.get_instances_by_module("module1"))
+
+
+@override_settings(EDX_TOGGLES_SETTINGS_SNAPSHOT=True)
+class SettingsSnapshotTests(TestCase):
+    """
+    Tests for the setting toggles snapshot mode.
+    """
+
+    def test_snapshot_values(self):
+        toggle1 = toggles.SettingToggle("NAME1", default=True)
+        toggle2 = toggles.SettingToggle("NAME1", default=False)
+        toggle3 = toggles.SettingDictToggle("NAME2", "key1", default=True)
+        toggle4 = toggles.SettingDictToggle("NAME2", "key2", default=False)
+        self.assertTrue(toggle1.is_enabled())
+        self.assertFalse(toggle2.is_enabled())
+        self.assertTrue(toggle3.is_enabled())
+        self.assertFalse(toggle4.is_enabled())
+        with self.settings(NAME1=0, NAME2={"key1": False, "key2": 42}):
+            self.assertIs(False, toggle1.is_enabled())
+            self.assertIs(False, toggle2.is_enabled())
+            self.assertIs(False, toggle3.is_enabled())
+            self.assertIs(True, toggle4.is_enabled())
+        self.assertTrue(toggle1.is_enabled())
+
+    def test_snapshot_is_frozen(self):
+        toggle = toggles.SettingToggle("NAME1", default=False)
+        with self.settings(NAME1=True):
+            self.assertTrue(toggle.is_enabled())
+            # Settings are no longer read
+            with patch.object(setting_toggle_module, "settings", object()):
+                self.assertTrue(toggle.is_enabled())
+
+    def test_snapshot_disabled(self):
+        with self.settings(EDX_TOGGLES_SETTINGS_SNAPSHOT=False):
+            self.assertIsNone(setting_toggle_module._settings_snapshot)  # pylint: disable=protected-access
+            self.assertTrue(toggles.SettingToggle("NAME1", default=True).is_enabled())
@@ -1,13 +1,22 @@
 """
 Tests for waffle utils views.
 """
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
 from django.conf import settings
+from django.db.models import F
 from django.test import TestCase
 from django.test.utils import override_settings
+from waffle.models import Flag, Switch
 from waffle.testutils import override_switch
 
-from edx_toggles.toggles import SettingDictToggle, SettingToggle, WaffleFlag
-from edx_toggles.toggles.state import ToggleStateReport
+from edx_toggles.toggles import SettingDictToggle, SettingToggle, WaffleFlag, WaffleSwitch
+from edx_toggles.toggles.state import CachedToggleStateReport, StreamingToggleStateReport, ToggleStateReport
+from edx_toggles.toggles.state.internal.code_owner import code_owner_resolver
+from edx_toggles.toggles.state.internal.report import _get_binary_name
+from edx_toggles.toggles.state.internal.setting_traversal import SettingTraversal, get_boolean_settings
 from edx_toggles.toggles.testutils import override_waffle_flag
 
 TEST_WAFFLE_FLAG = WaffleFlag("test.flag", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
@@ -196,3 +205,247 @@ class ToggleStateTests(TestCase):
                                 "['advanced']['settings']['notifications']['enabled']")
         self.assertIn(expected_toggle_name, setting_dict)
         self.assertTrue(setting_dict[expected_toggle_name]["is_active"])
+
+
+class CachedToggleStateTests(TestCase):
+    """
+    Unit tests for the cached toggle state report.
+    """
+
+    def setUp(self):
+        super().setUp()
+        CachedToggleStateReport.clear_cache()
+        self.addCleanup(CachedToggleStateReport.clear_cache)
+
+    def test_same_report(self):
+        _toggle = SettingToggle("MYSETTING", default=False, module_name="module1")
+        Flag.objects.create(name="test.flag", everyone=True)
+        Switch.objects.create(name="test.switch", active=True)
+        self.assertEqual(ToggleStateReport().as_dict(), CachedToggleStateReport().as_dict())
+
+    def test_cache_hit(self):
+        report = CachedToggleStateReport().as_dict()
+        # Two aggregate queries, for flags and switches
+        with self.assertNumQueries(2):
+            self.assertIs(report, CachedToggleStateReport().as_dict())
+        stats = CachedToggleStateReport.get_cache_stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertGreaterEqual(stats["age"], 0)
+
+    def test_invalidation_on_waffle_change(self):
+        CachedToggleStateReport().as_dict()
+        Switch.objects.create(name="test.switch", active=True)
+        report = CachedToggleStateReport().as_dict()
+        self.assertIn("test.switch", [switch["name"] for switch in report["waffle_switches"]])
+        Flag.objects.create(name="test.flag", everyone=True)
+        report = CachedToggleStateReport().as_dict()
+        self.assertIn("test.flag", [flag["name"] for flag in report["waffle_flags"]])
+        self.assertEqual(3, CachedToggleStateReport.get_cache_stats()["misses"])
+
+    def test_invalidation_on_change_in_other_process(self):
+        CachedToggleStateReport().as_dict()
+        Switch.objects.bulk_create([Switch(name="test.switch", active=True)])
+        report = CachedToggleStateReport().as_dict()
+        self.assertIn("test.switch", [switch["name"] for switch in report["waffle_switches"]])
+
+    def test_invalidation_on_setting_change(self):
+        CachedToggleStateReport().as_dict()
+        with override_settings(MYSETTING=True):
+            report = CachedToggleStateReport().as_dict()
+        self.assertIn({"name": "MYSETTING", "is_active": True}, report["django_settings"])
+
+    def test_invalidation_on_new_instance(self):
+        CachedToggleStateReport().as_dict()
+        _flag = WaffleFlag("test.flag2", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        report = CachedToggleStateReport().as_dict()
+        self.assertIn("test.flag2", [flag["name"] for flag in report["waffle_flags"]])
+
+    def test_no_cached_report(self):
+        self.assertEqual({"hits": 0, "misses": 0, "age": None}, CachedToggleStateReport.get_cache_stats())
+
+
+class StreamingToggleStateTests(TestCase):
+    """
+    Unit tests for the streaming toggle state report.
+    """
+
+    def setUp(self):
+        super().setUp()
+        # pylint: disable=toggle-missing-annotation
+        self.flags = [WaffleFlag(f"test.flag{i}", __name__) for i in range(0, 10, 2)]
+        self.switches = [WaffleSwitch(f"test.switch{i}", __name__) for i in range(0, 10, 2)]
+        Flag.objects.bulk_create(
+            [Flag(name=f"test.flag{i}", everyone=[True, False, None][i % 3], note=f"note{i}") for i in range(0, 10, 3)]
+        )
+        Switch.objects.bulk_create([Switch(name=f"test.switch{i}", active=bool(i % 2)) for i in range(0, 10, 3)])
+
+    def test_same_entries(self):
+        expected = ToggleStateReport().as_dict()
+        report = StreamingToggleStateReport()
+        report.chunk_size = 2
+        self.assertEqual(expected["waffle_flags"], list(report.iter_waffle_flags()))
+        self.assertEqual(expected["waffle_switches"], list(report.iter_waffle_switches()))
+        self.assertEqual(expected["django_settings"], list(report.iter_django_settings()))
+
+    def test_json(self):
+        expected = json.loads(json.dumps(ToggleStateReport().as_dict()))
+        self.assertEqual(expected, json.loads("".join(StreamingToggleStateReport().iter_json())))
+
+    def test_pagination(self):
+        report = StreamingToggleStateReport()
+        expected_names = [flag["name"] for flag in ToggleStateReport().as_dict()["waffle_flags"]]
+        names = []
+        cursor = None
+        while True:
+            page = report.get_page("waffle_flags", after=cursor, limit=3)
+            self.assertLessEqual(len(page["results"]), 3)
+            names += [flag["name"] for flag in page["results"]]
+            cursor = page["next"]
+            if cursor is None:
+                break
+        self.assertEqual(expected_names, names)
+
+    def test_empty_page(self):
+        page = StreamingToggleStateReport().get_page("waffle_switches", after="test.switch9")
+        self.assertEqual({"results": [], "next": None}, page)
+
+    def test_mixed_case_names(self):
+        # Uppercase letters sort before lowercase letters in Python, but not in case-insensitive collations
+        # pylint: disable=toggle-missing-annotation
+        _flags = [WaffleFlag("Test.a", __name__), WaffleFlag("test.B", __name__)]
+        Flag.objects.bulk_create([Flag(name="TEST.c"), Flag(name="test.A")])
+        report = StreamingToggleStateReport()
+        report.chunk_size = 1
+        expected_names = [flag["name"] for flag in ToggleStateReport().as_dict()["waffle_flags"]]
+        self.assertEqual(expected_names, [flag["name"] for flag in report.iter_waffle_flags()])
+        names = []
+        cursor = None
+        while True:
+            page = report.get_page("waffle_flags", after=cursor, limit=2)
+            names += [flag["name"] for flag in page["results"]]
+            cursor = page["next"]
+            if cursor is None:
+                break
+        self.assertEqual(expected_names, names)
+
+    def test_binary_name_expressions(self):
+        self.assertIn("AS BINARY", _get_binary_name("mysql").extra["template"])
+        self.assertEqual("C", _get_binary_name("postgresql").collation)
+        self.assertEqual("BINARY", _get_binary_name("sqlite").collation)
+        self.assertEqual(F("name"), _get_binary_name("other"))
+
+
+class CodeOwnerTests(TestCase):
+    """
+    Unit tests for the code owner resolution of the toggle state report.
+    """
+
+    def setUp(self):
+        super().setUp()
+        code_owner_resolver.clear()
+        self.addCleanup(code_owner_resolver.clear)
+
+    @patch("edx_toggles.toggles.state.internal.code_owner.get_code_owner_from_module", return_value="team-a")
+    def test_code_owners_are_memoized(self, mock_get_code_owner_from_module):
+        # pylint: disable=toggle-missing-annotation
+        _toggles = [
+            WaffleFlag("test.flag1", "module1"),
+            WaffleFlag("test.flag2", "module1"),
+            WaffleSwitch("test.switch1", "module1"),
+            SettingToggle("MYSETTING", module_name="module2"),
+        ]
+        report = ToggleStateReport().as_dict()
+        ToggleStateReport().as_dict()
+        resolved_modules = [call.args[0] for call in mock_get_code_owner_from_module.call_args_list]
+        self.assertEqual(sorted(set(resolved_modules)), sorted(resolved_modules))
+        self.assertIn("module1", resolved_modules)
+        self.assertIn("module2", resolved_modules)
+        flags = {flag["name"]: flag for flag in report["waffle_flags"]}
+        self.assertEqual("team-a", flags["test.flag1"]["code_owner"])
+
+    @patch("edx_toggles.toggles.state.internal.code_owner.get_code_owner_from_module", return_value="team-a")
+    def test_clear_on_setting_change(self, mock_get_code_owner_from_module):
+        self.assertEqual("team-a", code_owner_resolver.get_code_owner("module1"))
+        with override_settings(CODE_OWNER_MAPPINGS={}):
+            self.assertEqual("team-a", code_owner_resolver.get_code_owner("module1"))
+        self.assertEqual(2, mock_get_code_owner_from_module.call_count)
+
+    def test_batch_resolution(self):
+        class BatchReport(ToggleStateReport):
+            """
+            Report that resolves code owners in a batch.
+            """
+            batches = []
+
+            def get_code_owners(self, modules):
+                self.batches.append(set(modules))
+                return {module: f"owner-{module}" for module in modules}
+
+        _flags = [
+            WaffleFlag(f"test.flag{i}", f"module{i % 2}")  # lint-amnesty, pylint: disable=toggle-missing-annotation
+            for i in range(4)
+        ]
+        report = BatchReport().as_dict()
+        # Waffle flag modules are resolved in a single batch
+        self.assertTrue(any({"module0", "module1"}.issubset(batch) for batch in BatchReport.batches))
+        flags = {flag["name"]: flag for flag in report["waffle_flags"]}
+        self.assertEqual(
+            ["owner-module0", "owner-module1", "owner-module0", "owner-module1"],
+            [flags[f"test.flag{i}"]["code_owner"] for i in range(4)],
+        )
+
+
+class SettingTraversalTests(TestCase):
+    """
+    Unit tests for the traversal of Django settings.
+    """
+
+    def test_allowlist_and_denylist(self):
+        traversal = SettingTraversal(allowlist=["FEATURE_*", "OTHER"], denylist=["FEATURE_DENIED"])
+        self.assertTrue(traversal.is_included("FEATURE_A"))
+        self.assertTrue(traversal.is_included("OTHER"))
+        self.assertFalse(traversal.is_included("OTHER2"))
+        self.assertFalse(traversal.is_included("FEATURE_DENIED"))
+        self.assertTrue(SettingTraversal(denylist=["A*"]).is_included("B"))
+
+    def test_max_depth(self):
+        obj = SimpleNamespace(A=True, B={"c": True, "d": {"e": False}})
+        self.assertEqual({"A": True}, SettingTraversal(max_depth=0).get_boolean_settings(obj))
+        self.assertEqual({"A": True, "B['c']": True}, SettingTraversal(max_depth=1).get_boolean_settings(obj))
+        self.assertEqual(
+            {"A": True, "B['c']": True, "B['d']['e']": False}, SettingTraversal().get_boolean_settings(obj)
+        )
+
+    def test_cycles(self):
+        cyclic = {"a": True}
+        cyclic["self"] = cyclic
+        shared = {"b": False}
+        obj = SimpleNamespace(A=cyclic, B={"x": shared, "y": shared})
+        self.assertEqual(
+            {"A['a']": True, "B['x']['b']": False, "B['y']['b']": False},
+            SettingTraversal().get_boolean_settings(obj),
+        )
+
+    def test_report_settings(self):
+        with override_settings(
+            MYSETTING1=True, MYSETTING2={"a": {"b": True}}, EDX_TOGGLES_REPORT_SETTINGS_ALLOWLIST=["MYSETTING*"],
+            EDX_TOGGLES_REPORT_SETTINGS_DENYLIST=["MYSETTING1"], EDX_TOGGLES_REPORT_SETTINGS_MAX_DEPTH=1,
+        ):
+            report = ToggleStateReport().as_dict()
+        self.assertEqual([], [setting for setting in report["django_settings"] if "MYSETTING" in setting["name"]])
+        with override_settings(
+            MYSETTING1=True, MYSETTING2={"a": {"b": True}}, EDX_TOGGLES_REPORT_SETTINGS_ALLOWLIST=["MYSETTING*"],
+        ):
+            report = ToggleStateReport().as_dict()
+        self.assertEqual(
+            [{"name": "MYSETTING1", "is_active": True}, {"name": "MYSETTING2['a']['b']", "is_active": True}],
+            report["django_settings"],
+        )
+
+    def test_cached_boolean_settings(self):
+        with override_settings(MYSETTING=True):
+            boolean_settings = get_boolean_settings()
+            self.assertIs(boolean_settings, get_boolean_settings())
+        self.assertIsNot(boolean_settings, get_boolean_settings())
+        self.assertNotIn("MYSETTING", get_boolean_settings())
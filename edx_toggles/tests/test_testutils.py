@@ -4,11 +4,13 @@ Tests for waffle utils test utilities.
 
 
 import crum
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.test.client import RequestFactory
 from edx_django_utils.cache import RequestCache
 
 from edx_toggles.toggles import WaffleFlag, WaffleSwitch
+from edx_toggles.toggles.internal.waffle.cache import process_cache
 from edx_toggles.toggles.testutils import override_waffle_flag, override_waffle_switch
 
 
@@ -93,6 +95,18 @@ class OverrideWaffleFlagTests(TestCase):
         self.assertFalse(waffle_flag1.is_enabled())
         self.assertTrue(waffle_flag2.is_enabled())
 
+    @override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60)
+    def test_override_with_process_cache(self):
+        cache.clear()
+        process_cache.clear()
+        self.assertFalse(self.waffle_flag.is_enabled())
+        with override_waffle_flag(self.waffle_flag, True):
+            # e.g: the request cache is cleared by a request of the test client
+            RequestCache.clear_all_namespaces()
+            self.assertTrue(self.waffle_flag.is_enabled())
+        RequestCache.clear_all_namespaces()
+        self.assertFalse(self.waffle_flag.is_enabled())
+
 
 class OverrideWaffleSwitchTests(TestCase):
     """
@@ -108,3 +122,19 @@ class OverrideWaffleSwitchTests(TestCase):
         with override_waffle_switch(switch, active=True):
             self.assertTrue(switch.is_enabled())
         self.assertFalse(switch.is_enabled())
+
+    @override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60)
+    def test_override_with_process_cache(self):
+        cache.clear()
+        process_cache.clear()
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        switch = WaffleSwitch(  # lint-amnesty, pylint: disable=toggle-missing-annotation
+            "test_namespace.test_switch", module_name="testmodule"
+        )
+
+        self.assertFalse(switch.is_enabled())
+        with override_waffle_switch(switch, active=True):
+            RequestCache.clear_all_namespaces()
+            self.assertTrue(switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        self.assertFalse(switch.is_enabled())
@@ -1,14 +1,53 @@
 """
 Unit tests for waffle classes.
 """
+import asyncio
+import threading
+import time
+from unittest.mock import Mock, patch
 
-from unittest.mock import patch
-
-from django.test import TestCase
+import crum
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser, Group
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.test import TestCase, override_settings
+from django.test.client import RequestFactory
+from edx_django_utils.cache import RequestCache
+from waffle.models import Flag, Switch
+from waffle.testutils import override_switch
 
 from edx_toggles.toggles import NonNamespacedWaffleFlag, NonNamespacedWaffleSwitch, WaffleFlag, WaffleSwitch
-from edx_toggles.toggles.internal.waffle.base import BaseWaffle
+from edx_toggles.toggles.internal.waffle import flag as flag_module
+from edx_toggles.toggles.internal.waffle.base import BaseWaffle, _get_many_waffle_objects
 from edx_toggles.toggles.internal.waffle.base import logger as base_logger
+from edx_toggles.toggles.internal.waffle.cache import (
+    SingleFlight,
+    ToggleContext,
+    _get_waffle_request_cache,
+    get_process_cache_stats,
+    get_single_flight_stats,
+    get_toggle_context,
+    process_cache,
+    shared_cache,
+    single_flight,
+    toggle_context,
+    user_flag_memo
+)
+from edx_toggles.toggles.internal.waffle.invalidation import (
+    DjangoCacheInvalidationBackend,
+    get_invalidation_stats,
+    invalidation_bus
+)
+from edx_toggles.toggles.internal.waffle.switch_table import (
+    background_threads_enabled,
+    get_switch_table_stats,
+    refresh_switch_table,
+    switch_table
+)
+from edx_toggles.toggles.testutils import override_waffle_switch
+
+User = get_user_model()
 
 
 class NaiveWaffle(BaseWaffle):
@@ -84,3 +123,1008 @@ class WaffleSwitchTest(TestCase):
         NonNamespacedWaffleSwitch(  # lint-amnesty, pylint: disable=toggle-missing-annotation
             "non_namespaced", module_name="module1"
         )
+
+
+@override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60)
+class ProcessCacheTests(TestCase):
+    """
+    Process-wide cache tests.
+    """
+
+    def setUp(self):
+        super().setUp()
+        request = RequestFactory().request()
+        request.user = AnonymousUser()
+        crum.set_current_request(request)
+        self.addCleanup(crum.set_current_request, None)
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        cache.clear()
+        process_cache.clear()
+        process_cache.reset_stats()
+
+    def test_switch_is_cached_across_requests(self):
+        switch = WaffleSwitch("test.switch", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        with self.captureOnCommitCallbacks(execute=True):
+            Switch.objects.create(name="test.switch", active=True)
+        self.assertTrue(switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        with patch("edx_toggles.toggles.internal.waffle.switch.switch_is_active") as mock_switch_is_active:
+            self.assertTrue(switch.is_enabled())
+            mock_switch_is_active.assert_not_called()
+        stats = get_process_cache_stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["size"])
+
+    def test_switch_invalidation_on_save(self):
+        switch = WaffleSwitch("test.switch", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_switch = Switch.objects.create(name="test.switch", active=True)
+        self.assertTrue(switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        waffle_switch.active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_switch.save()
+        self.assertFalse(switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_switch.delete()
+        self.assertFalse(switch.is_enabled())
+        self.assertEqual(2, get_process_cache_stats()["invalidations"])
+
+    def test_flag_is_cached_across_requests(self):
+        flag = WaffleFlag("test.flag", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag = Flag.objects.create(name="test.flag", everyone=True)
+        self.assertTrue(flag.is_enabled())
+        RequestCache.clear_all_namespaces()
+        with patch.object(Flag, "get") as mock_get:
+            self.assertTrue(flag.is_enabled())
+            mock_get.assert_not_called()
+        waffle_flag.everyone = False
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag.save()
+        RequestCache.clear_all_namespaces()
+        self.assertFalse(flag.is_enabled())
+
+    def test_expiration(self):
+        switch = WaffleSwitch("test.switch", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        with patch("edx_toggles.toggles.internal.waffle.cache.time.monotonic", return_value=0):
+            self.assertFalse(switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        with patch("edx_toggles.toggles.internal.waffle.cache.time.monotonic", return_value=61):
+            self.assertFalse(switch.is_enabled())
+        self.assertEqual(1, get_process_cache_stats()["expirations"])
+
+    @override_settings(EDX_TOGGLES_PROCESS_CACHE_MAX_SIZE=1)
+    def test_eviction(self):
+        switch1 = WaffleSwitch("test.switch1", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        switch2 = WaffleSwitch("test.switch2", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        switch1.is_enabled()
+        switch2.is_enabled()
+        stats = get_process_cache_stats()
+        self.assertEqual(1, stats["size"])
+        self.assertEqual(1, stats["evictions"])
+
+    @override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=None)
+    def test_disabled(self):
+        switch = WaffleSwitch("test.switch", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        switch.is_enabled()
+        stats = get_process_cache_stats()
+        self.assertFalse(stats["enabled"])
+        self.assertEqual(0, stats["size"])
+
+
+@override_settings(EDX_TOGGLES_SHARED_CACHE_ALIAS="default")
+class SharedCacheTests(TestCase):
+    """
+    Tests for the cache of waffle objects that is shared across processes.
+    """
+
+    def setUp(self):
+        super().setUp()
+        request = RequestFactory().request()
+        request.user = AnonymousUser()
+        crum.set_current_request(request)
+        self.addCleanup(crum.set_current_request, None)
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        cache.clear()
+        shared_cache.configure()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waffle_switch = Switch.objects.create(name="test.switch", active=True)
+            Flag.objects.create(name="test.flag", everyone=True)
+        # pylint: disable=toggle-missing-annotation
+        self.switch = WaffleSwitch("test.switch", __name__)
+        self.missing_switch = WaffleSwitch("test.missing", __name__)
+        self.flag = WaffleFlag("test.flag", __name__)
+
+    def test_objects_are_fetched_once(self):
+        with self.assertNumQueries(2):
+            self.assertTrue(self.switch.is_enabled())
+            self.assertTrue(self.flag.is_enabled())
+            self.assertFalse(self.missing_switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.switch.is_enabled())
+            self.assertTrue(self.flag.is_enabled())
+
+    def test_objects_are_shared_across_processes(self):
+        self.switch.is_enabled()
+        RequestCache.clear_all_namespaces()
+        # Simulate a different process, which does not have a local copy of the objects
+        shared_cache.configure()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.switch.is_enabled())
+
+    def test_invalidation_on_save(self):
+        self.assertTrue(self.switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        self.waffle_switch.active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waffle_switch.save()
+        self.assertFalse(self.switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        with self.captureOnCommitCallbacks(execute=True):
+            Switch.objects.create(name="test.new", active=True)
+        new_switch = WaffleSwitch("test.new", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        self.assertTrue(new_switch.is_enabled())
+
+    def test_bulk_is_enabled(self):
+        self.switch.is_enabled()
+        RequestCache.clear_all_namespaces()
+        switches = [self.switch, self.missing_switch]
+        with self.assertNumQueries(0):
+            self.assertEqual({"test.switch": True, "test.missing": False}, WaffleSwitch.bulk_is_enabled(switches))
+
+    def test_remote_change_without_request(self):
+        crum.set_current_request(None)
+        self.assertTrue(self.flag.is_enabled())
+        # Simulate a modification in another process, e.g: while this process runs a Celery task
+        Flag.objects.filter(name="test.flag").update(everyone=False)
+        cache.set("edx_toggles.waffle.flag.version", "remote", None)
+        self.assertFalse(self.flag.is_enabled())
+
+    def test_objects_are_memoized_per_request(self):
+        self.assertTrue(self.flag.is_enabled())
+        Flag.objects.filter(name="test.flag").update(everyone=False)
+        cache.set("edx_toggles.waffle.flag.version", "remote", None)
+        _get_waffle_request_cache().pop("flags")
+        self.assertTrue(self.flag.is_enabled())
+        RequestCache.clear_all_namespaces()
+        self.assertFalse(self.flag.is_enabled())
+
+    @override_settings(EDX_TOGGLES_SHARED_CACHE_CHUNK_SIZE=1)
+    def test_objects_are_chunked(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Switch.objects.create(name="test.other", active=False)
+        self.assertTrue(self.switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        shared_cache.configure()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.switch.is_enabled())
+            # lint-amnesty, pylint: disable=toggle-missing-annotation
+            self.assertFalse(WaffleSwitch("test.other", __name__).is_enabled())
+
+    def test_evicted_chunk(self):
+        self.assertTrue(self.switch.is_enabled())
+        version = cache.get("edx_toggles.waffle.switch.version")
+        cache.delete(f"edx_toggles.waffle.switch.{version}.0")
+        RequestCache.clear_all_namespaces()
+        shared_cache.configure()
+        with self.assertNumQueries(1):
+            self.assertTrue(self.switch.is_enabled())
+
+    def test_store_failure(self):
+        with patch.object(cache, "set_many", side_effect=lambda data, *args: list(data)):
+            with patch("edx_toggles.toggles.internal.waffle.cache.log.warning") as mock_warning:
+                self.assertTrue(self.switch.is_enabled())
+        mock_warning.assert_called_once()
+        # The objects are copied locally anyway
+        RequestCache.clear_all_namespaces()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.switch.is_enabled())
+
+    @override_settings(EDX_TOGGLES_SHARED_CACHE_ALIAS=None)
+    def test_disabled(self):
+        self.assertFalse(shared_cache.enabled)
+        self.assertTrue(self.switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        with self.assertNumQueries(0):
+            # Cached by waffle itself
+            self.assertTrue(self.switch.is_enabled())
+
+
+class SingleFlightTests(TestCase):
+    """
+    Tests for the coalescing of concurrent lookups.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.single_flight = SingleFlight()
+        self.release = threading.Event()
+
+    def run_concurrently(self, func, num_threads, num_waiting, get_stats=None):
+        """
+        Run ``func`` in many threads, and let the lookups complete once ``num_waiting`` threads are coalesced.
+        """
+        get_stats = get_stats or self.single_flight.stats
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(func())) for _ in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        while get_stats()["coalesced"] < num_waiting:
+            self.release.wait(0.001)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_lookups_are_coalesced(self):
+        lookup = Mock(side_effect=lambda: self.release.wait() and "value")
+        results = self.run_concurrently(lambda: self.single_flight.do("key", lookup), 5, 4)
+        self.assertEqual(["value"] * 5, results)
+        lookup.assert_called_once()
+        self.assertEqual({"in_flight": 0, "coalesced": 4, "lock_waits": 0}, self.single_flight.stats())
+        # Subsequent lookups are not coalesced
+        self.single_flight.do("key", lookup)
+        self.assertEqual(2, lookup.call_count)
+
+    def test_errors_are_raised(self):
+        with self.assertRaises(ValueError):
+            self.single_flight.do("key", Mock(side_effect=ValueError))
+        self.assertEqual(0, self.single_flight.stats()["in_flight"])
+
+    def test_switch_lookups_are_coalesced(self):
+        single_flight.reset_stats()
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        switch = WaffleSwitch("test.switch", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        with patch(
+            "edx_toggles.toggles.internal.waffle.switch.switch_is_active",
+            side_effect=lambda name: self.release.wait(),
+        ) as mock_switch_is_active:
+            results = self.run_concurrently(switch.is_enabled, 3, 2, get_stats=get_single_flight_stats)
+        self.assertEqual([True] * 3, results)
+        mock_switch_is_active.assert_called_once_with("test.switch")
+
+    def test_wait_for_other_process(self):
+        cache.add("key.lock", True)
+        compute = Mock(return_value="computed")
+        with patch("edx_toggles.toggles.internal.waffle.cache.time.sleep", side_effect=lambda _: cache.set("key", 1)):
+            value = self.single_flight.do_with_lock(cache, "key.lock", lambda: cache.get("key"), compute, 5)
+        self.assertEqual(1, value)
+        compute.assert_not_called()
+        self.assertEqual(1, self.single_flight.stats()["lock_waits"])
+        # The lock of the other process is not released
+        self.assertTrue(cache.get("key.lock"))
+
+    def test_lock_is_released(self):
+        value = self.single_flight.do_with_lock(cache, "key.lock", lambda: None, lambda: "computed", 5)
+        self.assertEqual("computed", value)
+        self.assertIsNone(cache.get("key.lock"))
+        self.assertEqual(0, self.single_flight.stats()["lock_waits"])
+
+    def test_lock_released_without_result(self):
+        cache.add("key.lock", True)
+        compute = Mock(return_value="computed")
+        with patch(
+            "edx_toggles.toggles.internal.waffle.cache.time.sleep", side_effect=lambda _: cache.delete("key.lock")
+        ) as mock_sleep:
+            value = self.single_flight.do_with_lock(cache, "key.lock", lambda: None, compute, 5)
+        self.assertEqual("computed", value)
+        # The other process released the lock without storing the result: we do not wait for the lock timeout
+        mock_sleep.assert_called_once()
+        compute.assert_called_once()
+        self.assertIsNone(cache.get("key.lock"))
+
+    def test_lock_timeout(self):
+        cache.add("key.lock", True)
+        value = self.single_flight.do_with_lock(cache, "key.lock", lambda: None, lambda: "computed", 0)
+        self.assertEqual("computed", value)
+        self.assertEqual(1, self.single_flight.stats()["lock_waits"])
+
+
+class NoRequestFlagTests(TestCase):
+    """
+    Tests for flags that are evaluated outside of a request, e.g: in celery tasks.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        flag_module._no_request_warnings_logged_at.clear()  # pylint: disable=protected-access
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        self.flag = WaffleFlag("test.flag", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+
+    def test_value_is_not_cached_by_default(self):
+        self.assertFalse(self.flag.is_enabled())
+        with self.captureOnCommitCallbacks(execute=True):
+            Flag.objects.create(name="test.flag", everyone=True)
+        self.assertTrue(self.flag.is_enabled())
+
+    @override_settings(EDX_TOGGLES_NO_REQUEST_CACHE_TIMEOUT=60)
+    def test_value_is_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Flag.objects.create(name="test.flag", everyone=True)
+        with self.assertNumQueries(1):
+            for _ in range(10):
+                self.assertTrue(self.flag.is_enabled())
+
+    @override_settings(EDX_TOGGLES_NO_REQUEST_CACHE_TIMEOUT=60)
+    def test_cache_invalidation_on_save(self):
+        self.assertFalse(self.flag.is_enabled())
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag = Flag.objects.create(name="test.flag", everyone=True)
+        self.assertTrue(self.flag.is_enabled())
+        waffle_flag.everyone = False
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag.save()
+        self.assertFalse(self.flag.is_enabled())
+
+    @override_settings(EDX_TOGGLES_NO_REQUEST_CACHE_TIMEOUT=60)
+    def test_cache_timeout(self):
+        with patch("edx_toggles.toggles.internal.waffle.flag.time.monotonic", return_value=0):
+            self.assertFalse(self.flag.is_enabled())
+        # Simulate a modification in another process, without signals
+        Flag.objects.bulk_create([Flag(name="test.flag", everyone=True)])
+        cache.clear()
+        with patch("edx_toggles.toggles.internal.waffle.flag.time.monotonic", return_value=59):
+            self.assertFalse(self.flag.is_enabled())
+        with patch("edx_toggles.toggles.internal.waffle.flag.time.monotonic", return_value=60):
+            self.assertTrue(self.flag.is_enabled())
+
+    def test_warning_is_logged_once(self):
+        with patch.object(flag_module.log, "warning") as mock_warning:
+            for _ in range(10):
+                RequestCache.clear_all_namespaces()
+                self.flag.is_enabled()
+        mock_warning.assert_called_once()
+
+    @override_settings(EDX_TOGGLES_NO_REQUEST_WARNING_INTERVAL=0)
+    def test_warning_interval(self):
+        with patch.object(flag_module.log, "warning") as mock_warning:
+            for _ in range(3):
+                RequestCache.clear_all_namespaces()
+                self.flag.is_enabled()
+        self.assertEqual(3, mock_warning.call_count)
+
+
+class BulkIsEnabledTests(TestCase):
+    """
+    Tests for the evaluation of many flags and switches at once.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(crum.set_current_request, None)
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        with self.captureOnCommitCallbacks(execute=True):
+            Flag.objects.create(name="test.everyone", everyone=True)
+            Flag.objects.create(name="test.nobody", everyone=False)
+            Flag.objects.create(name="test.superusers", superusers=True)
+            Switch.objects.create(name="test.active", active=True)
+            Switch.objects.create(name="test.inactive", active=False)
+        # pylint: disable=toggle-missing-annotation
+        self.flags = [
+            WaffleFlag(name, __name__)
+            for name in ["test.everyone", "test.nobody", "test.superusers", "test.missing"]
+        ]
+        self.switches = [
+            WaffleSwitch(name, __name__)
+            for name in ["test.active", "test.inactive", "test.missing"]
+        ]
+        self.superuser = User.objects.create(username="admin", is_superuser=True)
+
+    def set_request(self, user):
+        """
+        Simulate the start of a new request of the given user.
+        """
+        RequestCache.clear_all_namespaces()
+        cache.clear()
+        request = RequestFactory().request()
+        request.user = user
+        crum.set_current_request(request)
+
+    def test_flags_match_individual_values(self):
+        # One query for all flags, plus the user and group ids of the "test.superusers" flag for non-superusers
+        for user, num_queries in [(AnonymousUser(), 3), (self.superuser, 1)]:
+            self.set_request(user)
+            individual_values = {flag.name: flag.is_enabled() for flag in self.flags}
+            self.set_request(user)
+            with self.assertNumQueries(num_queries):
+                bulk_values = WaffleFlag.bulk_is_enabled(self.flags)
+            self.assertEqual(individual_values, bulk_values)
+        self.assertEqual(
+            {"test.everyone": True, "test.nobody": False, "test.superusers": True, "test.missing": False},
+            bulk_values,
+        )
+
+    def test_flags_are_cached(self):
+        self.set_request(AnonymousUser())
+        WaffleFlag.bulk_is_enabled(self.flags)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.flags[0].is_enabled())
+            WaffleFlag.bulk_is_enabled(self.flags)
+
+    def test_flags_without_request(self):
+        self.assertEqual(
+            {"test.everyone": True, "test.nobody": False, "test.superusers": False, "test.missing": False},
+            WaffleFlag.bulk_is_enabled(self.flags),
+        )
+
+    def test_switches(self):
+        with self.assertNumQueries(1):
+            values = WaffleSwitch.bulk_is_enabled(self.switches)
+        self.assertEqual({"test.active": True, "test.inactive": False, "test.missing": False}, values)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.switches[0].is_enabled())
+            WaffleSwitch.bulk_is_enabled(self.switches)
+
+
+class AsyncIsEnabledTests(TestCase):
+    """
+    Tests for the async evaluation of waffle toggles.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        with self.captureOnCommitCallbacks(execute=True):
+            Flag.objects.create(name="test.everyone", everyone=True)
+            Flag.objects.create(name="test.superusers", superusers=True)
+            Switch.objects.create(name="test.active", active=True)
+        # pylint: disable=toggle-missing-annotation
+        self.flags = [WaffleFlag(name, __name__) for name in ["test.everyone", "test.superusers", "test.missing"]]
+        self.switches = [WaffleSwitch(name, __name__) for name in ["test.active", "test.missing"]]
+        self.request = RequestFactory().request()
+        self.request.user = User.objects.create(username="admin", is_superuser=True)
+
+    async def test_switches_are_batched(self):
+        with toggle_context(), patch(
+            "edx_toggles.toggles.internal.waffle.switch._get_many_waffle_objects", wraps=_get_many_waffle_objects
+        ) as mock_get_many_waffle_objects:
+            values = await asyncio.gather(*(switch.ais_enabled() for switch in self.switches))
+            self.assertEqual([True, False], values)
+            self.assertEqual({"test.active": True, "test.missing": False}, get_toggle_context().switches)
+            self.assertTrue(await self.switches[0].ais_enabled())
+        mock_get_many_waffle_objects.assert_called_once_with(Switch, ["test.active", "test.missing"])
+
+    async def test_flags_are_batched(self):
+        with toggle_context(self.request), patch(
+            "edx_toggles.toggles.internal.waffle.flag._get_many_waffle_objects", wraps=_get_many_waffle_objects
+        ) as mock_get_many_waffle_objects:
+            values = await asyncio.gather(*(flag.ais_enabled() for flag in self.flags))
+            self.assertEqual([True, True, False], values)
+            self.assertTrue(await self.flags[0].ais_enabled())
+        mock_get_many_waffle_objects.assert_called_once()
+
+    async def test_contexts_are_isolated(self):
+        async def evaluate(request):
+            with toggle_context(request):
+                return await self.flags[1].ais_enabled()
+
+        anonymous_request = RequestFactory().request()
+        anonymous_request.user = AnonymousUser()
+        self.assertEqual([True, False], await asyncio.gather(evaluate(self.request), evaluate(anonymous_request)))
+
+    async def test_errors_are_raised(self):
+        with toggle_context():
+            with patch("edx_toggles.toggles.internal.waffle.switch.process_cache.get", side_effect=ValueError):
+                with self.assertRaises(ValueError):
+                    await asyncio.gather(*(switch.ais_enabled() for switch in self.switches))
+            # Values are loaded again
+            self.assertTrue(await self.switches[0].ais_enabled())
+
+    async def test_without_context(self):
+        self.assertTrue(await self.switches[0].ais_enabled())
+        # Flags are evaluated like outside of a request
+        self.assertTrue(await self.flags[0].ais_enabled())
+        self.assertFalse(await self.flags[1].ais_enabled())
+
+
+class ToggleContextTests(TestCase):
+    """
+    Tests for the synchronous evaluation of waffle toggles in a toggle context.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        with self.captureOnCommitCallbacks(execute=True):
+            Flag.objects.create(name="test.superusers", superusers=True)
+            Switch.objects.create(name="test.active", active=True)
+        # pylint: disable=toggle-missing-annotation
+        self.flag = WaffleFlag("test.superusers", __name__)
+        self.switch = WaffleSwitch("test.active", __name__)
+        self.request = RequestFactory().request()
+        self.request.user = User.objects.create(username="admin", is_superuser=True)
+
+    def test_flag(self):
+        with toggle_context(self.request) as context:
+            with patch.object(flag_module.crum, "get_current_request") as mock_get_current_request:
+                self.assertTrue(self.flag.is_enabled())
+                self.assertTrue(self.flag.is_enabled())
+            mock_get_current_request.assert_not_called()
+            self.assertEqual({"test.superusers": True}, context.flags)
+            self.assertIs(context.flags, WaffleFlag.cached_flags())
+            self.assertEqual({"test.superusers": True}, WaffleFlag.bulk_is_enabled([self.flag]))
+        self.assertEqual({}, WaffleFlag.cached_flags())
+
+    def test_flag_without_context_request(self):
+        crum.set_current_request(self.request)
+        self.addCleanup(crum.set_current_request, None)
+        with toggle_context() as context:
+            self.assertTrue(self.flag.is_enabled())
+            self.assertEqual({"test.superusers": True}, context.flags)
+
+    def test_switch(self):
+        with toggle_context() as context:
+            self.assertTrue(self.switch.is_enabled())
+            with self.assertNumQueries(0):
+                self.assertTrue(self.switch.is_enabled())
+            self.assertEqual({"test.active": True}, context.switches)
+        self.assertEqual({}, _get_waffle_request_cache().get("switches", {}))
+
+    def test_contexts_are_isolated_across_threads(self):
+        results = []
+
+        def evaluate():
+            with toggle_context() as context:
+                context.switches["test.active"] = False
+                results.append(self.switch.is_enabled())
+
+        with toggle_context():
+            self.assertTrue(self.switch.is_enabled())
+            thread = threading.Thread(target=evaluate)
+            thread.start()
+            thread.join()
+            self.assertTrue(self.switch.is_enabled())
+        self.assertEqual([False], results)
+
+
+class ToggleContextBatchTests(TestCase):
+    """
+    Tests for the batched loading of toggle values in a toggle context.
+    """
+
+    async def test_cancelled_awaiter(self):
+        context = ToggleContext()
+
+        async def load_many(names):
+            await asyncio.sleep(0)
+            return {name: True for name in names}
+
+        task1 = asyncio.ensure_future(context.load("switches", "test.switch1", load_many))
+        task2 = asyncio.ensure_future(context.load("switches", "test.switch2", load_many))
+        await asyncio.sleep(0)
+        task1.cancel()
+        self.assertTrue(await asyncio.wait_for(task2, 1))
+        self.assertTrue(task1.cancelled())
+
+    async def test_missing_value(self):
+        context = ToggleContext()
+
+        async def load_many(_names):
+            return {"test.switch1": True}
+
+        values = await asyncio.wait_for(asyncio.gather(
+            context.load("switches", "test.switch1", load_many),
+            context.load("switches", "test.switch2", load_many),
+        ), 1)
+        self.assertEqual([True, None], values)
+
+    async def test_load_error(self):
+        context = ToggleContext()
+
+        async def load_many(names):
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            await asyncio.wait_for(context.load("switches", "test.switch1", load_many), 1)
+
+    async def test_cancelled_flush(self):
+        context = ToggleContext()
+        started = asyncio.Event()
+
+        async def load_many(_names):
+            started.set()
+            await asyncio.Event().wait()
+
+        task = asyncio.ensure_future(context.load("switches", "test.switch1", load_many))
+        await started.wait()
+        for flush_task in list(context._flush_tasks):  # pylint: disable=protected-access
+            flush_task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await asyncio.wait_for(task, 1)
+
+
+@override_settings(EDX_TOGGLES_SWITCH_TABLE_REFRESH_INTERVAL=60)
+class SwitchTableTests(TestCase):
+    """
+    Tests for the in-process table of waffle switch values.
+    """
+
+    def setUp(self):
+        super().setUp()
+        switch_table.configure()
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waffle_switch = Switch.objects.create(name="test.active", active=True)
+            Switch.objects.create(name="test.inactive", active=False)
+        # pylint: disable=toggle-missing-annotation
+        self.switches = [WaffleSwitch(name, __name__) for name in ["test.active", "test.inactive", "test.missing"]]
+
+    def test_single_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual([True, False, False], [switch.is_enabled() for switch in self.switches])
+        RequestCache.clear_all_namespaces()
+        with self.assertNumQueries(0):
+            self.assertTrue(self.switches[0].is_enabled())
+            self.assertEqual(
+                {"test.active": True, "test.inactive": False, "test.missing": False},
+                WaffleSwitch.bulk_is_enabled(self.switches),
+            )
+        self.assertEqual({}, _get_waffle_request_cache().get("switches", {}))
+        stats = get_switch_table_stats()
+        self.assertEqual(2, stats["size"])
+        self.assertEqual(1, stats["refreshes"])
+        self.assertFalse(stats["background_refresh"])
+
+    async def test_ais_enabled(self):
+        self.assertTrue(await self.switches[0].ais_enabled())
+        self.assertFalse(await self.switches[1].ais_enabled())
+
+    def test_invalidation_on_save(self):
+        self.assertTrue(self.switches[0].is_enabled())
+        self.waffle_switch.active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waffle_switch.save()
+        self.assertTrue(get_switch_table_stats()["stale"])
+        self.assertFalse(self.switches[0].is_enabled())
+
+    def test_invalidation_before_commit(self):
+        self.assertTrue(self.switches[0].is_enabled())
+        self.waffle_switch.active = False
+        self.waffle_switch.save()
+        self.assertFalse(self.switches[0].is_enabled())
+
+    def test_override_waffle_switch(self):
+        self.assertTrue(self.switches[0].is_enabled())
+        with override_waffle_switch(self.switches[0], active=False):
+            self.assertFalse(self.switches[0].is_enabled())
+            self.assertEqual({"test.active": False}, WaffleSwitch.bulk_is_enabled(self.switches[:1]))
+            RequestCache.clear_all_namespaces()
+            self.assertFalse(self.switches[0].is_enabled())
+        self.assertTrue(self.switches[0].is_enabled())
+
+    def test_override_switch(self):
+        self.assertFalse(self.switches[2].is_enabled())
+        with override_switch("test.missing", active=True):
+            self.assertTrue(self.switches[2].is_enabled())
+        self.assertFalse(self.switches[2].is_enabled())
+
+    async def test_ais_enabled_request_cache(self):
+        _get_waffle_request_cache()["switches"] = {"test.active": False}
+        self.assertFalse(await self.switches[0].ais_enabled())
+
+    def test_forced_refresh(self):
+        self.assertTrue(self.switches[0].is_enabled())
+        Switch.objects.filter(name="test.active").update(active=False)
+        self.assertTrue(self.switches[0].is_enabled())
+        refresh_switch_table()
+        self.assertFalse(self.switches[0].is_enabled())
+
+    def test_refresh_on_read_after_interval(self):
+        with patch("edx_toggles.toggles.internal.waffle.switch_table.time.monotonic", return_value=0):
+            self.switches[0].is_enabled()
+        with patch("edx_toggles.toggles.internal.waffle.switch_table.time.monotonic", return_value=59):
+            self.switches[0].is_enabled()
+            self.assertEqual(59, get_switch_table_stats()["age"])
+        with patch("edx_toggles.toggles.internal.waffle.switch_table.time.monotonic", return_value=60):
+            self.switches[0].is_enabled()
+        self.assertEqual(2, get_switch_table_stats()["refreshes"])
+
+    @override_settings(EDX_TOGGLES_SWITCH_TABLE_REFRESH_INTERVAL=0.001, EDX_TOGGLES_BACKGROUND_THREADS=True)
+    def test_background_refresh(self):
+        refreshed_in_background = threading.Event()
+
+        def refresh():
+            if threading.current_thread().name == "edx_toggles.switch_table":
+                refreshed_in_background.set()
+            return {}
+
+        self.assertTrue(self.switches[0].is_enabled())
+        with patch.object(switch_table, "refresh", side_effect=refresh) as mock_refresh:
+            switch_table.invalidate()
+            self.switches[0].is_enabled()
+            self.assertTrue(refreshed_in_background.wait(5))
+            self.assertTrue(get_switch_table_stats()["background_refresh"])
+            switch_table.stop()
+        self.assertGreaterEqual(mock_refresh.call_count, 2)
+        self.assertFalse(get_switch_table_stats()["background_refresh"])
+
+    def test_no_background_thread_in_tests(self):
+        self.assertFalse(background_threads_enabled())
+        self.switches[0].is_enabled()
+        self.assertFalse(get_switch_table_stats()["background_refresh"])
+        with override_settings(EDX_TOGGLES_BACKGROUND_THREADS=True):
+            self.assertTrue(background_threads_enabled())
+        with patch("edx_toggles.toggles.internal.waffle.switch_table._is_test_environment", return_value=False):
+            self.assertTrue(background_threads_enabled())
+            with override_settings(EDX_TOGGLES_BACKGROUND_THREADS=False):
+                self.assertFalse(background_threads_enabled())
+
+    @override_settings(EDX_TOGGLES_SWITCH_TABLE_REFRESH_INTERVAL=None)
+    def test_disabled(self):
+        self.assertTrue(self.switches[0].is_enabled())
+        self.assertEqual({"test.active": True}, _get_waffle_request_cache()["switches"])
+        self.assertEqual(0, get_switch_table_stats()["refreshes"])
+
+
+@override_settings(
+    EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60,
+    EDX_TOGGLES_INVALIDATION_BACKEND="edx_toggles.toggles.internal.waffle.invalidation.LoopbackInvalidationBackend",
+)
+class InvalidationBusTests(TestCase):
+    """
+    Tests for the propagation of waffle modifications across processes.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        process_cache.clear()
+        invalidation_bus.reset_stats()
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        self.switch = WaffleSwitch("test.switch", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+
+    def test_eviction(self):
+        self.assertFalse(self.switch.is_enabled())
+        # Simulate a modification in another process, without signals
+        Switch.objects.bulk_create([Switch(name="test.switch", active=True)])
+        cache.clear()
+        RequestCache.clear_all_namespaces()
+        self.assertFalse(self.switch.is_enabled())
+        RequestCache.clear_all_namespaces()
+        invalidation_bus.publish("switch", "test.switch")
+        self.assertTrue(self.switch.is_enabled())
+        stats = get_invalidation_stats()
+        self.assertEqual(1, stats["published"])
+        self.assertEqual(1, stats["received"])
+        self.assertGreaterEqual(stats["max_latency"], 0)
+
+    def test_publish_on_save_and_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag = Flag.objects.create(name="test.flag", everyone=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            waffle_flag.delete()
+        self.assertEqual(2, get_invalidation_stats()["published"])
+
+    def test_restart_after_fork(self):
+        backend = invalidation_bus.backend
+        with patch.object(backend, "start", wraps=backend.start) as mock_start, patch(
+            "edx_toggles.toggles.internal.waffle.invalidation.os.getpid", return_value=-1
+        ):
+            invalidation_bus._after_fork()  # pylint: disable=protected-access
+            mock_start.assert_not_called()
+            request_started.send(sender=None)
+            request_started.send(sender=None)
+            mock_start.assert_called_once()
+        self.assertFalse(self.switch.is_enabled())
+        Switch.objects.bulk_create([Switch(name="test.switch", active=True)])
+        cache.clear()
+        RequestCache.clear_all_namespaces()
+        with patch("edx_toggles.toggles.internal.waffle.invalidation.os.getpid", return_value=-1):
+            invalidation_bus.publish("switch", "test.switch")
+        self.assertTrue(self.switch.is_enabled())
+
+    @override_settings(EDX_TOGGLES_INVALIDATION_BACKEND=None)
+    def test_disabled(self):
+        invalidation_bus.publish("switch", "test.switch")
+        stats = get_invalidation_stats()
+        self.assertFalse(stats["enabled"])
+        self.assertEqual(0, stats["published"])
+
+
+class DjangoCacheInvalidationBackendTests(TestCase):
+    """
+    Tests for the invalidation backend based on the Django cache.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.publisher = DjangoCacheInvalidationBackend(max_messages=3)
+        self.subscriber = DjangoCacheInvalidationBackend(max_messages=3)
+        self.received = []
+        self.subscriber.start(self.received.append)
+        self.addCleanup(self.subscriber.stop)
+
+    def publish(self, name):
+        """
+        Publish a message for a switch.
+        """
+        self.publisher.publish({"kind": "switch", "name": name, "published_at": time.time(), "origin": "publisher"})
+
+    def test_poll(self):
+        self.subscriber.poll()
+        self.assertEqual([], self.received)
+        self.publish("test.switch1")
+        self.publish("test.switch2")
+        self.subscriber.poll()
+        self.assertEqual(["test.switch1", "test.switch2"], [message["name"] for message in self.received])
+        self.subscriber.poll()
+        self.assertEqual(2, len(self.received))
+
+    def test_no_thread_in_tests(self):
+        self.assertIsNone(self.subscriber._thread)  # pylint: disable=protected-access
+
+    def test_lock_not_held_during_cache_calls(self):
+        self.publish("test.switch1")
+
+        def get_many(keys):
+            self.assertFalse(self.subscriber._lock.locked())  # pylint: disable=protected-access
+            return cache.get_many(keys)
+
+        with patch.object(DjangoCacheInvalidationBackend, "cache", Mock(get=cache.get, get_many=get_many)):
+            self.subscriber.poll()
+        self.assertEqual(["test.switch1"], [message["name"] for message in self.received])
+
+    def test_concurrent_poll(self):
+        self.publish("test.switch1")
+
+        def get_many(keys):
+            with patch.object(DjangoCacheInvalidationBackend, "cache", cache):
+                self.subscriber.poll()
+            return cache.get_many(keys)
+
+        with patch.object(DjangoCacheInvalidationBackend, "cache", Mock(get=cache.get, get_many=get_many)):
+            self.subscriber.poll()
+        self.assertEqual(1, len(self.received))
+
+    def test_after_fork(self):
+        # Simulate a lock that was held by a thread of the parent process
+        self.subscriber._lock.acquire()  # pylint: disable=protected-access,consider-using-with
+        self.subscriber.after_fork()
+        self.publish("test.switch1")
+        self.subscriber.poll()
+        self.assertEqual(1, len(self.received))
+
+    def test_too_many_messages(self):
+        for i in range(4):
+            self.publish(f"test.switch{i}")
+        self.subscriber.poll()
+        self.assertEqual([None], self.received)
+
+    def test_missing_message(self):
+        self.publish("test.switch1")
+        cache.delete("edx_toggles.invalidation.1")
+        self.publish("test.switch2")
+        with patch("edx_toggles.toggles.internal.waffle.invalidation.time.monotonic", return_value=0):
+            self.subscriber.poll()
+        self.assertEqual([], self.received)
+        with patch("edx_toggles.toggles.internal.waffle.invalidation.time.monotonic", return_value=5):
+            self.subscriber.poll()
+        self.assertEqual(None, self.received[0])
+        self.assertEqual("test.switch2", self.received[1]["name"])
+
+
+@override_settings(EDX_TOGGLES_PROCESS_CACHE_TIMEOUT=60, EDX_TOGGLES_USER_FLAG_MEMO_TIMEOUT=60)
+class UserFlagMemoTests(TestCase):
+    """
+    Tests for the memoization of flag values per user, across requests.
+    """
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        process_cache.clear()
+        user_flag_memo.clear()
+        user_flag_memo.reset_stats()
+        self.addCleanup(crum.set_current_request, None)
+        self.addCleanup(RequestCache.clear_all_namespaces)
+        self.user = User.objects.create(username="user")
+        self.group = Group.objects.create(name="group")
+        self.flag = WaffleFlag("test.flag", __name__)  # lint-amnesty, pylint: disable=toggle-missing-annotation
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waffle_flag = Flag.objects.create(name="test.flag", everyone=None)
+            self.waffle_flag.groups.add(self.group)
+
+    def start_request(self, user=None):
+        """
+        Simulate the start of a new request.
+        """
+        RequestCache.clear_all_namespaces()
+        request = RequestFactory().get("/")
+        request.user = user or self.user
+        crum.set_current_request(request)
+
+    def is_enabled(self, user=None):
+        """
+        Return the flag value in a new request, and the number of underlying flag evaluations.
+        """
+        self.start_request(user)
+        with patch.object(Flag, "is_active", autospec=True, side_effect=Flag.is_active) as mock_is_active:
+            value = self.flag.is_enabled()
+        return value, mock_is_active.call_count
+
+    def test_memoized_across_requests(self):
+        self.assertEqual((False, 1), self.is_enabled())
+        self.assertEqual((False, 0), self.is_enabled())
+        other_user = User.objects.create(username="other")
+        self.assertEqual((False, 1), self.is_enabled(other_user))
+        stats = user_flag_memo.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(2, stats["size"])
+
+    def test_user_attributes(self):
+        self.waffle_flag.staff = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waffle_flag.save()
+        self.assertEqual((False, 1), self.is_enabled())
+        self.user.is_staff = True
+        self.assertEqual((True, 1), self.is_enabled())
+
+    def test_invalidation_on_flag_change(self):
+        self.assertEqual((False, 1), self.is_enabled())
+        self.waffle_flag.authenticated = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waffle_flag.save()
+        self.assertEqual((True, 1), self.is_enabled())
+
+    def test_invalidation_on_group_change(self):
+        self.assertEqual((False, 1), self.is_enabled())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertEqual((True, 1), self.is_enabled())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.clear()
+        self.assertEqual((False, 1), self.is_enabled())
+
+    @override_settings(
+        EDX_TOGGLES_INVALIDATION_BACKEND="edx_toggles.toggles.internal.waffle.invalidation.LoopbackInvalidationBackend"
+    )
+    def test_invalidation_on_group_change_in_other_process(self):
+        self.assertEqual((False, 1), self.is_enabled())
+        # Simulate a modification in another process, without signals
+        User.groups.through.objects.create(user=self.user, group=self.group)
+        self.assertEqual((False, 0), self.is_enabled())
+        invalidation_bus.publish("user", self.user.pk)
+        self.assertEqual((True, 1), self.is_enabled())
+        User.groups.through.objects.all().delete()
+        invalidation_bus.publish("user", None)
+        self.assertEqual((False, 1), self.is_enabled())
+
+    @override_settings(
+        EDX_TOGGLES_INVALIDATION_BACKEND="edx_toggles.toggles.internal.waffle.invalidation.LoopbackInvalidationBackend"
+    )
+    def test_publish_on_group_change(self):
+        with patch.object(invalidation_bus, "publish") as mock_publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.user.groups.add(self.group)
+            mock_publish.assert_called_once_with("user", self.user.pk)
+            mock_publish.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.group.user_set.clear()
+            mock_publish.assert_called_once_with("user", None)
+
+    def test_not_memoized_for_request_dependent_flags(self):
+        self.waffle_flag.percent = 50
+        with self.captureOnCommitCallbacks(execute=True):
+            self.waffle_flag.save()
+        self.is_enabled()
+        self.assertEqual(1, self.is_enabled()[1])
+        self.assertEqual(0, user_flag_memo.stats()["size"])
+
+    def test_not_memoized_for_anonymous_users(self):
+        self.is_enabled(AnonymousUser())
+        self.assertEqual(1, self.is_enabled(AnonymousUser())[1])
+
+    @override_settings(EDX_TOGGLES_USER_FLAG_MEMO_TIMEOUT=None)
+    def test_disabled(self):
+        self.is_enabled()
+        self.assertEqual(1, self.is_enabled()[1])
+        self.assertFalse(user_flag_memo.stats()["enabled"])
@@ -1,6 +1,7 @@
 """
 Expose public feature toggle API.
 """
+from .internal.instrumentation import get_toggle_stats, get_top_call_sites, reset_toggle_stats
 from .internal.setting_toggle import SettingDictToggle, SettingToggle
 from .internal.waffle.flag import NonNamespacedWaffleFlag, WaffleFlag
 from .internal.waffle.switch import NonNamespacedWaffleSwitch, WaffleSwitch
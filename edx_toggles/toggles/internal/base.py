@@ -4,14 +4,20 @@ Feature toggle base classes
 
 from abc import ABC
 
+from asgiref.sync import sync_to_async
+
+from .registry import ToggleRegistry, toggle_registry
+
 
 class BaseToggle(ABC):
     """
     This abstract base class exposes the basic API required by toggle classes. Toggle instances are tracked in the
-    ``_class_instances`` class method, which is exposed via the ``get_instances`` class method.
+    ``_class_instances`` class attribute, which is exposed via the ``get_instances`` class method. All toggle instances,
+    across classes, are also tracked in the ``toggle_registry`` object.
     """
 
-    # Each child class should implement its own cache of class instances, for instance via WeakSet objects.
+    # Each child class should implement its own cache of class instances, for instance via ToggleRegistry objects.
+    # Other containers, such as WeakSet objects, are supported but slower.
     _class_instances = None
 
     def __init__(self, name, default=False, module_name=""):
@@ -20,6 +26,7 @@ class BaseToggle(ABC):
         self.default = default
         self.module_name = module_name
         self._class_instances.add(self)
+        toggle_registry.add(self)
 
     @classmethod
     def validate_name(cls, name):
@@ -31,9 +38,43 @@ class BaseToggle(ABC):
     def is_enabled(self):
         raise NotImplementedError
 
+    async def ais_enabled(self):
+        """
+        Async variant of ``is_enabled``, for use in async views. By default, ``is_enabled`` is called in a thread.
+        """
+        return await sync_to_async(self.is_enabled)()
+
     @classmethod
     def get_instances(cls):
         """
         Return the list of class instances sorted by name.
         """
-        return sorted(cls._class_instances, key=lambda instance: instance.name)
+        return cls._get_registry().get_instances()
+
+    @classmethod
+    def get_instance(cls, name):
+        """
+        Return the first class instance with this name, or None.
+        """
+        return cls._get_registry().get_instance(name)
+
+    @classmethod
+    def get_instances_by_module(cls, module_prefix):
+        """
+        Return the list of class instances sorted by name that were created in ``module_prefix`` or in one of its
+        submodules.
+        """
+        return cls._get_registry().get_instances_by_module(module_prefix)
+
+    @classmethod
+    def get_duplicate_names(cls):
+        """
+        Return the class instances that share their name with other instances, as a dict of lists indexed by name.
+        """
+        return cls._get_registry().get_duplicate_names()
+
+    @classmethod
+    def _get_registry(cls):
+        if isinstance(cls._class_instances, ToggleRegistry):
+            return cls._class_instances
+        return ToggleRegistry(cls._class_instances)
@@ -0,0 +1,301 @@
+"""
+Instrumentation of toggle evaluations.
+"""
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from edx_django_utils.cache import RequestCache
+from edx_django_utils.monitoring import set_custom_attribute
+
+# Upper bounds of the latency histogram buckets, in seconds. Evaluations that take longer than the last bound are
+# counted in an extra bucket.
+LATENCY_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1)
+
+
+class ToggleInstrumentation:
+    """
+    Collect per-toggle evaluation statistics: number of evaluations, latency, cache hits and misses per cache tier, and
+    number of waffle flag evaluations that happened outside of a request.
+
+    Toggles are identified by (kind, name, key) tuples, where kind is one of "flag", "switch", "setting" and
+    "setting_dict", and key is None except for setting dict toggles. Cache tiers are "request", "process", "user"
+    (for the per-user flag memo) and "no_request" (for flags that are evaluated outside of a request).
+
+    In addition, the call sites of a random sample of toggle evaluations can be recorded, to find out where redundant
+    or expensive evaluations come from. Call sites are aggregated per toggle and per calling module, line and function,
+    in a structure of bounded size: when it is full, the least sampled call site is replaced (this is the "Space-Saving"
+    algorithm, which keeps track of the most frequent call sites with bounded memory).
+
+    The instrumentation is configured with the following Django settings:
+
+        EDX_TOGGLES_INSTRUMENTATION: collect statistics (default: False). When this setting is False, the overhead of
+            the instrumentation is limited to a single boolean check per evaluation.
+        EDX_TOGGLES_INSTRUMENTATION_CUSTOM_ATTRIBUTES: additionally report the number of toggle evaluations of each
+            request, and their cumulative duration, as the "edx_toggles.evaluations" and
+            "edx_toggles.evaluation_seconds" monitoring custom attributes (default: False).
+        EDX_TOGGLES_CALL_SITE_SAMPLE_RATE: fraction of the toggle evaluations whose call site is recorded, between 0
+            (default) and 1. This does not require EDX_TOGGLES_INSTRUMENTATION to be True.
+        EDX_TOGGLES_CALL_SITE_MAX_ENTRIES: maximum number of recorded (toggle, call site) pairs (default: 1000).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._enabled = False
+        self._custom_attributes = False
+        self._sample_rate = 0.0
+        self._max_call_sites = 1000
+        self._call_sites = {}
+        self._active = False
+        self._configured = False
+
+    def configure(self):
+        """
+        (Re-)load the instrumentation configuration from the Django settings. Statistics are preserved.
+        """
+        self._enabled = bool(getattr(settings, "EDX_TOGGLES_INSTRUMENTATION", False))
+        self._custom_attributes = self._enabled and bool(
+            getattr(settings, "EDX_TOGGLES_INSTRUMENTATION_CUSTOM_ATTRIBUTES", False)
+        )
+        self._sample_rate = float(getattr(settings, "EDX_TOGGLES_CALL_SITE_SAMPLE_RATE", 0) or 0)
+        self._max_call_sites = getattr(settings, "EDX_TOGGLES_CALL_SITE_MAX_ENTRIES", 1000)
+        self._active = self._enabled or self._sample_rate > 0
+        self._configured = True
+
+    @property
+    def enabled(self):
+        if not self._configured:
+            self.configure()
+        return self._enabled
+
+    @property
+    def active(self):
+        """
+        Whether statistics are collected or call sites are sampled.
+        """
+        if not self._configured:
+            self.configure()
+        return self._active
+
+    @property
+    def sample_rate(self):
+        if not self._configured:
+            self.configure()
+        return self._sample_rate
+
+    def set_sample_rate(self, sample_rate):
+        """
+        Override the call site sample rate until the next configuration reload.
+        """
+        if not self._configured:
+            self.configure()
+        self._sample_rate = sample_rate
+        self._active = self._enabled or sample_rate > 0
+
+    def record_evaluation(self, kind, name, key, duration):
+        """
+        Record a toggle evaluation that took ``duration`` seconds.
+        """
+        with self._lock:
+            stats = self._get_toggle_stats(kind, name, key)
+            stats["evaluations"] += 1
+            stats["total_seconds"] += duration
+            stats["histogram"][bisect_left(LATENCY_BUCKETS, duration)] += 1
+        if self._custom_attributes:
+            request_stats = RequestCache("edx_toggles.instrumentation").data
+            request_stats["evaluations"] = request_stats.get("evaluations", 0) + 1
+            request_stats["evaluation_seconds"] = request_stats.get("evaluation_seconds", 0.0) + duration
+            set_custom_attribute("edx_toggles.evaluations", request_stats["evaluations"])
+            set_custom_attribute("edx_toggles.evaluation_seconds", request_stats["evaluation_seconds"])
+
+    def record_cache_access(self, kind, name, tier, hit):
+        """
+        Record a cache hit or miss for a toggle. This is a no-op when the instrumentation is disabled.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            tier_stats = self._get_toggle_stats(kind, name, None)["cache"].setdefault(tier, {"hits": 0, "misses": 0})
+            tier_stats["hits" if hit else "misses"] += 1
+
+    def record_no_request(self, name):
+        """
+        Record the evaluation of a waffle flag outside of a request. This is a no-op when the instrumentation is
+        disabled.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._get_toggle_stats("flag", name, None)["no_request"] += 1
+
+    def sample_call_site(self, kind, name, key, frame):
+        """
+        Record the call site of a toggle evaluation, with probability ``sample_rate``. ``frame`` is the frame of the
+        caller of ``is_enabled``. Frames of toggle methods, including ``is_enabled`` methods of child classes, are
+        skipped, such that the evaluation is attributed to the code that needs the toggle value.
+        """
+        # The rate is read once, since it might be modified concurrently, e.g: by the toggle_call_sites command
+        sample_rate = self._sample_rate
+        if sample_rate <= 0 or random.random() >= sample_rate:
+            return
+        while frame is not None and _is_toggle_frame(frame):
+            frame = frame.f_back
+        if frame is None:
+            return
+        call_site = (
+            kind, name, key, frame.f_globals.get("__name__", ""), frame.f_lineno, frame.f_code.co_name
+        )
+        with self._lock:
+            counts = self._call_sites.get(call_site)
+            if counts is None:
+                if len(self._call_sites) >= self._max_call_sites:
+                    # Replace the least sampled call site, and inherit its counts, which are upper bounds to the number
+                    # of times the new call site was previously sampled
+                    least_sampled = min(self._call_sites, key=lambda site: self._call_sites[site][0])
+                    counts = self._call_sites.pop(least_sampled)
+                else:
+                    counts = [0, 0.0]
+                self._call_sites[call_site] = counts
+            # Number of samples, and estimated number of calls
+            counts[0] += 1
+            counts[1] += 1 / sample_rate
+
+    def get_top_call_sites(self, limit=10):
+        """
+        Return the ``limit`` most sampled (toggle, call site) pairs, in decreasing order of samples. Each item is a dict
+        with the following entries: "kind", "name", "key", "module", "lineno", "function", "samples" and
+        "estimated_calls", which is the sum of the inverse sample rates at the time of the samples.
+        """
+        with self._lock:
+            top_call_sites = sorted(self._call_sites.items(), key=lambda item: item[1][0], reverse=True)[:limit]
+            call_sites = [(call_site, tuple(counts)) for call_site, counts in top_call_sites]
+        return [
+            {
+                "kind": kind,
+                "name": name,
+                "key": key,
+                "module": module,
+                "lineno": lineno,
+                "function": function,
+                "samples": samples,
+                "estimated_calls": round(estimated_calls),
+            }
+            for (kind, name, key, module, lineno, function), (samples, estimated_calls) in call_sites
+        ]
+
+    def get_stats(self):
+        """
+        Return the list of per-toggle statistics, sorted by kind, name and key. Each item is a dict with the following
+        entries: "kind", "name", "key", "evaluations", "total_seconds", "histogram" (list of evaluation counts, with one
+        item per LATENCY_BUCKETS bound plus one for slower evaluations), "cache" (dict of {"hits", "misses"} dicts
+        indexed by cache tier) and "no_request".
+        """
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: (item[0][0], item[0][1], str(item[0][2])))
+            return [
+                dict(
+                    stats,
+                    histogram=list(stats["histogram"]),
+                    cache={tier: dict(tier_stats) for tier, tier_stats in stats["cache"].items()},
+                )
+                for _stats_key, stats in items
+            ]
+
+    def reset(self):
+        """
+        Drop all statistics and call sites.
+        """
+        with self._lock:
+            self._stats.clear()
+            self._call_sites.clear()
+
+    def _get_toggle_stats(self, kind, name, key):
+        """
+        Return the mutable statistics of a toggle. This must be called with the lock held.
+        """
+        stats_key = (kind, name, key)
+        stats = self._stats.get(stats_key)
+        if stats is None:
+            stats = self._stats[stats_key] = {
+                "kind": kind,
+                "name": name,
+                "key": key,
+                "evaluations": 0,
+                "total_seconds": 0.0,
+                "histogram": [0] * (len(LATENCY_BUCKETS) + 1),
+                "cache": {},
+                "no_request": 0,
+            }
+        return stats
+
+
+instrumentation = ToggleInstrumentation()
+
+
+def instrumented(kind):
+    """
+    Decorator for the ``is_enabled`` method of toggle classes, which records evaluations of the given toggle kind.
+    """
+    def decorator(is_enabled):
+        @wraps(is_enabled)
+        def wrapper(toggle):
+            if not instrumentation.active:
+                return is_enabled(toggle)
+            if instrumentation.sample_rate:
+                caller_frame = sys._getframe(1)  # pylint: disable=protected-access
+                instrumentation.sample_call_site(kind, toggle.name, getattr(toggle, "key", None), caller_frame)
+            if not instrumentation.enabled:
+                return is_enabled(toggle)
+            start = time.perf_counter()
+            value = is_enabled(toggle)
+            duration = time.perf_counter() - start
+            instrumentation.record_evaluation(kind, toggle.name, getattr(toggle, "key", None), duration)
+            return value
+        return wrapper
+    return decorator
+
+
+def _is_toggle_frame(frame):
+    """
+    Return whether a frame belongs to a toggle method rather than to the code that evaluates the toggle.
+    """
+    return frame.f_code.co_name == "is_enabled" or frame.f_globals.get("__name__", "").startswith(
+        "edx_toggles.toggles.internal."
+    )
+
+
+def get_toggle_stats():
+    """
+    Return the per-toggle evaluation statistics. See ``ToggleInstrumentation.get_stats``.
+    """
+    return instrumentation.get_stats()
+
+
+def get_top_call_sites(limit=10):
+    """
+    Return the most frequently sampled toggle call sites. See ``ToggleInstrumentation.get_top_call_sites``.
+    """
+    return instrumentation.get_top_call_sites(limit)
+
+
+def reset_toggle_stats():
+    """
+    Drop all toggle evaluation statistics and sampled call sites.
+    """
+    instrumentation.reset()
+
+
+@receiver(setting_changed)
+def _reconfigure_instrumentation(setting, **kwargs):
+    """
+    Reload the instrumentation configuration whenever the corresponding settings are modified, e.g: in tests.
+    """
+    if setting.startswith(("EDX_TOGGLES_INSTRUMENTATION", "EDX_TOGGLES_CALL_SITE_")):
+        instrumentation.configure()
@@ -0,0 +1,157 @@
+"""
+Registry of toggle instances.
+"""
+import threading
+from bisect import bisect_left, insort
+from weakref import ref
+
+
+class ToggleRegistry:
+    """
+    Weak registry of toggle instances, indexed by name and kept sorted by name.
+
+    Like a ``WeakSet``, the registry does not prevent toggle instances from being garbage-collected. Instances are
+    removed from the registry as soon as they are collected. Contrary to a ``WeakSet``, lookup by name is O(1) and
+    listing the sorted instances does not require sorting them again on every call. Multiple instances may share the
+    same name: these are reported by ``get_duplicate_names``.
+    """
+
+    def __init__(self, instances=()):
+        self._lock = threading.Lock()
+        # Weak references to instances, indexed by name, in order of creation
+        self._refs_by_name = {}
+        self._names_by_ref = {}
+        self._sorted_names = []
+        # Cache of the weak references to all instances, sorted by name, invalidated whenever the registry is modified.
+        # We do not cache the instances themselves, as that would prevent them from being collected.
+        self._sorted_refs = None
+        # Weak references to collected instances. Like in WeakSet, we do not modify the registry from within the
+        # weakref callbacks, as these can be triggered at any time by the garbage collector, including while the lock
+        # is held by the same thread.
+        self._pending_removals = []
+        # Incremented whenever instances are added or removed
+        self._version = 0
+
+        def _remove(instance_ref, self_ref=ref(self)):
+            registry = self_ref()
+            if registry is not None:
+                registry._pending_removals.append(instance_ref)  # pylint: disable=protected-access
+
+        self._remove = _remove
+        for instance in instances:
+            self.add(instance)
+
+    def add(self, instance):
+        """
+        Register a toggle instance.
+        """
+        with self._lock:
+            self._commit_removals()
+            instance_ref = ref(instance, self._remove)
+            refs = self._refs_by_name.get(instance.name)
+            if refs is None:
+                refs = self._refs_by_name[instance.name] = []
+                insort(self._sorted_names, instance.name)
+            refs.append(instance_ref)
+            self._names_by_ref[instance_ref] = instance.name
+            self._sorted_refs = None
+            self._version += 1
+
+    def get_instances(self):
+        """
+        Return the list of registered instances sorted by name. Instances with identical names are listed in order of
+        creation.
+        """
+        with self._lock:
+            self._commit_removals()
+            if self._sorted_refs is None:
+                self._sorted_refs = tuple(
+                    instance_ref
+                    for name in self._sorted_names
+                    for instance_ref in self._refs_by_name[name]
+                )
+            instances = [instance_ref() for instance_ref in self._sorted_refs]
+        return [instance for instance in instances if instance is not None]
+
+    def get_instance(self, name):
+        """
+        Return the first registered instance with this name, or None.
+        """
+        with self._lock:
+            self._commit_removals()
+            for instance in self._live_instances(name):
+                return instance
+            return None
+
+    def get_instances_by_module(self, module_prefix):
+        """
+        Return the sorted list of instances that were created in the module ``module_prefix`` or in one of its
+        submodules.
+        """
+        submodule_prefix = module_prefix + "."
+        return [
+            instance
+            for instance in self.get_instances()
+            if instance.module_name == module_prefix or instance.module_name.startswith(submodule_prefix)
+        ]
+
+    def get_duplicate_names(self):
+        """
+        Return the instances that share their name with other instances, as a dict of lists indexed by name.
+        """
+        with self._lock:
+            self._commit_removals()
+            duplicates = {}
+            for name, refs in self._refs_by_name.items():
+                if len(refs) > 1:
+                    instances = list(self._live_instances(name))
+                    if len(instances) > 1:
+                        duplicates[name] = instances
+            return duplicates
+
+    @property
+    def version(self):
+        """
+        Number that changes whenever instances are added to or removed from the registry.
+        """
+        with self._lock:
+            self._commit_removals()
+            return self._version
+
+    def __iter__(self):
+        return iter(self.get_instances())
+
+    def __len__(self):
+        with self._lock:
+            self._commit_removals()
+            return len(self._names_by_ref)
+
+    def _live_instances(self, name):
+        """
+        Iterate on the instances with this name that were not yet collected.
+        """
+        for instance_ref in self._refs_by_name.get(name, ()):
+            instance = instance_ref()
+            if instance is not None:
+                yield instance
+
+    def _commit_removals(self):
+        """
+        Remove the weak references to collected instances. This must be called with the lock held.
+        """
+        while self._pending_removals:
+            instance_ref = self._pending_removals.pop()
+            name = self._names_by_ref.pop(instance_ref, None)
+            if name is None:
+                continue
+            refs = self._refs_by_name[name]
+            refs.remove(instance_ref)
+            if not refs:
+                del self._refs_by_name[name]
+                del self._sorted_names[bisect_left(self._sorted_names, name)]
+            self._sorted_refs = None
+            self._version += 1
+
+
+# Registry of all toggle instances, across all toggle classes
+toggle_registry = ToggleRegistry()
@@ -1,11 +1,22 @@
 """
 Setting-derived feature toggles
 """
-from weakref import WeakSet
+from types import MappingProxyType
 
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 
 from .base import BaseToggle
+from .instrumentation import instrumented
+from .registry import ToggleRegistry
+
+# Frozen lookup table of setting toggle values, indexed by (setting name, dict key) tuples, where the key is None for
+# SettingToggle instances. This is None when the snapshot mode is disabled.
+_settings_snapshot = None
+
+# Value stored in the snapshot for absent settings: in that case, the toggle default value is used.
+_ABSENT = object()
 
 
 class SettingToggle(BaseToggle):
@@ -15,11 +26,29 @@ class SettingToggle(BaseToggle):
         MY_FEATURE = SettingToggle("SETTING_NAME", default=False, module_name=__name__)
     """
 
-    _class_instances = WeakSet()
+    _class_instances = ToggleRegistry()
 
+    @instrumented("setting")
     def is_enabled(self):
+        # The snapshot is read once, since it might be rebuilt concurrently
+        snapshot = _settings_snapshot
+        if snapshot is not None:
+            return _get_snapshot_value(self, snapshot, (self.name, None))
         return bool(getattr(settings, self.name, self.default))
 
+    async def ais_enabled(self):
+        """
+        Async variant of ``is_enabled``. Setting values are read without performing any I/O.
+        """
+        return self.is_enabled()
+
+    def _get_setting_value(self):
+        """
+        Return the boolean setting value, or _ABSENT.
+        """
+        value = getattr(settings, self.name, _ABSENT)
+        return value if value is _ABSENT else bool(value)
+
 
 class SettingDictToggle(BaseToggle):
     """
@@ -28,12 +57,75 @@ class SettingDictToggle(BaseToggle):
         MY_FEATURE = SettingDictToggle("SETTING_NAME", "key" default=False, module_name=__name__)
     """
 
-    _class_instances = WeakSet()
+    _class_instances = ToggleRegistry()
 
     def __init__(self, name, key, default=False, module_name=""):
         super().__init__(name, default=default, module_name=module_name)
         self.key = key
 
+    @instrumented("setting_dict")
     def is_enabled(self):
+        # The snapshot is read once, since it might be rebuilt concurrently
+        snapshot = _settings_snapshot
+        if snapshot is not None:
+            return _get_snapshot_value(self, snapshot, (self.name, self.key))
         setting_dict = getattr(settings, self.name, {})
         return bool(setting_dict.get(self.key, self.default))
+
+    async def ais_enabled(self):
+        """
+        Async variant of ``is_enabled``. Setting values are read without performing any I/O.
+        """
+        return self.is_enabled()
+
+    def _get_setting_value(self):
+        """
+        Return the boolean setting dict value, or _ABSENT.
+        """
+        value = getattr(settings, self.name, {}).get(self.key, _ABSENT)
+        return value if value is _ABSENT else bool(value)
+
+
+def build_settings_snapshot():
+    """
+    Resolve the values of all registered setting toggles into a frozen lookup table, which is then used by the
+    ``is_enabled`` methods. This is a no-op unless the ``EDX_TOGGLES_SETTINGS_SNAPSHOT`` setting is True.
+
+    The snapshot is built when the edx_toggles app is ready, and it is rebuilt whenever a setting is modified, e.g: with
+    ``override_settings``. Toggles that are created later are added by rebuilding the snapshot on first access.
+
+    Returns the new snapshot, or None if the snapshot mode is disabled.
+    """
+    global _settings_snapshot  # pylint: disable=global-statement
+    if not getattr(settings, "EDX_TOGGLES_SETTINGS_SNAPSHOT", False):
+        _settings_snapshot = None
+        return None
+    values = {}
+    for toggle in SettingToggle.get_instances():
+        values[(toggle.name, None)] = toggle._get_setting_value()  # pylint: disable=protected-access
+    for toggle in SettingDictToggle.get_instances():
+        values[(toggle.name, toggle.key)] = toggle._get_setting_value()  # pylint: disable=protected-access
+    _settings_snapshot = snapshot = MappingProxyType(values)
+    return snapshot
+
+
+def _get_snapshot_value(toggle, snapshot, snapshot_key):
+    """
+    Return the toggle value from the snapshot, which is rebuilt if the toggle was created after the snapshot.
+    """
+    value = snapshot.get(snapshot_key)
+    if value is None:
+        snapshot = build_settings_snapshot()
+        value = snapshot.get(snapshot_key) if snapshot is not None else None
+        if value is None:
+            # The snapshot mode was disabled in the meantime
+            value = toggle._get_setting_value()  # pylint: disable=protected-access
+    return bool(toggle.default) if value is _ABSENT else value
+
+
+@receiver(setting_changed)
+def _rebuild_settings_snapshot(**kwargs):
+    """
+    Rebuild the setting toggles snapshot whenever a setting is modified, e.g: in tests.
+    """
+    build_settings_snapshot()
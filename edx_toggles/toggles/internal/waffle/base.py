@@ -4,7 +4,11 @@ Base waffle toggle classes.
 
 import logging
 
+from django.db import router
+from waffle.utils import get_setting
+
 from ..base import BaseToggle
+from .cache import shared_cache
 
 logger = logging.getLogger(__name__)
 
@@ -40,3 +44,20 @@ class BaseWaffle(BaseToggle):
             logger.error(
                 f"{cls.__name__} instance name should not include a blank space prefix or suffix: '{name}'"
             )
+
+
+def _get_many_waffle_objects(model, names):
+    """
+    Fetch waffle Flag or Switch objects in a single query, or from the shared cache if enabled, indexed by name. Like
+    waffle's ``get`` method, missing objects are replaced by unsaved instances, such that their ``is_active`` method
+    returns the default value.
+    """
+    if not names:
+        return {}
+    if shared_cache.enabled:
+        return {name: shared_cache.get_object(model, name) for name in names}
+    objects = model.objects
+    if get_setting("READ_FROM_WRITE_DB"):
+        objects = objects.using(router.db_for_write(model))
+    fetched = {obj.name: obj for obj in objects.filter(name__in=names)}
+    return {name: fetched.get(name) or model(name=name) for name in names}
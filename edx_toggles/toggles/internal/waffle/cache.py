@@ -1,11 +1,624 @@
 """
 Caching utilities for waffle toggles.
 """
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+from uuid import uuid4
+
+import crum
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
 from edx_django_utils.cache import RequestCache
 
+from ..instrumentation import instrumentation
+
+log = logging.getLogger(__name__)
+
+# Returned by ToggleProcessCache.get when a key is absent, expired or when the cache is disabled. We cannot use None,
+# because None is a legitimate cached value.
+MISSING = object()
+
 
 def _get_waffle_request_cache():
     """
     Returns a request cache shared by all Waffle objects.
     """
     return RequestCache("WaffleNamespace").data
+
+
+class ToggleContext:
+    """
+    Per-request toggle state, stored in a context variable. Contrary to the thread-local request cache, the context is
+    isolated across concurrent requests that are served by the same thread, e.g: in ASGI servers, and it is shared by
+    all the asyncio tasks that are created while serving a request. Greenlets also have their own context (with
+    greenlet>=0.4.17), so gevent workers are supported as well.
+
+    When a context is set, both ``is_enabled`` and ``ais_enabled`` read the current request and the cached flag and
+    switch values from the context, instead of django-crum and the request cache: a cache hit is then a single dict
+    lookup. Otherwise, ``is_enabled`` falls back to the thread-local request cache.
+
+    The context is set by ``ToggleContextMiddleware``, or with the ``toggle_context`` context manager.
+    """
+
+    def __init__(self, request=None):
+        self.request = request
+        # Flag and switch values, indexed by name
+        self.flags = {}
+        self.switches = {}
+        # Futures of the values that are being loaded, indexed by name, in dicts indexed by kind ("flags" or "switches")
+        self._pending = {}
+        self._flush_tasks = set()
+
+    async def load(self, kind, name, load_many):
+        """
+        Return the value of a flag or switch. Concurrent calls are batched: the values of all names that are requested
+        before the event loop gets a chance to run the batch are loaded with a single ``await load_many(names)`` call,
+        which must return a dict of values indexed by name. Values are then stored in the ``flags`` or ``switches``
+        dict, depending on ``kind``. The value of a name that is missing from the result is None.
+        """
+        pending = self._pending.setdefault(kind, {})
+        future = pending.get(name)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = pending[name] = loop.create_future()
+            if len(pending) == 1:
+                # The flush task runs after all the tasks that are already scheduled, which may add names to the batch
+                task = loop.create_task(self._flush(kind, load_many))
+                self._flush_tasks.add(task)
+                task.add_done_callback(self._flush_tasks.discard)
+        return await future
+
+    async def _flush(self, kind, load_many):
+        """
+        Load the values of a batch of names, and resolve the corresponding futures.
+        """
+        pending = self._pending.pop(kind)
+        try:
+            values = await load_many(list(pending))
+            getattr(self, kind).update(values)
+            for name, future in pending.items():
+                # Awaiters might have been cancelled
+                if not future.done():
+                    future.set_result(values.get(name))
+        except Exception as e:  # pylint: disable=broad-except
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Never leave awaiters hanging, e.g: when the flush task itself is cancelled
+            for future in pending.values():
+                if not future.done():
+                    future.cancel()
+
+
+_toggle_context = ContextVar("edx_toggles_toggle_context", default=None)
+
+
+def get_toggle_context():
+    """
+    Return the toggle context of the current request, or None.
+    """
+    return _toggle_context.get()
+
+
+@contextmanager
+def toggle_context(request=None):
+    """
+    Set a new toggle context for the duration of the ``with`` block.
+    """
+    context = ToggleContext(request)
+    token = _toggle_context.set(context)
+    try:
+        yield context
+    finally:
+        _toggle_context.reset(token)
+
+
+class ToggleProcessCache:
+    """
+    Thread-safe, size-bounded cache with a time-to-live, shared by all requests that are served by the same process.
+
+    This cache sits under the request cache: it is only hit when a toggle value is not already cached for the current
+    request. Entries expire ``timeout`` seconds after they were stored, such that the staleness of a cached value is
+    bounded even when a toggle is modified in a different process. Entries are also invalidated whenever a waffle
+    Flag or Switch object is saved or deleted in the current process (see ``signals.py``). The least recently used
+    entries are evicted when ``max_size`` is reached.
+
+    The cache is configured with the following Django settings, where the prefix is "EDX_TOGGLES_PROCESS_CACHE_" by
+    default:
+
+        <prefix>TIMEOUT: time-to-live of cache entries, in seconds. The cache is disabled when this setting is None
+            (default) or 0.
+        <prefix>MAX_SIZE: maximum number of cached entries (default: 10000).
+
+    Keys are tuples whose first two items are the toggle kind and name. Cache hits and misses are recorded in the
+    toggle instrumentation under the ``tier`` name.
+    """
+
+    def __init__(self, setting_prefix="EDX_TOGGLES_PROCESS_CACHE_", tier="process"):
+        self.setting_prefix = setting_prefix
+        self.tier = tier
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._timeout = None
+        self._max_size = None
+        self._configured = False
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    def configure(self):
+        """
+        (Re-)load the cache configuration from the Django settings. Cached entries are dropped.
+        """
+        with self._lock:
+            self._timeout = getattr(settings, f"{self.setting_prefix}TIMEOUT", None) or None
+            self._max_size = getattr(settings, f"{self.setting_prefix}MAX_SIZE", 10000)
+            self._data.clear()
+            self._configured = True
+
+    @property
+    def enabled(self):
+        if not self._configured:
+            self.configure()
+        return self._timeout is not None
+
+    def get(self, key):
+        """
+        Return the cached value, or MISSING.
+        """
+        if not self.enabled:
+            return MISSING
+        with self._lock:
+            value = self._get(key)
+        instrumentation.record_cache_access(key[0], key[1], self.tier, value is not MISSING)
+        return value
+
+    def _get(self, key):
+        """
+        Return the cached value, or MISSING. This must be called with the lock held.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            self._misses += 1
+            return MISSING
+        value, stored_at = entry
+        if time.monotonic() - stored_at >= self._timeout:
+            del self._data[key]
+            self._expirations += 1
+            self._misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def set(self, key, value):
+        """
+        Store a value in the cache, evicting the least recently used entries if necessary.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self._max_size:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, key):
+        """
+        Invalidate a single cache entry.
+        """
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self._invalidations += 1
+
+    def delete_matching(self, predicate):
+        """
+        Invalidate the cache entries whose key matches ``predicate``. This scans all entries, so it should only be
+        called on rare events, such as modifications of waffle objects.
+        """
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            self._invalidations += len(keys)
+
+    def clear(self):
+        """
+        Invalidate all cache entries.
+        """
+        with self._lock:
+            self._invalidations += len(self._data)
+            self._data.clear()
+
+    def reset_stats(self):
+        """
+        Reset all statistics counters to zero.
+        """
+        with self._lock:
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+            self._expirations = 0
+            self._invalidations = 0
+
+    def stats(self):
+        """
+        Return a dict of cache statistics. "max_age" is the age, in seconds, of the oldest cached entry: it is an upper
+        bound to the staleness of the values that are currently returned by the cache.
+        """
+        enabled = self.enabled
+        with self._lock:
+            now = time.monotonic()
+            max_age = max((now - stored_at for _value, stored_at in self._data.values()), default=0.0)
+            return {
+                "enabled": enabled,
+                "timeout": self._timeout,
+                "max_size": self._max_size,
+                "size": len(self._data),
+                "max_age": max_age,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations,
+            }
+
+
+# Process-wide cache of waffle switch values and waffle Flag objects. Keys are ("switch", name) and ("flag", name)
+# tuples. Flag values cannot be cached across requests, because they depend on the request user, but the Flag objects
+# can.
+process_cache = ToggleProcessCache()
+
+
+def get_process_cache_stats():
+    """
+    Return the statistics of the process-wide waffle cache.
+    """
+    return process_cache.stats()
+
+
+# Process-wide memo of the flag values of each user, for flags whose value only depends on the request user (see
+# ``WaffleFlag``). It is configured with the EDX_TOGGLES_USER_FLAG_MEMO_TIMEOUT and EDX_TOGGLES_USER_FLAG_MEMO_MAX_SIZE
+# settings, and it is disabled by default. Keys are ("flag", name, user id, is_authenticated, is_staff, is_superuser,
+# flag modification time) tuples.
+user_flag_memo = ToggleProcessCache("EDX_TOGGLES_USER_FLAG_MEMO_", tier="user")
+
+
+def is_flag_key(flag_name, key):
+    """
+    Return whether a key of the per-user flag memo belongs to a flag.
+    """
+    return key[1] == flag_name
+
+
+def is_user_key(user_id, key):
+    """
+    Return whether a key of the per-user flag memo belongs to a user.
+    """
+    return key[2] == user_id
+
+
+def get_user_flag_memo_stats():
+    """
+    Return the statistics of the per-user waffle flag memo.
+    """
+    return user_flag_memo.stats()
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent lookups of the same key, such that a single lookup is performed at a time.
+
+    Within a process, threads that request a key while a lookup of that key is in flight wait for its result instead
+    of performing their own lookup. Across processes, ``do_with_lock`` coordinates lookups through a short-lived lock
+    in a Django cache backend.
+    """
+
+    # Interval between two checks of the result of a lookup performed by another process, in seconds
+    poll_interval = 0.05
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._coalesced = 0
+        self._lock_waits = 0
+
+    def do(self, key, func):
+        """
+        Return the result of ``func()``, or wait for the result of the call that is already in flight for this key.
+        Exceptions are raised in all waiting threads.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+            else:
+                self._coalesced += 1
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def do_with_lock(self, cache, lock_key, get, compute, lock_timeout):
+        """
+        Return the result of ``compute()`` while holding a lock in ``cache``. If another process holds the lock, wait
+        until ``get()`` returns its result (i.e: a value that is not None). ``compute`` is called anyway, without the
+        lock, if the lock is released without a result, or after ``lock_timeout`` seconds, in case the other process
+        died while holding the lock.
+        """
+        acquired = cache.add(lock_key, True, lock_timeout)
+        if not acquired:
+            with self._lock:
+                self._lock_waits += 1
+            deadline = time.monotonic() + lock_timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                value = get()
+                if value is not None:
+                    return value
+                if cache.get(lock_key) is None:
+                    # The lock was released without a result, e.g: after an error in the other process, or because the
+                    # result could not be stored. Waiting any longer would not help.
+                    break
+        try:
+            return compute()
+        finally:
+            if acquired:
+                cache.delete(lock_key)
+
+    def reset_stats(self):
+        """
+        Reset all statistics counters to zero.
+        """
+        with self._lock:
+            self._coalesced = 0
+            self._lock_waits = 0
+
+    def stats(self):
+        """
+        Return a dict of statistics. "coalesced" is the number of lookups that waited for a lookup in the same process,
+        and "lock_waits" the number of lookups that waited for a lookup in a different process.
+        """
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "coalesced": self._coalesced,
+                "lock_waits": self._lock_waits,
+            }
+
+
+class _Call:
+    """
+    Lookup in flight, for SingleFlight.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Coalesces the concurrent lookups of waffle objects that are missing from the caches
+single_flight = SingleFlight()
+
+
+def get_single_flight_stats():
+    """
+    Return the statistics of the coalesced waffle lookups.
+    """
+    return single_flight.stats()
+
+
+class ToggleSharedCache:
+    """
+    Cache of all the objects of a waffle model, stored as a single versioned entry in a Django cache backend that is
+    shared by all processes.
+
+    The objects of each model are stored under a key that includes a version number, which is itself stored in the
+    cache. The version is changed whenever an object is saved or deleted (see ``signals.py``), such that the objects are
+    then fetched again from the database by the first process that needs them. Processes keep a copy of the latest
+    version that they fetched, so that a cache miss costs a single cache lookup as long as the version does not change.
+    The version is looked up at most once per request, and on every lookup outside of requests, e.g: in Celery tasks
+    and management commands, where the request cache is never cleared. When the objects are missing from the cache, a
+    single thread per process fetches them, and processes wait for each other through a lock in the cache backend.
+
+    The cache is configured with the following Django settings:
+
+        EDX_TOGGLES_SHARED_CACHE_ALIAS: name of the Django cache backend. The shared cache is disabled when this setting
+            is None (default).
+        EDX_TOGGLES_SHARED_CACHE_TIMEOUT: time-to-live of cache entries, in seconds (default: 300).
+        EDX_TOGGLES_SHARED_CACHE_LOCK_TIMEOUT: maximum time during which a process waits for the objects that are
+            being fetched by another process, in seconds (default: 5).
+        EDX_TOGGLES_SHARED_CACHE_CHUNK_SIZE: maximum number of objects per cache entry (default: 500). Objects are
+            stored in chunks, such that each entry remains under the item size limit of the cache backend, e.g: 1 MB
+            for memcached.
+
+    If the objects cannot be stored, e.g: because a chunk is still too large, a warning is logged, and each process
+    fetches the objects from the database once per version.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._alias = None
+        self._timeout = None
+        self._lock_timeout = None
+        self._chunk_size = None
+        self._configured = False
+        # Latest fetched (version, objects) tuples, indexed by model label
+        self._local_objects = {}
+
+    def configure(self):
+        """
+        (Re-)load the cache configuration from the Django settings.
+        """
+        with self._lock:
+            self._alias = getattr(settings, "EDX_TOGGLES_SHARED_CACHE_ALIAS", None)
+            self._timeout = getattr(settings, "EDX_TOGGLES_SHARED_CACHE_TIMEOUT", 300)
+            self._lock_timeout = getattr(settings, "EDX_TOGGLES_SHARED_CACHE_LOCK_TIMEOUT", 5)
+            self._chunk_size = getattr(settings, "EDX_TOGGLES_SHARED_CACHE_CHUNK_SIZE", 500)
+            self._local_objects.clear()
+            self._configured = True
+
+    @property
+    def enabled(self):
+        if not self._configured:
+            self.configure()
+        return self._alias is not None
+
+    def get_object(self, model, name):
+        """
+        Return a single waffle object. Like in waffle's ``get`` method, missing objects are replaced by unsaved
+        instances.
+        """
+        return self.get_objects(model).get(name) or model(name=name)
+
+    def get_objects(self, model):
+        """
+        Return all the objects of a waffle model, indexed by name. The returned dict should not be modified.
+        """
+        label = model._meta.label_lower  # pylint: disable=protected-access
+        request_objects = _get_shared_objects_memo()
+        if request_objects is not None and label in request_objects:
+            return request_objects[label]
+
+        cache = caches[self._alias]
+        version = self._get_version(cache, label)
+        local_version, objects = self._local_objects.get(label, (None, None))
+        if local_version != version:
+            objects_key = f"edx_toggles.{label}.{version}"
+            objects = self._load_objects(cache, objects_key)
+            if objects is None:
+                objects = single_flight.do(objects_key, partial(self._fetch_objects, cache, model, objects_key))
+            self._local_objects[label] = (version, objects)
+        if request_objects is not None:
+            request_objects[label] = objects
+        return objects
+
+    def invalidate(self, model):
+        """
+        Change the version of the cached objects of a waffle model, in all processes.
+        """
+        if not self.enabled:
+            return
+        label = model._meta.label_lower  # pylint: disable=protected-access
+        caches[self._alias].set(f"edx_toggles.{label}.version", uuid4().hex, None)
+        _get_waffle_request_cache().get("shared_objects", {}).pop(label, None)
+
+    def _fetch_objects(self, cache, model, objects_key):
+        """
+        Fetch the objects from the database and store them in the cache, unless another process does it first.
+        """
+        def compute():
+            objects = {obj.name: obj for obj in model.objects.all()}
+            self._store_objects(cache, objects_key, objects)
+            return objects
+
+        return single_flight.do_with_lock(
+            cache, objects_key + ".lock", partial(self._load_objects, cache, objects_key), compute, self._lock_timeout
+        )
+
+    def _store_objects(self, cache, objects_key, objects):
+        """
+        Store the objects in chunks, followed by the number of chunks, such that objects are never partially loaded.
+        """
+        items = list(objects.items())
+        chunks = {
+            f"{objects_key}.{chunk_index}": dict(items[start:start + self._chunk_size])
+            for chunk_index, start in enumerate(range(0, len(items), self._chunk_size))
+        }
+        # Contrary to set, set_many returns the keys that could not be stored
+        failed_keys = cache.set_many(chunks, self._timeout)
+        if not failed_keys:
+            failed_keys = cache.set_many({objects_key: len(chunks)}, self._timeout)
+        if failed_keys:
+            log.warning(
+                "Failed to store %d waffle objects in the shared cache, in %d chunks: %s. Consider reducing "
+                "EDX_TOGGLES_SHARED_CACHE_CHUNK_SIZE.",
+                len(items),
+                len(chunks),
+                ", ".join(failed_keys),
+            )
+
+    @staticmethod
+    def _load_objects(cache, objects_key):
+        """
+        Return the objects stored by ``_store_objects``, or None if they are missing or incomplete.
+        """
+        chunk_count = cache.get(objects_key)
+        if chunk_count is None:
+            return None
+        chunk_keys = [f"{objects_key}.{chunk_index}" for chunk_index in range(chunk_count)]
+        chunks = cache.get_many(chunk_keys)
+        if len(chunks) != chunk_count:
+            # Some chunks were evicted
+            return None
+        objects = {}
+        for chunk_key in chunk_keys:
+            objects.update(chunks[chunk_key])
+        return objects
+
+    @staticmethod
+    def _get_version(cache, label):
+        """
+        Return the current version of the cached objects of a model, which is created if it is missing.
+        """
+        version_key = f"edx_toggles.{label}.version"
+        version = cache.get(version_key)
+        if version is None:
+            # Another process might set the version concurrently, so we do not override it
+            cache.add(version_key, uuid4().hex, None)
+            version = cache.get(version_key)
+        return version
+
+
+def _get_shared_objects_memo():
+    """
+    Return the dict of shared cache objects of the current request, or None outside of requests.
+    """
+    if _toggle_context.get() is None and crum.get_current_request() is None:
+        return None
+    return _get_waffle_request_cache().setdefault("shared_objects", {})
+
+
+# Cache of waffle Flag and Switch objects that is shared across processes
+shared_cache = ToggleSharedCache()
+
+
+@receiver(setting_changed)
+def _reconfigure_caches(setting, **kwargs):
+    """
+    Reload the cache configuration whenever the corresponding settings are modified, e.g: in tests.
+    """
+    if setting.startswith("EDX_TOGGLES_PROCESS_CACHE_"):
+        process_cache.configure()
+    elif setting.startswith("EDX_TOGGLES_USER_FLAG_MEMO_"):
+        user_flag_memo.configure()
+    elif setting == "EDX_TOGGLES_COMPILED_FLAGS":
+        # Cached flags are either Flag objects or compiled flags, depending on this setting
+        process_cache.clear()
+    elif setting.startswith("EDX_TOGGLES_SHARED_CACHE_"):
+        shared_cache.configure()
@@ -2,23 +2,41 @@
 Waffle flag classes.
 """
 import logging
-from weakref import WeakSet
+import time
+from functools import partial
 
 import crum
-from waffle import flag_is_active  # lint-amnesty, pylint: disable=invalid-django-waffle-import
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from waffle import get_waffle_flag_model  # lint-amnesty, pylint: disable=invalid-django-waffle-import
 
-from .base import BaseWaffle
-from .cache import _get_waffle_request_cache
+from ..instrumentation import instrumentation, instrumented
+from ..registry import ToggleRegistry
+from .base import BaseWaffle, _get_many_waffle_objects
+from .cache import (
+    MISSING,
+    _get_waffle_request_cache,
+    _toggle_context,
+    get_toggle_context,
+    process_cache,
+    shared_cache,
+    single_flight,
+    user_flag_memo
+)
+from .rules import compile_flag, compiled_flags_enabled, depends_on_user_only
 
 log = logging.getLogger(__name__)
 
+# Time at which the last no-request warning was logged, indexed by flag name
+_no_request_warnings_logged_at = {}
+
 
 class WaffleFlag(BaseWaffle):
     """
     Represents a single waffle flag, enhanced with request-level caching.
     """
 
-    _class_instances = WeakSet()
+    _class_instances = ToggleRegistry()
 
     def __init__(self, name, module_name, log_prefix=""):
         """
@@ -27,30 +45,75 @@ class WaffleFlag(BaseWaffle):
         self.log_prefix = log_prefix
         super().__init__(name, module_name)
 
+    @instrumented("flag")
     def is_enabled(self):
         """
         Returns whether or not the flag is enabled.
         """
         return self._get_flag_active()
 
+    @classmethod
+    def bulk_is_enabled(cls, flags):
+        """
+        Return whether many flags are enabled, as a dict indexed by flag name.
+
+        In the context of a request, the waffle Flag objects of all flags that are not already cached are fetched in a
+        single query, and their values are stored in the request cache. Values are identical to the values that would be
+        returned by individual ``WaffleFlag.is_enabled`` calls, but they are not evaluations: they are neither counted
+        nor sampled by the toggle instrumentation, such that prefetching flags does not hide unused flags.
+        """
+        request = _get_current_request()
+        if not request:
+            return {flag.name: flag._get_flag_active() for flag in flags}  # pylint: disable=protected-access
+        cached_flags = cls.cached_flags()
+        uncached_names = {flag.name for flag in flags if cached_flags.get(flag.name) is None}
+        cached_flags.update(_get_flag_values(request, uncached_names))
+        return {flag.name: cached_flags[flag.name] for flag in flags}
+
+    async def ais_enabled(self):
+        """
+        Async variant of ``is_enabled``. In the context of a request (see ``ToggleContextMiddleware``), the values of
+        flags that are evaluated concurrently, e.g: with ``asyncio.gather``, are computed together, in a single thread
+        and with a single query.
+        """
+        context = get_toggle_context()
+        if context is None or context.request is None:
+            return await super().ais_enabled()
+        value = context.flags.get(self.name)
+        if value is None:
+            value = await context.load("flags", self.name, partial(_aget_flag_values, context.request))
+        return value
+
     @staticmethod
     def cached_flags():
         """
-        Returns a dictionary of all flags in the request cache. This method should only ever be used by child classes.
+        Returns a dictionary of all flags in the toggle context or, in its absence, in the request cache. This method
+        should only ever be used by child classes.
         """
+        context = _toggle_context.get()
+        if context is not None:
+            return context.flags
         return _get_waffle_request_cache().setdefault("flags", {})
 
     def _get_flag_active(self):
         """
         Return and cache the value of the flag activation. This does not handle monitoring.
         """
-        # Check global cache
-        value = self.cached_flags().get(self.name)
+        # Check global cache. In a toggle context, this does not involve any thread-local lookup.
+        context = _toggle_context.get()
+        if context is not None:
+            value = context.flags.get(self.name)
+            request = context.request
+        else:
+            value = _get_waffle_request_cache().setdefault("flags", {}).get(self.name)
+            request = None
+        instrumentation.record_cache_access("flag", self.name, "request", value is not None)
         if value is not None:
             return value
 
         # Check in context of request
-        request = crum.get_current_request()
+        if request is None:
+            request = crum.get_current_request()
         value = self._get_flag_active_request(request)
         if value is not None:
             return value
@@ -63,7 +126,7 @@ class WaffleFlag(BaseWaffle):
         Get flag value in the context of the current request.
         """
         if request:
-            value = flag_is_active(request, self.name)
+            value = _is_flag_active(_get_flag(self.name), request)
             self.cached_flags()[self.name] = value
             return value
         return None
@@ -73,16 +136,40 @@ class WaffleFlag(BaseWaffle):
         Return default value in the absence of any other, more specific flag value. This triggers warnings, as waffle
         flag values are not supposed to be accessed in the absence of any request context.
 
-        Note: this skips the cache as the value might be different in a normal request context. This case seems to
-        occur when a page redirects to a 404, or for celery workers.
+        Note: this skips the "flags" cache as the value might be different in a normal request context. This case seems
+        to occur when a page redirects to a 404, or for celery workers. If the EDX_TOGGLES_NO_REQUEST_CACHE_TIMEOUT
+        setting is set, values are cached in a separate "flags_no_request" dict of the request cache for that many
+        seconds. The timeout bounds the staleness of values in processes where the request cache is never cleared, such
+        as celery workers. Values are not cached by default (None). Warnings are logged at most once per flag every
+        EDX_TOGGLES_NO_REQUEST_WARNING_INTERVAL seconds (default: 3600).
+        """
+        instrumentation.record_no_request(self.name)
+        now = time.monotonic()
+        cached_flags_no_request = _get_waffle_request_cache().setdefault("flags_no_request", {})
+        value, expires_at = cached_flags_no_request.get(self.name, (None, now))
+        instrumentation.record_cache_access("flag", self.name, "no_request", now < expires_at)
+        if now >= expires_at:
+            self._log_no_request_warning(now)
+            value = _is_flag_active_for_everyone(self.name)
+            timeout = getattr(settings, "EDX_TOGGLES_NO_REQUEST_CACHE_TIMEOUT", None)
+            if timeout:
+                cached_flags_no_request[self.name] = (value, now + timeout)
+        return value
+
+    def _log_no_request_warning(self, now):
+        """
+        Log a warning about a flag being accessed without a request, unless it was already logged recently.
         """
+        interval = getattr(settings, "EDX_TOGGLES_NO_REQUEST_WARNING_INTERVAL", 3600)
+        last_logged_at = _no_request_warnings_logged_at.get(self.name)
+        if last_logged_at is not None and now - last_logged_at < interval:
+            return
+        _no_request_warnings_logged_at[self.name] = now
         log.warning(
             "%sFlag '%s' accessed without a request, which is likely in the context of a celery task.",
             self.log_prefix,
             self.name,
         )
-        value = _is_flag_active_for_everyone(self.name)
-        return value
 
 
 class NonNamespacedWaffleFlag(WaffleFlag):
@@ -96,17 +183,130 @@ class NonNamespacedWaffleFlag(WaffleFlag):
         pass
 
 
+def _get_flag(flag_name):
+    """
+    Return the waffle Flag object, from the process cache or the shared cache if enabled. This is equivalent to what
+    ``waffle.flag_is_active`` does, with extra caching layers. Concurrent lookups of the same flag are coalesced. When
+    EDX_TOGGLES_COMPILED_FLAGS is True, the returned object is the compiled flag, if the flag could be compiled.
+    """
+    cache_key = ("flag", flag_name)
+    flag = process_cache.get(cache_key)
+    if flag is MISSING:
+        flag = single_flight.do(cache_key, partial(_fetch_flag, flag_name))
+    return flag
+
+
+def _fetch_flag(flag_name):
+    """
+    Fetch the waffle Flag object from the shared cache, if enabled, or from waffle, and store it in the process cache.
+    """
+    if shared_cache.enabled:
+        flag = shared_cache.get_object(get_waffle_flag_model(), flag_name)
+    else:
+        flag = get_waffle_flag_model().get(flag_name)
+    flag = _compile_flag(flag)
+    process_cache.set(("flag", flag_name), flag)
+    return flag
+
+
+def _get_flags(flag_names):
+    """
+    Return many waffle Flag objects, indexed by name. Objects that are not in the process cache are fetched in a single
+    query.
+    """
+    flags = {}
+    uncached_names = []
+    for flag_name in flag_names:
+        flag = process_cache.get(("flag", flag_name))
+        if flag is MISSING:
+            uncached_names.append(flag_name)
+        else:
+            flags[flag_name] = flag
+    for flag_name, flag in _get_many_waffle_objects(get_waffle_flag_model(), uncached_names).items():
+        flag = _compile_flag(flag)
+        process_cache.set(("flag", flag_name), flag)
+        flags[flag_name] = flag
+    return flags
+
+
+def _compile_flag(flag):
+    """
+    Return the compiled rules of a waffle Flag object if EDX_TOGGLES_COMPILED_FLAGS is True and the flag can be
+    compiled, or the Flag object otherwise.
+    """
+    if compiled_flags_enabled():
+        return compile_flag(flag) or flag
+    return flag
+
+
+def _get_current_request():
+    """
+    Return the request of the toggle context or, in its absence, the crum current request.
+    """
+    context = _toggle_context.get()
+    if context is not None and context.request is not None:
+        return context.request
+    return crum.get_current_request()
+
+
+def _get_flag_values(request, flag_names):
+    """
+    Return the values of many flags for a request, indexed by name.
+    """
+    return {flag_name: _is_flag_active(flag, request) for flag_name, flag in _get_flags(flag_names).items()}
+
+
+_aget_flag_values = sync_to_async(_get_flag_values)
+
+
+def _is_flag_active(flag, request):
+    """
+    Return whether a waffle Flag object, or a compiled flag, is active for a request. If the per-user memo is enabled
+    and the flag value only depends on the request user, the value is memoized across requests.
+    """
+    key = _get_user_memo_key(flag, request)
+    if key is None:
+        return flag.is_active(request)
+    value = user_flag_memo.get(key)
+    if value is MISSING:
+        value = flag.is_active(request)
+        user_flag_memo.set(key, value)
+    return value
+
+
+def _get_user_memo_key(flag, request):
+    """
+    Return the key of a flag value in the per-user memo, or None if the value must not be memoized. The key includes
+    the user attributes that flag rules depend on, and the flag modification time, such that values are not reused
+    once the flag is modified in another process and the new Flag object is loaded.
+    """
+    if not user_flag_memo.enabled or not depends_on_user_only(flag):
+        return None
+    user = getattr(request, "user", None)
+    user_id = getattr(user, "pk", None)
+    if user_id is None:
+        return None
+    return (
+        "flag",
+        flag.name,
+        user_id,
+        user.is_authenticated,
+        getattr(user, "is_staff", False),
+        getattr(user, "is_superuser", False),
+        flag.modified,
+    )
+
+
+def evict_no_request_value(flag_name):
+    """
+    Evict the value of a flag that was cached outside of a request, in the current thread.
+    """
+    _get_waffle_request_cache().get("flags_no_request", {}).pop(flag_name, None)
+
+
 def _is_flag_active_for_everyone(flag_name):
     """
     Returns True if the waffle flag is configured as active for Everyone,
     False otherwise.
     """
-    # Import is placed here to avoid model import at project startup.
-    # pylint: disable=import-outside-toplevel
-    from waffle.models import Flag
-
-    try:
-        waffle_flag = Flag.objects.get(name=flag_name)
-        return waffle_flag.everyone is True
-    except Flag.DoesNotExist:
-        return False
+    return _get_flag(flag_name).everyone is True
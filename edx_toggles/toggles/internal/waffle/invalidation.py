@@ -0,0 +1,410 @@
+"""
+Propagation of waffle Flag and Switch modifications to the caches of all processes.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import request_started, setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .cache import is_flag_key, is_user_key, process_cache, user_flag_memo
+from .switch_table import background_threads_enabled, switch_table
+
+log = logging.getLogger(__name__)
+
+
+class BaseInvalidationBackend:
+    """
+    Transport of invalidation messages between processes.
+
+    Messages are dicts with the following entries: "kind" ("flag", "switch" or "user"), "name" (name of the flag or
+    switch, or id of the user, or None for all users), "published_at" (wall clock time, in seconds since the epoch) and
+    "origin" (identifier of the publishing process). Backends deliver messages to the callback that is passed to
+    ``start``, including the messages that are published by the current process. When messages may have been lost,
+    backends call the callback with None, such that all cached values are invalidated.
+    """
+
+    def publish(self, message):
+        """
+        Send a message to all processes.
+        """
+        raise NotImplementedError
+
+    def start(self, callback):
+        """
+        Start delivering messages to ``callback``. In forked processes, this is called again on first use.
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        """
+        Stop delivering messages.
+        """
+
+    def after_fork(self):
+        """
+        Reset the state that is not inherited by forked processes, before ``start`` is called again. This runs in the
+        fork hook of the child process, so it must neither start threads nor perform any I/O.
+        """
+
+
+class LoopbackInvalidationBackend(BaseInvalidationBackend):
+    """
+    Deliver messages synchronously to the current process only. This is useful in tests, and in deployments with a
+    single process.
+    """
+
+    def __init__(self):
+        self._callback = None
+
+    def publish(self, message):
+        if self._callback is not None:
+            self._callback(message)
+
+    def start(self, callback):
+        self._callback = callback
+
+    def stop(self):
+        self._callback = None
+
+
+class DjangoCacheInvalidationBackend(BaseInvalidationBackend):
+    """
+    Exchange messages through a Django cache backend that is shared by all processes, e.g: memcached or redis.
+
+    Messages are stored under sequential keys, and each process polls the latest sequence number every
+    ``poll_interval`` seconds from a daemon thread, then fetches the new messages in a single ``get_many`` call. The
+    thread is not started in Django's test environment, or when the ``EDX_TOGGLES_BACKGROUND_THREADS`` setting is False
+    (see ``background_threads_enabled``): ``poll`` must then be called explicitly.
+
+    Arguments:
+        cache_alias (str): name of the Django cache backend (default: "default").
+        poll_interval (float): time between two polls, in seconds (default: 1).
+        timeout (int): time-to-live of messages in the cache, in seconds (default: 300).
+        max_messages (int): maximum number of messages that are fetched by a single poll. If more messages were
+            published since the previous poll, all cached values are invalidated instead (default: 1000).
+        max_delay (float): time after which a message that is still missing from the cache, although its sequence
+            number was allocated, is considered lost, in seconds (default: 5).
+    """
+
+    key_prefix = "edx_toggles.invalidation"
+
+    def __init__(self, cache_alias="default", poll_interval=1, timeout=300, max_messages=1000, max_delay=5):
+        self.cache_alias = cache_alias
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_messages = max_messages
+        self.max_delay = max_delay
+        self._callback = None
+        self._last_seq = 0
+        self._missing_since = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def publish(self, message):
+        seq_key = f"{self.key_prefix}.seq"
+        self.cache.add(seq_key, 0, None)
+        seq = self.cache.incr(seq_key)
+        self.cache.set(f"{self.key_prefix}.{seq}", message, self.timeout)
+
+    def start(self, callback):
+        self.stop()
+        # Messages that were published before the process started are irrelevant
+        seq = self._get_seq()
+        with self._lock:
+            self._callback = callback
+            self._last_seq = seq
+            self._missing_since = None
+        if not background_threads_enabled():
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._poll_periodically, args=(self._stop,), name="edx_toggles.invalidation", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread, self._thread = self._thread, None
+        if thread is not None and thread is not threading.current_thread() and thread.is_alive():
+            thread.join()
+
+    def after_fork(self):
+        # The lock might have been held by a thread of the parent process, e.g: by a poll, at the time of the fork
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """
+        Deliver the messages that were published since the previous poll. The lock is not held during cache calls:
+        if another poll delivered messages in the meantime, the fetched messages are dropped.
+        """
+        with self._lock:
+            callback, last_seq = self._callback, self._last_seq
+        if callback is None:
+            return
+        seq = self._get_seq()
+        if seq < last_seq or seq - last_seq > self.max_messages:
+            # The sequence number was reset, e.g: after a cache flush, or too many messages were published
+            messages_by_key = None
+        else:
+            messages_by_key = self.cache.get_many(self._get_message_keys(last_seq, seq))
+        with self._lock:
+            if self._last_seq != last_seq:
+                return
+            if messages_by_key is None:
+                self._last_seq = seq
+                self._missing_since = None
+                messages = [None]
+            else:
+                messages = self._collect_messages(seq, messages_by_key)
+        for message in messages:
+            callback(message)
+
+    def _get_message_keys(self, last_seq, seq):
+        return [f"{self.key_prefix}.{message_seq}" for message_seq in range(last_seq + 1, seq + 1)]
+
+    def _collect_messages(self, seq, messages_by_key):
+        """
+        Return the fetched messages from ``_last_seq`` to ``seq``, in order. This must be called with the lock held.
+        """
+        messages = []
+        for key in self._get_message_keys(self._last_seq, seq):
+            message = messages_by_key.get(key)
+            if message is None:
+                # The publisher might not have stored the message yet: wait for it, up to max_delay seconds
+                now = time.monotonic()
+                if self._missing_since is None:
+                    self._missing_since = now
+                if now - self._missing_since < self.max_delay:
+                    break
+                messages.append(None)
+            else:
+                messages.append(message)
+            self._missing_since = None
+            self._last_seq += 1
+        return messages
+
+    def _get_seq(self):
+        return self.cache.get(f"{self.key_prefix}.seq") or 0
+
+    def _poll_periodically(self, stop):
+        """
+        Poll messages every ``poll_interval`` seconds, until ``stop`` is set. This runs in the background thread.
+        """
+        while not stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to poll waffle invalidation messages")
+
+
+class InvalidationBus:
+    """
+    Publish a message whenever a waffle Flag or Switch is saved or deleted, or the groups of a user are modified, and
+    evict the corresponding entries from the process cache, the per-user flag memo and the switch table of every
+    process that receives it.
+
+    The bus is configured with the following Django settings:
+
+        EDX_TOGGLES_INVALIDATION_BACKEND: dotted path of a ``BaseInvalidationBackend`` class, e.g:
+            "edx_toggles.toggles.internal.waffle.invalidation.DjangoCacheInvalidationBackend". The bus is disabled when
+            this setting is None (default).
+        EDX_TOGGLES_INVALIDATION_BACKEND_OPTIONS: dict of keyword arguments of the backend constructor (default: {}).
+
+    The propagation latency is measured with the wall clock, so it includes the clock skew between servers.
+
+    Threads do not survive forks, so in forked processes the backend is started again on first use: at the start of
+    the first request, or when the first message is published.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backend = None
+        # Process in which the backend was started
+        self._pid = None
+        # Identifier of the current process
+        self.origin = uuid.uuid4().hex
+        self._published = 0
+        self._received = 0
+        self._lost = 0
+        self._last_latency = None
+        self._total_latency = 0.0
+        self._max_latency = None
+
+    def configure(self):
+        """
+        (Re-)load the backend from the Django settings, and start receiving messages.
+        """
+        self.stop()
+        backend_path = getattr(settings, "EDX_TOGGLES_INVALIDATION_BACKEND", None)
+        if backend_path is None:
+            return
+        options = getattr(settings, "EDX_TOGGLES_INVALIDATION_BACKEND_OPTIONS", {})
+        backend = import_string(backend_path)(**options)
+        backend.start(self._receive)
+        with self._lock:
+            self._backend = backend
+            self._pid = os.getpid()
+
+    def stop(self):
+        """
+        Stop receiving messages, and drop the backend.
+        """
+        with self._lock:
+            backend, self._backend = self._backend, None
+        if backend is not None:
+            backend.stop()
+
+    @property
+    def backend(self):
+        return self._backend
+
+    def ensure_started(self):
+        """
+        Start the backend again if it was started in a parent process, before the current process was forked.
+        """
+        backend = self._backend
+        if backend is None or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        try:
+            backend.start(self._receive)
+        except Exception:  # pylint: disable=broad-except
+            log.exception("Failed to start the waffle invalidation backend")
+            with self._lock:
+                self._pid = None
+
+    def publish(self, kind, name):
+        """
+        Notify all processes that a flag or switch, or the groups of a user (all users if ``name`` is None), were
+        modified. This is a no-op if the bus is disabled.
+        """
+        self.ensure_started()
+        backend = self._backend
+        if backend is None:
+            return
+        backend.publish({"kind": kind, "name": name, "published_at": time.time(), "origin": self.origin})
+        with self._lock:
+            self._published += 1
+
+    def stats(self):
+        """
+        Return a dict of statistics. Latencies are expressed in seconds, between the publication and the eviction of
+        cache entries. "lost" is the number of times all cached values were invalidated because messages were lost.
+        """
+        with self._lock:
+            return {
+                "enabled": self._backend is not None,
+                "published": self._published,
+                "received": self._received,
+                "lost": self._lost,
+                "last_latency": self._last_latency,
+                "mean_latency": self._total_latency / self._received if self._received else None,
+                "max_latency": self._max_latency,
+            }
+
+    def reset_stats(self):
+        """
+        Reset all statistics counters.
+        """
+        with self._lock:
+            self._reset_stats()
+
+    def _reset_stats(self):
+        """
+        Reset all statistics counters. This must be called with the lock held.
+        """
+        self._published = 0
+        self._received = 0
+        self._lost = 0
+        self._last_latency = None
+        self._total_latency = 0.0
+        self._max_latency = None
+
+    def _receive(self, message):
+        """
+        Evict the cache entries of a modified flag, switch or user, or all entries if messages were lost.
+        """
+        if message is None:
+            process_cache.clear()
+            user_flag_memo.clear()
+            switch_table.invalidate()
+            with self._lock:
+                self._lost += 1
+            return
+        kind, name = message["kind"], message["name"]
+        if kind == "user":
+            # Memoized flag values depend on the groups of users
+            if name is None:
+                user_flag_memo.clear()
+            else:
+                user_flag_memo.delete_matching(partial(is_user_key, name))
+        elif kind == "flag":
+            process_cache.delete((kind, name))
+            user_flag_memo.delete_matching(partial(is_flag_key, name))
+        else:
+            process_cache.delete((kind, name))
+            switch_table.invalidate()
+        latency = max(time.time() - message["published_at"], 0.0)
+        with self._lock:
+            self._received += 1
+            self._last_latency = latency
+            self._total_latency += latency
+            self._max_latency = latency if self._max_latency is None else max(self._max_latency, latency)
+
+    def _after_fork(self):
+        """
+        Reset the state of the bus in a forked process. The backend is started again by ``ensure_started``, outside of
+        the fork hook.
+        """
+        self._lock = threading.Lock()
+        self.origin = uuid.uuid4().hex
+        backend = self._backend
+        if backend is not None:
+            backend.after_fork()
+
+
+invalidation_bus = InvalidationBus()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=invalidation_bus._after_fork)  # pylint: disable=protected-access
+
+
+def get_invalidation_stats():
+    """
+    Return the statistics of the invalidation bus, including the propagation latency.
+    """
+    return invalidation_bus.stats()
+
+
+@receiver(request_started)
+def _start_invalidation_bus(**kwargs):
+    """
+    Start the backend in forked worker processes before they serve their first request.
+    """
+    invalidation_bus.ensure_started()
+
+
+@receiver(setting_changed)
+def _reconfigure_invalidation_bus(setting, **kwargs):
+    """
+    Reload the bus configuration whenever the corresponding settings are modified, e.g: in tests.
+    """
+    if setting.startswith("EDX_TOGGLES_INVALIDATION_"):
+        invalidation_bus.configure()
@@ -0,0 +1,210 @@
+"""
+Compilation of waffle Flag objects into in-memory rules.
+"""
+import random
+from datetime import datetime
+from decimal import Decimal
+from typing import NamedTuple, Optional
+
+from django.conf import settings
+from waffle.utils import get_setting
+
+# Methods that must be inherited from waffle's AbstractBaseFlag (first group) and AbstractUserFlag (second group) for
+# the compiled rules to be equivalent to ``Flag.is_active``
+_BASE_FLAG_RULE_METHODS = ("is_active", "_is_active_for_user", "_is_active_for_language", "_is_active_for_percent")
+_USER_FLAG_RULE_METHODS = ("is_active_for_user", "_get_user_ids", "_get_group_ids")
+
+# Whether the rules of a Flag model can be compiled, indexed by model
+_compilable_models = {}
+
+
+class CompiledFlag(NamedTuple):
+    """
+    Immutable rules of a waffle Flag, including the ids of its users and groups.
+
+    ``is_active`` returns the same value as ``Flag.is_active``, with the same side effects on the request (test and
+    percentage cookies), but it does not access the cache or the database, except to fetch the group ids of
+    ``request.user`` for flags that are active for some groups. The group ids of each user are fetched at most once per
+    request.
+    """
+
+    name: str
+    everyone: Optional[bool]
+    testing: bool
+    superusers: bool
+    staff: bool
+    authenticated: bool
+    languages: tuple
+    percent: Optional[Decimal]
+    rollout: bool
+    user_ids: frozenset
+    group_ids: frozenset
+    modified: datetime
+
+    def is_active(self, request, read_only=False):
+        """
+        Return whether the flag is active for a request.
+        """
+        if get_setting("OVERRIDE") and self.name in request.GET:
+            return request.GET[self.name] == "1"
+
+        if self.everyone is not None:
+            return self.everyone
+
+        if self.testing:
+            test_cookie = get_setting("TEST_COOKIE") % self.name
+            test_header = test_cookie.replace("_", "-")
+            active = None
+            if test_cookie in request.GET:
+                active = request.GET[test_cookie] == "1"
+            elif test_header in request.headers:
+                active = request.headers[test_header] == "1"
+            if active is not None:
+                if not hasattr(request, "waffle_tests"):
+                    request.waffle_tests = {}
+                request.waffle_tests[self.name] = active
+                return active
+            if test_cookie in request.COOKIES:
+                return request.COOKIES[test_cookie] == "True"
+
+        if self.languages and hasattr(request, "LANGUAGE_CODE") and request.LANGUAGE_CODE in self.languages:
+            return True
+
+        user = getattr(request, "user", None)
+        if not user:
+            return False
+        if self.is_active_for_user(request, user):
+            return True
+
+        if self.percent is not None:
+            return self._is_active_for_percent(request, read_only)
+        return False
+
+    def is_active_for_user(self, request, user):
+        """
+        Return whether the flag is active for the user of a request, regardless of languages and percentages.
+        """
+        if self.authenticated and user.is_authenticated:
+            return True
+        if self.staff and getattr(user, "is_staff", False):
+            return True
+        if self.superusers and getattr(user, "is_superuser", False):
+            return True
+        if self.user_ids and hasattr(user, "pk") and user.pk in self.user_ids:
+            return True
+        if self.group_ids and hasattr(user, "groups"):
+            if not self.group_ids.isdisjoint(_get_user_group_ids(request, user)):
+                return True
+        return False
+
+    def _is_active_for_percent(self, request, read_only):
+        """
+        Return whether the flag is active for a request according to its percentage, like
+        ``AbstractBaseFlag._is_active_for_percent``: the value is stored in a cookie by waffle's middleware.
+        """
+        # Import is placed here to avoid model import at project startup.
+        # pylint: disable=import-outside-toplevel
+        from waffle.models import set_flag
+
+        if not hasattr(request, "waffles"):
+            request.waffles = {}
+        elif self.name in request.waffles:
+            return request.waffles[self.name][0]
+
+        cookie = get_setting("COOKIE") % self.name
+        if cookie in request.COOKIES:
+            active = request.COOKIES[cookie] == "True"
+            if not read_only:
+                set_flag(request, self.name, active, self.rollout)
+            return active
+
+        if not read_only:
+            active = Decimal(str(random.uniform(0, 100))) <= self.percent
+            set_flag(request, self.name, active, self.rollout)
+            if active:
+                return True
+        return False
+
+
+def compile_flag(flag):
+    """
+    Return the compiled rules of a waffle Flag object, or None if the flag cannot be compiled: this is the case of
+    flags that do not exist in the database, which must be evaluated by waffle to preserve its logging and creation of
+    missing flags, and of flags whose model overrides the evaluation methods of waffle's ``AbstractUserFlag``.
+    """
+    if not flag.pk or not _is_compilable(type(flag)):
+        return None
+    # The user and group ids are not needed if the flag is active, or inactive, for everyone
+    has_rules = flag.everyone is None
+    return CompiledFlag(
+        name=flag.name,
+        everyone=flag.everyone,
+        testing=flag.testing,
+        superusers=flag.superusers,
+        staff=flag.staff,
+        authenticated=flag.authenticated,
+        languages=tuple(language.strip() for language in flag.languages.split(",")) if flag.languages else (),
+        percent=flag.percent if flag.percent and flag.percent > 0 else None,
+        rollout=flag.rollout,
+        user_ids=frozenset(flag._get_user_ids()) if has_rules else frozenset(),  # pylint: disable=protected-access
+        group_ids=frozenset(flag._get_group_ids()) if has_rules else frozenset(),  # pylint: disable=protected-access
+        modified=flag.modified,
+    )
+
+
+def depends_on_user_only(flag):
+    """
+    Return whether the value of a waffle Flag object, or of a compiled flag, only depends on the request user, and not
+    on request parameters, cookies or randomness. This excludes flags that do not exist in the database, flags with
+    percentage, testing or language rules, flags that are active or inactive for everyone (whose evaluation is trivial)
+    and all flags when WAFFLE_OVERRIDE is True.
+    """
+    if get_setting("OVERRIDE"):
+        return False
+    if not isinstance(flag, CompiledFlag) and (not flag.pk or not _is_compilable(type(flag))):
+        return False
+    return (
+        flag.everyone is None
+        and not flag.testing
+        and not flag.languages
+        and not (flag.percent and flag.percent > 0)
+    )
+
+
+def compiled_flags_enabled():
+    """
+    Return whether waffle Flag objects should be compiled, as configured by the ``EDX_TOGGLES_COMPILED_FLAGS`` setting
+    (default: False). Compiled flags are stored instead of Flag objects in the process cache, so they are most useful
+    when the process cache is enabled.
+    """
+    return getattr(settings, "EDX_TOGGLES_COMPILED_FLAGS", False)
+
+
+def _is_compilable(model):
+    """
+    Return whether a Flag model inherits all the evaluation methods of waffle, such that its rules can be compiled.
+    """
+    compilable = _compilable_models.get(model)
+    if compilable is None:
+        # Import is placed here to avoid model import at project startup.
+        # pylint: disable=import-outside-toplevel
+        from waffle.models import AbstractBaseFlag, AbstractUserFlag
+
+        rule_methods = [(AbstractBaseFlag, method_name) for method_name in _BASE_FLAG_RULE_METHODS] + [
+            (AbstractUserFlag, method_name) for method_name in _USER_FLAG_RULE_METHODS
+        ]
+        compilable = _compilable_models[model] = all(
+            getattr(model, method_name, None) is getattr(base, method_name) for base, method_name in rule_methods
+        )
+    return compilable
+
+
+def _get_user_group_ids(request, user):
+    """
+    Return the group ids of a user, fetched at most once per request.
+    """
+    group_ids_by_user = request.__dict__.setdefault("_edx_toggles_user_group_ids", {})
+    group_ids = group_ids_by_user.get(user.pk)
+    if group_ids is None:
+        group_ids = group_ids_by_user[user.pk] = frozenset(user.groups.all().values_list("pk", flat=True))
+    return group_ids
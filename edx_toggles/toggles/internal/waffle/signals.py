@@ -0,0 +1,111 @@
+"""
+Signal handlers that invalidate the waffle caches whenever waffle objects are modified.
+"""
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from waffle import (  # lint-amnesty, pylint: disable=invalid-django-waffle-import
+    get_waffle_flag_model,
+    get_waffle_switch_model
+)
+
+from .cache import is_flag_key, process_cache, shared_cache, user_flag_memo
+from .flag import evict_no_request_value
+from .invalidation import invalidation_bus
+from .switch_table import switch_table
+
+
+def connect_signal_handlers():
+    """
+    Connect cache invalidation handlers to the waffle Flag and Switch model signals. This should be called once the
+    app registry is ready, e.g: in ``AppConfig.ready``.
+    """
+    flag_model = get_waffle_flag_model()
+    switch_model = get_waffle_switch_model()
+    post_save.connect(_invalidate_flag, sender=flag_model, dispatch_uid="edx_toggles.flag.post_save")
+    post_delete.connect(_invalidate_flag, sender=flag_model, dispatch_uid="edx_toggles.flag.post_delete")
+    post_save.connect(_invalidate_switch, sender=switch_model, dispatch_uid="edx_toggles.switch.post_save")
+    post_delete.connect(_invalidate_switch, sender=switch_model, dispatch_uid="edx_toggles.switch.post_delete")
+    # Compiled flags include the ids of their users and groups
+    for relation in ("users", "groups"):
+        if hasattr(flag_model, relation):
+            m2m_changed.connect(
+                _invalidate_flag_relation,
+                sender=getattr(flag_model, relation).through,
+                dispatch_uid=f"edx_toggles.flag.{relation}.m2m_changed",
+            )
+    # Memoized flag values depend on the groups of users
+    user_model = get_user_model()
+    if hasattr(user_model, "groups"):
+        m2m_changed.connect(
+            _invalidate_user_groups,
+            sender=user_model.groups.through,
+            dispatch_uid="edx_toggles.user.groups.m2m_changed",
+        )
+
+
+def _evict(callback):
+    """
+    Evict cache entries both immediately and on commit.
+
+    Like waffle, we invalidate on commit: otherwise, a concurrent request could cache the former value again before the
+    transaction is committed. But we also invalidate immediately, such that the current transaction reads its own
+    modifications. This is the case of waffle's ``override_flag`` and ``override_switch`` test utilities, which are
+    used inside test transactions that are never committed.
+    """
+    callback()
+    transaction.on_commit(callback)
+
+
+def _invalidate_flag(sender, instance, **kwargs):
+    """
+    Evict a saved or deleted flag from all caches, and notify the other processes.
+    """
+    _evict(partial(process_cache.delete, ("flag", instance.name)))
+    _evict(partial(shared_cache.invalidate, sender))
+    _evict(partial(user_flag_memo.delete_matching, partial(is_flag_key, instance.name)))
+    _evict(partial(evict_no_request_value, instance.name))
+    transaction.on_commit(partial(invalidation_bus.publish, "flag", instance.name))
+
+
+def _invalidate_flag_relation(instance, action, reverse, **kwargs):
+    """
+    Evict the flags whose users or groups were modified, since compiled flags include their ids.
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        # The instance is a user or a group, and the modified flags are not known for sure
+        _evict(process_cache.clear)
+        _evict(user_flag_memo.clear)
+    else:
+        _invalidate_flag(type(instance), instance)
+
+
+def _invalidate_user_groups(instance, action, reverse, pk_set, **kwargs):
+    """
+    Evict the memoized flag values of the users whose groups were modified, and notify the other processes.
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        user_ids = {instance.pk}
+    elif pk_set is None:
+        # The instance is a group, and the modified users are not known
+        _evict(user_flag_memo.clear)
+        transaction.on_commit(partial(invalidation_bus.publish, "user", None))
+        return
+    else:
+        user_ids = set(pk_set)
+    _evict(partial(user_flag_memo.delete_matching, lambda key: key[2] in user_ids))
+    for user_id in user_ids:
+        transaction.on_commit(partial(invalidation_bus.publish, "user", user_id))
+
+
+def _invalidate_switch(sender, instance, **kwargs):
+    _evict(partial(process_cache.delete, ("switch", instance.name)))
+    _evict(partial(shared_cache.invalidate, sender))
+    _evict(switch_table.invalidate)
+    transaction.on_commit(partial(invalidation_bus.publish, "switch", instance.name))
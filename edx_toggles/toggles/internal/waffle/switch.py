@@ -1,12 +1,26 @@
 """
 New-style switch classes: these classes no longer depend on namespaces to be created.
 """
-from weakref import WeakSet
 
-from waffle import switch_is_active  # lint-amnesty, pylint: disable=invalid-django-waffle-import
+from asgiref.sync import sync_to_async
+from waffle import (  # lint-amnesty, pylint: disable=invalid-django-waffle-import
+    get_waffle_switch_model,
+    switch_is_active
+)
 
-from .base import BaseWaffle
-from .cache import _get_waffle_request_cache
+from ..instrumentation import instrumentation, instrumented
+from ..registry import ToggleRegistry
+from .base import BaseWaffle, _get_many_waffle_objects
+from .cache import (
+    MISSING,
+    _get_waffle_request_cache,
+    _toggle_context,
+    get_toggle_context,
+    process_cache,
+    shared_cache,
+    single_flight
+)
+from .switch_table import switch_table
 
 
 class WaffleSwitch(BaseWaffle):
@@ -14,25 +28,121 @@ class WaffleSwitch(BaseWaffle):
     Represents a single waffle switch, enhanced with request-level caching.
     """
 
-    _class_instances = WeakSet()
+    _class_instances = ToggleRegistry()
 
+    @instrumented("switch")
     def is_enabled(self):
         """
         Returns whether or not the switch is enabled.
         """
-        value = self._cached_switches.get(self.name)
+        cached_switches = _get_cached_switches()
+        value = cached_switches.get(self.name)
+        instrumentation.record_cache_access("switch", self.name, "request", value is not None)
         if value is None:
+            if switch_table.enabled:
+                # Table values are not copied to the request cache, such that table refreshes are seen immediately
+                return switch_table.get(self.name)
+            value = self._get_switch_active()
+            cached_switches[self.name] = value
+        return value
+
+    @classmethod
+    def bulk_is_enabled(cls, switches):
+        """
+        Return whether many switches are enabled, as a dict indexed by switch name.
+
+        The waffle Switch objects of all switches that are not already cached are fetched in a single query, and their
+        values are stored in the request cache. Values are identical to the values that would be returned by individual
+        ``WaffleSwitch.is_enabled`` calls, but they are not evaluations: they are neither counted nor sampled by the
+        toggle instrumentation, such that prefetching switches does not hide unused switches.
+        """
+        cached_switches = _get_cached_switches()
+        if switch_table.enabled:
+            values = {switch.name: cached_switches.get(switch.name) for switch in switches}
+            return {name: switch_table.get(name) if value is None else value for name, value in values.items()}
+        uncached_names = [switch.name for switch in switches if cached_switches.get(switch.name) is None]
+        cached_switches.update(_get_switch_values(uncached_names))
+        return {switch.name: cached_switches[switch.name] for switch in switches}
+
+    async def ais_enabled(self):
+        """
+        Async variant of ``is_enabled``. In the context of a request (see ``ToggleContextMiddleware``), the values of
+        switches that are evaluated concurrently, e.g: with ``asyncio.gather``, are fetched together.
+        """
+        value = _get_cached_switches().get(self.name)
+        if value is not None:
+            return value
+        if switch_table.enabled:
+            if switch_table.needs_refresh():
+                return await super().ais_enabled()
+            return switch_table.get(self.name)
+        context = get_toggle_context()
+        if context is None:
+            return await super().ais_enabled()
+        return await context.load("switches", self.name, _aget_switch_values)
+
+    def _get_switch_active(self):
+        """
+        Return the switch value from the process cache or the shared cache, if enabled, or from waffle. Concurrent
+        lookups of the same switch are coalesced.
+        """
+        cache_key = ("switch", self.name)
+        value = process_cache.get(cache_key)
+        if value is MISSING:
+            value = single_flight.do(cache_key, self._fetch_switch_active)
+        return value
+
+    def _fetch_switch_active(self):
+        """
+        Fetch the switch value from the shared cache, if enabled, or from waffle, and store it in the process cache.
+        """
+        if shared_cache.enabled:
+            value = shared_cache.get_object(get_waffle_switch_model(), self.name).is_active()
+        else:
             value = switch_is_active(self.name)
-            self._cached_switches[self.name] = value
+        process_cache.set(("switch", self.name), value)
         return value
 
     @property
     def _cached_switches(self):
         """
-        Return a dictionary of all namespaced switches in the request cache.
+        Return a dictionary of all namespaced switches in the toggle context or, in its absence, in the request cache.
         Note that this property might be used elsewhere, in edx-platform for instance (although it probably shouldn't).
         """
-        return _get_waffle_request_cache().setdefault("switches", {})
+        return _get_cached_switches()
+
+
+def _get_cached_switches():
+    """
+    Return the dict of switch values of the toggle context or, in its absence, of the request cache.
+    """
+    context = _toggle_context.get()
+    if context is not None:
+        return context.switches
+    return _get_waffle_request_cache().setdefault("switches", {})
+
+
+def _get_switch_values(switch_names):
+    """
+    Return the values of many switches, indexed by name. Values that are not in the process cache are fetched in a
+    single query.
+    """
+    values = {}
+    uncached_names = []
+    for switch_name in switch_names:
+        value = process_cache.get(("switch", switch_name))
+        if value is MISSING:
+            uncached_names.append(switch_name)
+        else:
+            values[switch_name] = value
+    for switch_name, waffle_switch in _get_many_waffle_objects(get_waffle_switch_model(), uncached_names).items():
+        value = waffle_switch.is_active()
+        process_cache.set(("switch", switch_name), value)
+        values[switch_name] = value
+    return values
+
+
+_aget_switch_values = sync_to_async(_get_switch_values)
 
 
 class NonNamespacedWaffleSwitch(WaffleSwitch):
@@ -0,0 +1,251 @@
+"""
+In-process table of all waffle switch values, refreshed in the background.
+"""
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, router
+from django.dispatch import receiver
+from waffle import get_waffle_switch_model  # lint-amnesty, pylint: disable=invalid-django-waffle-import
+from waffle.utils import get_setting
+
+from .cache import single_flight
+
+log = logging.getLogger(__name__)
+
+
+class SwitchTable:
+    """
+    Table of the values of all waffle switches, loaded with a single query.
+
+    Switches are global booleans, so their values do not need to be fetched for every request: when the table is
+    enabled, ``WaffleSwitch.is_enabled`` reads values from the table, without touching the database. Values that are
+    stored in the request cache, e.g: by ``override_waffle_switch``, still take precedence. A daemon thread refreshes
+    the table every ``interval`` seconds. The table can also be refreshed by a periodic task, with
+    ``refresh_switch_table``. Saving or deleting a switch in the current process marks the table as stale, immediately
+    and again on commit, and it is then refreshed on the next read. Switches that do not exist in the database have the
+    ``WAFFLE_SWITCH_DEFAULT`` value: contrary to waffle, their evaluation is neither logged nor does it create them.
+
+    The table is configured with the following Django settings:
+
+        EDX_TOGGLES_SWITCH_TABLE_REFRESH_INTERVAL: refresh interval, in seconds. The table is disabled when this setting
+            is None (default).
+        EDX_TOGGLES_BACKGROUND_THREADS: whether background threads may be started. By default (None), they are
+            started unless Django's test environment is set up. Without a background thread, the table is refreshed on
+            read, once it is older than ``interval`` seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._interval = None
+        self._configured = False
+        self._values = None
+        self._default = False
+        self._refreshed_at = None
+        self._stale = False
+        self._invalidations = 0
+        self._refreshes = 0
+        self._errors = 0
+        self._last_refresh_duration = None
+        self._thread = None
+        self._thread_pid = None
+        self._stop = threading.Event()
+
+    def configure(self):
+        """
+        (Re-)load the table configuration from the Django settings. The table and its statistics are dropped, and the
+        background thread, if any, is stopped: it is started again on the next read.
+        """
+        self.stop()
+        with self._lock:
+            self._interval = getattr(settings, "EDX_TOGGLES_SWITCH_TABLE_REFRESH_INTERVAL", None)
+            self._values = None
+            self._refreshed_at = None
+            self._stale = False
+            self._refreshes = 0
+            self._errors = 0
+            self._last_refresh_duration = None
+            self._configured = True
+
+    @property
+    def enabled(self):
+        if not self._configured:
+            self.configure()
+        return self._interval is not None
+
+    def get(self, name):
+        """
+        Return the value of a switch, after loading the table if necessary.
+        """
+        values = self._values
+        if values is None or self.needs_refresh():
+            self._ensure_background_refresh()
+            # Concurrent reads wait for a single refresh
+            values = single_flight.do("switch_table", self.refresh)
+        value = values.get(name)
+        return self._default if value is None else value
+
+    def needs_refresh(self):
+        """
+        Return whether the table must be refreshed before it is read.
+        """
+        if self._values is None or self._stale:
+            return True
+        if self._is_refreshed_in_background():
+            return False
+        return time.monotonic() - self._refreshed_at >= self._interval
+
+    def refresh(self):
+        """
+        Load the values of all switches with a single query, and return them.
+        """
+        model = get_waffle_switch_model()
+        objects = model.objects
+        if get_setting("READ_FROM_WRITE_DB"):
+            objects = objects.using(router.db_for_write(model))
+        invalidations = self._invalidations
+        start = time.monotonic()
+        try:
+            values = MappingProxyType(dict(objects.values_list("name", "active")))
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        now = time.monotonic()
+        with self._lock:
+            self._values = values
+            self._default = get_setting("SWITCH_DEFAULT")
+            self._refreshed_at = now
+            # The table remains stale if it was invalidated during the query
+            self._stale = self._invalidations != invalidations
+            self._refreshes += 1
+            self._last_refresh_duration = now - start
+        return values
+
+    def invalidate(self):
+        """
+        Mark the table as stale, such that it is refreshed on the next read.
+        """
+        with self._lock:
+            self._invalidations += 1
+            self._stale = True
+
+    def stop(self):
+        """
+        Stop the background thread, if it is running.
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+            self._stop.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def stats(self):
+        """
+        Return a dict of statistics. "age" is the time since the last refresh, in seconds, which is an upper bound to
+        the staleness of the table values.
+        """
+        enabled = self.enabled
+        with self._lock:
+            return {
+                "enabled": enabled,
+                "interval": self._interval,
+                "background_refresh": self._thread is not None and self._thread_pid == os.getpid(),
+                "size": 0 if self._values is None else len(self._values),
+                "age": None if self._refreshed_at is None else time.monotonic() - self._refreshed_at,
+                "stale": self._stale,
+                "refreshes": self._refreshes,
+                "errors": self._errors,
+                "last_refresh_duration": self._last_refresh_duration,
+            }
+
+    def _is_refreshed_in_background(self):
+        return self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive()
+
+    def _ensure_background_refresh(self):
+        """
+        Start the background thread, unless it is already running in this process or background threads are disabled.
+        Threads do not survive forks, so the thread is started again in forked worker processes.
+        """
+        if self._is_refreshed_in_background() or not background_threads_enabled():
+            return
+        with self._lock:
+            if self._is_refreshed_in_background():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(
+                target=self._refresh_periodically,
+                args=(self._stop, self._interval),
+                name="edx_toggles.switch_table",
+                daemon=True,
+            )
+            self._thread_pid = os.getpid()
+            self._thread.start()
+
+    def _refresh_periodically(self, stop, interval):
+        """
+        Refresh the table every ``interval`` seconds, until ``stop`` is set. This runs in the background thread.
+        """
+        while not stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception:  # pylint: disable=broad-except
+                log.exception("Failed to refresh the waffle switch table")
+            finally:
+                # Like at the end of a request, close the database connection of this thread if it is unusable or older
+                # than CONN_MAX_AGE
+                close_old_connections()
+
+
+def background_threads_enabled():
+    """
+    Return whether background threads may be started, as configured by the ``EDX_TOGGLES_BACKGROUND_THREADS`` setting
+    or, if it is None (default), unless Django's test environment is set up.
+    """
+    enabled = getattr(settings, "EDX_TOGGLES_BACKGROUND_THREADS", None)
+    if enabled is None:
+        return not _is_test_environment()
+    return enabled
+
+
+def _is_test_environment():
+    """
+    Return whether ``django.test.utils.setup_test_environment`` was called, e.g: by the Django test runner or by
+    pytest-django, and not torn down since.
+    """
+    from django.test.utils import _TestState  # pylint: disable=import-outside-toplevel
+    return hasattr(_TestState, "saved_data")
+
+
+# In-process table of all waffle switch values
+switch_table = SwitchTable()
+
+
+def refresh_switch_table():
+    """
+    Force the refresh of the waffle switch table, e.g: from a periodic task. This is a no-op if the table is disabled.
+    """
+    if switch_table.enabled:
+        switch_table.refresh()
+
+
+def get_switch_table_stats():
+    """
+    Return the statistics of the waffle switch table.
+    """
+    return switch_table.stats()
+
+
+@receiver(setting_changed)
+def _reconfigure_switch_table(setting, **kwargs):
+    """
+    Reload the table configuration whenever the corresponding settings are modified, e.g: in tests.
+    """
+    if setting.startswith("EDX_TOGGLES_SWITCH_TABLE_") or setting.startswith("WAFFLE_"):
+        switch_table.configure()
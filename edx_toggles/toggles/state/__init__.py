@@ -1,4 +1,9 @@
 """
 Expose public feature toggle state API.
 """
-from .internal.report import ToggleStateReport, get_or_create_toggle_response
+from .internal.report import (
+    CachedToggleStateReport,
+    StreamingToggleStateReport,
+    ToggleStateReport,
+    get_or_create_toggle_response
+)
@@ -0,0 +1,64 @@
+"""
+Code owner resolution for the toggle state report.
+"""
+import threading
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from edx_django_utils.monitoring import get_code_owner_from_module
+
+
+class CodeOwnerResolver:
+    """
+    Memoized code owner lookup, indexed by module.
+
+    Many toggles are created in the same modules, so the code owner of each module is resolved only once per process,
+    or until the code owner settings are modified.
+
+    Results are not memoized per module prefix (package): the owner of a module is the owner of its most specific
+    prefix in the CODE_OWNER_MAPPINGS setting, and edx-django-utils does not expose its parsed path-to-owner mapping.
+    Without it, the owner of a package cannot be reused for its modules, since a module might have a more specific
+    owner. Memoizing the results per module bounds the number of lookups by the number of distinct modules anyway.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._code_owners = {}
+
+    def get_code_owner(self, module):
+        """
+        Return the code owner of a module, or None.
+        """
+        try:
+            return self._code_owners[module]
+        except KeyError:
+            pass
+        code_owner = get_code_owner_from_module(module)
+        with self._lock:
+            self._code_owners[module] = code_owner
+        return code_owner
+
+    def get_code_owners(self, modules):
+        """
+        Return the code owners of many modules, as a dict indexed by module.
+        """
+        return {module: self.get_code_owner(module) for module in set(modules)}
+
+    def clear(self):
+        """
+        Forget all resolved code owners.
+        """
+        with self._lock:
+            self._code_owners.clear()
+
+
+code_owner_resolver = CodeOwnerResolver()
+
+
+@receiver(setting_changed)
+def _clear_code_owners(setting, **kwargs):
+    """
+    Clear the resolved code owners whenever the code owner settings are modified, e.g: in tests.
+    """
+    if setting.startswith("CODE_OWNER_"):
+        code_owner_resolver.clear()
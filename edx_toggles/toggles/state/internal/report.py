@@ -1,13 +1,38 @@
 """
 Toggle state report API.
 """
+import copy
+import heapq
+import json
+import threading
+import time
 from collections import OrderedDict
-
-from django.conf import settings
-from edx_django_utils.monitoring import get_code_owner_from_module
+from itertools import islice
+
+from django.core.signals import setting_changed
+from django.db import connections, router
+from django.db.models import CharField, Count, F, Func, Max
+from django.db.models.functions import Collate
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from waffle.models import Flag, Switch
 
 from edx_toggles.toggles import SettingDictToggle, SettingToggle, WaffleFlag, WaffleSwitch
+from edx_toggles.toggles.internal.registry import toggle_registry
+
+from .code_owner import code_owner_resolver
+from .setting_traversal import get_boolean_settings, setting_dict_name
+
+# Counters that are incremented whenever settings or waffle objects are modified in the current process. They are used
+# to invalidate the cached reports.
+_invalidation_counters = {"settings": 0, "waffle": 0}
+
+# Collations that compare strings by Unicode code point, indexed by database vendor (see ``_get_binary_name``)
+_BINARY_COLLATIONS = {
+    "postgresql": "C",
+    "sqlite": "BINARY",
+    "oracle": "BINARY",
+}
 
 
 class ToggleStateReport:
@@ -48,7 +73,7 @@ class ToggleStateReport:
         """
         Add waffle flag instances, indexed by name.
         """
-        _add_waffle_flag_instances(flags_dict)
+        _add_waffle_flag_instances(flags_dict, self.get_code_owners)
 
     def add_waffle_flag_state(self, flags_dict):
         """
@@ -73,13 +98,338 @@ class ToggleStateReport:
         """
         Get all waffle switches, indexed by name.
         """
-        return _get_all_waffle_switches()
+        return _get_all_waffle_switches(self.get_code_owners)
 
     def get_django_settings(self):
         """
         Get all Django settins, indexed by name.
         """
-        return _get_settings_state()
+        return _get_settings_state(self.get_code_owners)
+
+    def get_code_owners(self, modules):
+        """
+        Return the code owners of a batch of modules, as a dict indexed by module. Code owners are missing or None for
+        modules without owner.
+        """
+        return code_owner_resolver.get_code_owners(modules)
+
+
+class CachedToggleStateReport(ToggleStateReport):
+    """
+    Toggle state report that is cached in the current process, across calls.
+
+    The static parts of the report (toggle instances, with their module and code owner, and Django settings) are
+    computed once, and then only when toggle instances are created or deleted or when settings are modified. The
+    complete report is recomputed only when the waffle Flag and Switch tables are modified. Changes made in the current
+    process are detected with the save/delete signals of these models. Changes made in other processes are detected
+    with the number of rows and the latest "modified" timestamp of each table, which are fetched in two cheap queries.
+
+    The returned report is shared by all callers and should not be modified. Use as follows:
+
+        report = CachedToggleStateReport().as_dict()
+        stats = CachedToggleStateReport.get_cache_stats()
+    """
+
+    # Cache entries, indexed by report class, such that subclasses do not share their cache
+    _caches = {}
+    _caches_lock = threading.Lock()
+
+    def as_dict(self):
+        """
+        Return the cached report, after recomputing it if necessary.
+        """
+        cache = self._get_cache()
+        cache_key = (self._get_static_key(), self.get_state_key())
+        with cache.lock:
+            if cache.report is not None and cache.key == cache_key:
+                cache.hits += 1
+                return cache.report
+            cache.misses += 1
+            cache.report = super().as_dict()
+            cache.key = cache_key
+            cache.built_at = time.monotonic()
+            return cache.report
+
+    def get_state_key(self):
+        """
+        Return a value that changes whenever the waffle Flag and Switch tables are modified.
+        """
+        return (
+            _invalidation_counters["waffle"],
+            tuple(Flag.objects.aggregate(Count("id"), Max("modified")).values()),
+            tuple(Switch.objects.aggregate(Count("id"), Max("modified")).values()),
+        )
+
+    def add_waffle_flag_instances(self, flags_dict):
+        flags_dict.update(copy.deepcopy(self._get_static_parts()["waffle_flags"]))
+
+    def get_waffle_switches(self):
+        switches_dict = copy.deepcopy(self._get_static_parts()["waffle_switches"])
+        _add_waffle_switch_state(switches_dict)
+        _add_waffle_switch_computed_status(switches_dict)
+        return switches_dict
+
+    def get_django_settings(self):
+        return copy.deepcopy(self._get_static_parts()["django_settings"])
+
+    @classmethod
+    def get_cache_stats(cls):
+        """
+        Return a dict with the number of cache "hits" and "misses" and the "age" of the cached report, in seconds (None
+        if there is no cached report).
+        """
+        cache = cls._get_cache()
+        with cache.lock:
+            return {
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "age": None if cache.report is None else time.monotonic() - cache.built_at,
+            }
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Drop the cached report and reset the cache statistics.
+        """
+        with cls._caches_lock:
+            cls._caches.pop(cls, None)
+
+    @classmethod
+    def _get_cache(cls):
+        """
+        Return the report cache of this report class, which is created on first use.
+        """
+        with cls._caches_lock:
+            if cls not in cls._caches:
+                cls._caches[cls] = _ReportCache()
+            return cls._caches[cls]
+
+    @staticmethod
+    def _get_static_key():
+        return (_invalidation_counters["settings"], toggle_registry.version)
+
+    def _get_static_parts(self):
+        """
+        Return the cached parts of the report that do not depend on the database.
+        """
+        cache = self._get_cache()
+        static_key = self._get_static_key()
+        if cache.static_parts is None or cache.static_key != static_key:
+            waffle_flags = {}
+            super().add_waffle_flag_instances(waffle_flags)
+            waffle_switches = {}
+            _add_waffle_switch_instances(waffle_switches, self.get_code_owners)
+            cache.static_parts = {
+                "waffle_flags": waffle_flags,
+                "waffle_switches": waffle_switches,
+                "django_settings": super().get_django_settings(),
+            }
+            cache.static_key = static_key
+        return cache.static_parts
+
+
+class _ReportCache:
+    """
+    Cached report of a single report class.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.key = None
+        self.report = None
+        self.built_at = None
+        self.static_key = None
+        self.static_parts = None
+        self.hits = 0
+        self.misses = 0
+
+
+@receiver(post_save, sender=Flag)
+@receiver(post_delete, sender=Flag)
+@receiver(post_save, sender=Switch)
+@receiver(post_delete, sender=Switch)
+def _invalidate_waffle_state(**kwargs):
+    """
+    Invalidate the cached reports whenever a waffle Flag or Switch is saved or deleted.
+    """
+    _invalidation_counters["waffle"] += 1
+
+
+@receiver(setting_changed)
+def _invalidate_settings(**kwargs):
+    _invalidation_counters["settings"] += 1
+
+
+class StreamingToggleStateReport(ToggleStateReport):
+    """
+    Toggle state report that is produced incrementally, for very large waffle Flag and Switch tables.
+
+    Rows are fetched from the database in chunks of ``chunk_size`` rows, as plain values, and the report entries are
+    yielded one at a time in name order, such that the complete report is never held in memory. The entries are
+    identical to the entries of ``ToggleStateReport.as_dict``. Entries are sorted by Unicode code point, like Python
+    strings, regardless of the database collation: on MySQL, PostgreSQL, SQLite and Oracle, rows are sorted with a
+    binary collation, which does not use the index of the name column. On other databases, rows are sorted with the
+    column collation, which might differ from the Python string order, e.g: if it is case-insensitive.
+
+    Use as follows:
+
+        # Chunked JSON response
+        StreamingHttpResponse(StreamingToggleStateReport().iter_json(), content_type="application/json")
+
+        # Paginated response
+        page = StreamingToggleStateReport().get_page("waffle_flags", after=request.GET.get("after"), limit=100)
+    """
+
+    chunk_size = 2000
+
+    def iter_waffle_flags(self, after=None):
+        """
+        Iterate on waffle flag entries, sorted by name. If ``after`` is defined, only entries with a greater name are
+        returned.
+        """
+        for flag in self._iter_waffle_entries(
+            Flag, ("everyone", "note", "created", "modified"), _set_waffle_flag_state, self.get_waffle_flag_instances(),
+            after,
+        ):
+            flag["computed_status"] = self.get_waffle_flag_computed_status(flag)
+            yield flag
+
+    def iter_waffle_switches(self, after=None):
+        """
+        Iterate on waffle switch entries, sorted by name. If ``after`` is defined, only entries with a greater name
+        are returned.
+        """
+        for switch in self._iter_waffle_entries(
+            Switch, ("active", "note", "created", "modified"), _set_waffle_switch_state,
+            self.get_waffle_switch_instances(), after,
+        ):
+            switch["computed_status"] = "on" if switch.get("is_active") == "true" else "off"
+            yield switch
+
+    def iter_django_settings(self, after=None):
+        """
+        Iterate on Django setting entries, sorted by name. Settings are not stored in the database, so they are all
+        loaded in memory.
+        """
+        for setting in sorted_values_by_name(self.get_django_settings()):
+            if after is None or setting["name"] > after:
+                yield setting
+
+    def get_waffle_flag_instances(self):
+        """
+        Return the list of waffle flag instances, sorted by name.
+        """
+        return WaffleFlag.get_instances()
+
+    def get_waffle_switch_instances(self):
+        """
+        Return the list of waffle switch instances, sorted by name.
+        """
+        return WaffleSwitch.get_instances()
+
+    def get_page(self, section, after=None, limit=100):
+        """
+        Return a page of ``limit`` entries of a report section ("waffle_flags", "waffle_switches" or
+        "django_settings"), starting after the ``after`` cursor.
+
+        Return:
+            page (dict): this contains the "results" list and the "next" cursor, which is None on the last page.
+        """
+        iterators = {
+            "waffle_flags": self.iter_waffle_flags,
+            "waffle_switches": self.iter_waffle_switches,
+            "django_settings": self.iter_django_settings,
+        }
+        results = list(islice(iterators[section](after=after), limit + 1))
+        next_cursor = None
+        if len(results) > limit:
+            results = results[:limit]
+            next_cursor = results[-1]["name"]
+        return {"results": results, "next": next_cursor}
+
+    def iter_json(self):
+        """
+        Iterate on chunks of the JSON-serialized report, which is equivalent to the serialized ``as_dict`` report.
+        """
+        sections = (
+            ("waffle_flags", self.iter_waffle_flags()),
+            ("waffle_switches", self.iter_waffle_switches()),
+            ("django_settings", self.iter_django_settings()),
+        )
+        for section_index, (section, entries) in enumerate(sections):
+            yield ("{" if section_index == 0 else ", ") + json.dumps(section) + ": ["
+            for entry_index, entry in enumerate(entries):
+                yield (", " if entry_index else "") + json.dumps(entry)
+            yield "]"
+        yield "}"
+
+    def _iter_waffle_entries(self, model, fields, set_state, instances, after):
+        """
+        Merge the waffle toggle instances and the rows of the corresponding model into entries sorted by name.
+        """
+        instances_by_name = OrderedDict()
+        for instance in instances:
+            if after is None or instance.name > after:
+                instances_by_name.setdefault(instance.name, []).append(instance)
+        code_owners = _get_instances_code_owners(
+            [instance for name_instances in instances_by_name.values() for instance in name_instances],
+            self.get_code_owners,
+        )
+
+        # Instances that have a row in the database are merged with that row. Others are merged with the rows.
+        names_in_db = set()
+        instance_names = list(instances_by_name)
+        for start in range(0, len(instance_names), self.chunk_size):
+            names_in_db.update(
+                model.objects.filter(name__in=instance_names[start:start + self.chunk_size]).values_list(
+                    "name", flat=True
+                )
+            )
+
+        # Rows are sorted and filtered like Python strings, such that they can be merged with the instances
+        rows = model.objects.annotate(
+            sort_name=_get_binary_name(connections[router.db_for_read(model)].vendor)
+        ).order_by("sort_name").values_list("name", *fields)
+        if after is not None:
+            rows = rows.filter(sort_name__gt=after)
+
+        def db_entries():
+            for name, *values in rows.iterator(chunk_size=self.chunk_size):
+                entry = self._get_instance_entry(name, instances_by_name.get(name, []), code_owners)
+                set_state(entry, *values)
+                yield entry
+
+        instance_only_entries = (
+            self._get_instance_entry(name, name_instances, code_owners)
+            for name, name_instances in instances_by_name.items()
+            if name not in names_in_db
+        )
+        return heapq.merge(db_entries(), instance_only_entries, key=lambda entry: entry["name"])
+
+    @staticmethod
+    def _get_instance_entry(name, instances, code_owners):
+        """
+        Return the report entry of a toggle that is defined in the code but not in the database.
+        """
+        entry = OrderedDict()
+        entry["name"] = name
+        for instance in instances:
+            _add_toggle_instance_details(entry, instance, code_owners)
+        return entry
+
+
+def _get_binary_name(vendor):
+    """
+    Return an expression of the "name" column that sorts and compares like Python strings on this database vendor, or
+    the column itself on unsupported vendors. UTF-8 byte order is identical to the Unicode code point order.
+    """
+    if vendor == "mysql":
+        # Binary strings are compared byte by byte, whatever the character set of the column (utf8mb3 or utf8mb4)
+        return Func(F("name"), template="CAST(%(expressions)s AS BINARY)", output_field=CharField())
+    collation = _BINARY_COLLATIONS.get(vendor)
+    if collation is None:
+        return F("name")
+    return Collate(F("name"), collation)
 
 
 def sorted_values_by_name(entries):
@@ -104,25 +454,26 @@ def get_or_create_toggle_response(toggles_dict, toggle_name):
     return toggle
 
 
-def _get_all_waffle_switches():
+def _get_all_waffle_switches(get_code_owners=code_owner_resolver.get_code_owners):
     """
     Gets all waffle switches and their state.
     """
     switches_dict = {}
-    _add_waffle_switch_instances(switches_dict)
+    _add_waffle_switch_instances(switches_dict, get_code_owners)
     _add_waffle_switch_state(switches_dict)
     _add_waffle_switch_computed_status(switches_dict)
     return switches_dict
 
 
-def _add_waffle_switch_instances(switches_dict):
+def _add_waffle_switch_instances(switches_dict, get_code_owners=code_owner_resolver.get_code_owners):
     """
     Add details from waffle switch instances, like code_owner.
     """
     waffle_switch_instances = WaffleSwitch.get_instances()
+    code_owners = _get_instances_code_owners(waffle_switch_instances, get_code_owners)
     for switch_instance in waffle_switch_instances:
         switch = get_or_create_toggle_response(switches_dict, switch_instance.name)
-        _add_toggle_instance_details(switch, switch_instance)
+        _add_toggle_instance_details(switch, switch_instance, code_owners)
 
 
 def _add_waffle_switch_state(switches_dict):
@@ -132,11 +483,20 @@ def _add_waffle_switch_state(switches_dict):
     waffle_switches = Switch.objects.all()
     for switch_data in waffle_switches:
         switch = get_or_create_toggle_response(switches_dict, switch_data.name)
-        switch["is_active"] = "true" if switch_data.active else "false"
-        if switch_data.note:
-            switch["note"] = switch_data.note
-        switch["created"] = str(switch_data.created)
-        switch["modified"] = str(switch_data.modified)
+        _set_waffle_switch_state(
+            switch, switch_data.active, switch_data.note, switch_data.created, switch_data.modified
+        )
+
+
+def _set_waffle_switch_state(switch, active, note, created, modified):
+    """
+    Set the keys of a switch response that are derived from the waffle Switch model fields.
+    """
+    switch["is_active"] = "true" if active else "false"
+    if note:
+        switch["note"] = note
+    switch["created"] = str(created)
+    switch["modified"] = str(modified)
 
 
 def _add_waffle_switch_computed_status(switch_dict):
@@ -148,14 +508,15 @@ def _add_waffle_switch_computed_status(switch_dict):
         switch["computed_status"] = computed_status
 
 
-def _add_waffle_flag_instances(flags_dict):
+def _add_waffle_flag_instances(flags_dict, get_code_owners=code_owner_resolver.get_code_owners):
     """
     Add details from waffle flag instances, like code_owner.
     """
     waffle_flag_instances = WaffleFlag.get_instances()
+    code_owners = _get_instances_code_owners(waffle_flag_instances, get_code_owners)
     for flag_instance in waffle_flag_instances:
         flag = get_or_create_toggle_response(flags_dict, flag_instance.name)
-        _add_toggle_instance_details(flag, flag_instance)
+        _add_toggle_instance_details(flag, flag_instance, code_owners)
 
 
 def _add_waffle_flag_state(flags_dict):
@@ -165,18 +526,24 @@ def _add_waffle_flag_state(flags_dict):
     This sets the following keys: "everyone", "created", "modified".
     """
     for flag_data in Flag.objects.all():
-        if flag_data.everyone is True:
-            everyone = "yes"
-        elif flag_data.everyone is False:
-            everyone = "no"
-        else:
-            everyone = "unknown"
         flag = get_or_create_toggle_response(flags_dict, flag_data.name)
-        flag["everyone"] = everyone
-        if flag_data.note:
-            flag["note"] = flag_data.note
-        flag["created"] = str(flag_data.created)
-        flag["modified"] = str(flag_data.modified)
+        _set_waffle_flag_state(flag, flag_data.everyone, flag_data.note, flag_data.created, flag_data.modified)
+
+
+def _set_waffle_flag_state(flag, everyone, note, created, modified):
+    """
+    Set the keys of a flag response that are derived from the waffle Flag model fields.
+    """
+    if everyone is True:
+        flag["everyone"] = "yes"
+    elif everyone is False:
+        flag["everyone"] = "no"
+    else:
+        flag["everyone"] = "unknown"
+    if note:
+        flag["note"] = note
+    flag["created"] = str(created)
+    flag["modified"] = str(modified)
 
 
 def _get_waffle_flag_computed_status(flag):
@@ -197,87 +564,70 @@ def _get_waffle_flag_computed_status(flag):
     return "off"
 
 
-def _get_settings_state():
+def _get_settings_state(get_code_owners=code_owner_resolver.get_code_owners):
     """
     Return a list of setting-based toggles: Django settings, SettingToggle and SettingDictToggle instances.
     SettingToggle and SettingDictToggle override the settings with identical names (if any).
     """
     settings_dict = {}
     _add_settings(settings_dict)
-    _add_setting_toggles(settings_dict)
-    _add_setting_dict_toggles(settings_dict)
+    _add_setting_toggles(settings_dict, get_code_owners)
+    _add_setting_dict_toggles(settings_dict, get_code_owners)
     return settings_dict
 
 
-def _add_setting(settings_dict, setting_value, setting_name):
-    """
-    Recursively process a setting value and add boolean values to settings_dict.
-
-    Args:
-        settings_dict: Dictionary to store the processed settings
-        setting_value: The value of the setting to process
-        setting_name: The name/path of the setting
-    """
-    if isinstance(setting_value, bool):
-        toggle_response = get_or_create_toggle_response(settings_dict, setting_name)
-        toggle_response["is_active"] = setting_value
-    elif isinstance(setting_value, dict):
-        for dict_key, dict_value in setting_value.items():
-            nested_name = setting_dict_name(setting_name, dict_key)
-            _add_setting(settings_dict, dict_value, nested_name)
-
-
 def _add_settings(settings_dict):
     """
     Fill the `settings_dict` with deeply nested dictionaries with true or false values.
     """
-    settings_dict_copy = {}
-    default_attribute_value = object()  # default is not a bool, so won't be included
-    for attr in dir(settings):
-        if not attr.startswith('__'):
-            value = getattr(settings, attr, default_attribute_value)
-            settings_dict_copy[attr] = value
-
-    # Process each top-level setting
-    for setting_name, value in settings_dict_copy.items():
-        _add_setting(settings_dict, value, setting_name)
+    for setting_name, value in get_boolean_settings().items():
+        toggle_response = get_or_create_toggle_response(settings_dict, setting_name)
+        toggle_response["is_active"] = value
 
 
-def _add_setting_toggles(settings_dict):
+def _add_setting_toggles(settings_dict, get_code_owners=code_owner_resolver.get_code_owners):
     """
     Fill the `settings_dict` with values from the list of SettingToggle instances.
     """
-    for toggle in SettingToggle.get_instances():
+    setting_toggles = SettingToggle.get_instances()
+    code_owners = _get_instances_code_owners(setting_toggles, get_code_owners)
+    for toggle in setting_toggles:
         toggle_response = get_or_create_toggle_response(settings_dict, toggle.name)
         toggle_response["is_active"] = toggle.is_enabled()
-        _add_toggle_instance_details(toggle_response, toggle)
+        _add_toggle_instance_details(toggle_response, toggle, code_owners)
+
+
+def _get_instances_code_owners(toggle_instances, get_code_owners):
+    """
+    Resolve the code owners of the modules of a list of toggle instances, in a single batch.
+    """
+    return get_code_owners({instance.module_name for instance in toggle_instances if instance.module_name})
 
 
-def _add_toggle_instance_details(toggle, toggle_instance):
+def _add_toggle_instance_details(toggle, toggle_instance, code_owners=None):
     """
-    Add details (class, module, code_owner) from a specific toggle instance.
+    Add details (class, module, code_owner) from a specific toggle instance. Code owners are looked up in the
+    ``code_owners`` dict, if defined.
     """
     toggle["class"] = toggle_instance.__class__.__name__
     toggle["module"] = toggle_instance.module_name
     if toggle_instance.module_name:
-        code_owner = get_code_owner_from_module(toggle_instance.module_name)
+        if code_owners is None:
+            code_owner = code_owner_resolver.get_code_owner(toggle_instance.module_name)
+        else:
+            code_owner = code_owners.get(toggle_instance.module_name)
         if code_owner:
             toggle["code_owner"] = code_owner
 
 
-def _add_setting_dict_toggles(settings_dict):
+def _add_setting_dict_toggles(settings_dict, get_code_owners=code_owner_resolver.get_code_owners):
     """
     Fill the `settings_dict` with values from the list of SettingDictToggle instances.
     """
-    for toggle in SettingDictToggle.get_instances():
+    setting_dict_toggles = SettingDictToggle.get_instances()
+    code_owners = _get_instances_code_owners(setting_dict_toggles, get_code_owners)
+    for toggle in setting_dict_toggles:
         name = setting_dict_name(toggle.name, toggle.key)
         toggle_response = get_or_create_toggle_response(settings_dict, name)
         toggle_response["is_active"] = toggle.is_enabled()
-        _add_toggle_instance_details(toggle_response, toggle)
-
-
-def setting_dict_name(dict_name, key):
-    """
-    Return the name associated to a `dict_name[key]` setting.
-    """
-    return "{dict_name}['{key}']".format(dict_name=dict_name, key=key)
+        _add_toggle_instance_details(toggle_response, toggle, code_owners)
@@ -0,0 +1,134 @@
+"""
+Traversal of Django settings, to find boolean values for the toggle state report.
+"""
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class SettingTraversal:
+    """
+    Find the boolean values in Django settings, including in nested dicts.
+
+    Arguments:
+        allowlist (list): if defined, only the top-level settings that match one of these patterns are traversed.
+        denylist (list): top-level settings that match one of these patterns are not traversed.
+        max_depth (int): if defined, nested dicts are not traversed beyond this depth. The top-level settings have a
+            depth of 0.
+
+    Patterns are either setting names or, when they end with "*", setting name prefixes. Dicts that contain themselves,
+    directly or not, are traversed only once.
+    """
+
+    def __init__(self, allowlist=None, denylist=None, max_depth=None):
+        self.allowlist = _compile_patterns(allowlist)
+        self.denylist = _compile_patterns(denylist) or ((), ())
+        self.max_depth = max_depth
+
+    def get_boolean_settings(self, settings_obj):
+        """
+        Return the boolean settings, as a dict indexed by setting name, in the same order as ``dir(settings_obj)``.
+        """
+        boolean_settings = {}
+        missing = object()
+        for setting_name in dir(settings_obj):
+            if setting_name.startswith("__") or not self.is_included(setting_name):
+                continue
+            value = getattr(settings_obj, setting_name, missing)
+            self._add_value(boolean_settings, value, setting_name, 0, set())
+        return boolean_settings
+
+    def is_included(self, setting_name):
+        """
+        Return whether a top-level setting should be traversed.
+        """
+        if _matches(setting_name, self.denylist):
+            return False
+        return self.allowlist is None or _matches(setting_name, self.allowlist)
+
+    def _add_value(self, boolean_settings, value, name, depth, parent_ids):
+        """
+        Add the boolean values of a setting to ``boolean_settings``, recursing into dicts up to ``max_depth``.
+        ``parent_ids`` holds the ids of the enclosing dicts, such that cyclic references are not followed.
+        """
+        if isinstance(value, bool):
+            boolean_settings[name] = value
+        elif isinstance(value, dict):
+            if self.max_depth is not None and depth >= self.max_depth:
+                return
+            if id(value) in parent_ids:
+                return
+            parent_ids.add(id(value))
+            for key, nested_value in value.items():
+                self._add_value(boolean_settings, nested_value, setting_dict_name(name, key), depth + 1, parent_ids)
+            parent_ids.remove(id(value))
+
+
+def get_boolean_settings():
+    """
+    Return the boolean Django settings, as a dict indexed by setting name.
+
+    The traversal is configured by the following settings, which are all optional:
+
+        EDX_TOGGLES_REPORT_SETTINGS_ALLOWLIST: list of setting names or prefixes that are traversed.
+        EDX_TOGGLES_REPORT_SETTINGS_DENYLIST: list of setting names or prefixes that are not traversed.
+        EDX_TOGGLES_REPORT_SETTINGS_MAX_DEPTH: maximum depth of the traversal of nested dicts.
+
+    Results are cached until the settings object is replaced or a setting is modified, e.g: with ``override_settings``.
+    The returned dict is shared by all callers and should not be modified.
+    """
+    cache_key = (id(getattr(settings, "_wrapped", settings)), _cache["generation"])
+    with _cache_lock:
+        if _cache["key"] == cache_key:
+            return _cache["boolean_settings"]
+    traversal = SettingTraversal(
+        allowlist=getattr(settings, "EDX_TOGGLES_REPORT_SETTINGS_ALLOWLIST", None),
+        denylist=getattr(settings, "EDX_TOGGLES_REPORT_SETTINGS_DENYLIST", None),
+        max_depth=getattr(settings, "EDX_TOGGLES_REPORT_SETTINGS_MAX_DEPTH", None),
+    )
+    boolean_settings = traversal.get_boolean_settings(settings)
+    with _cache_lock:
+        _cache["key"] = cache_key
+        _cache["boolean_settings"] = boolean_settings
+    return boolean_settings
+
+
+def setting_dict_name(dict_name, key):
+    """
+    Return the name associated to a `dict_name[key]` setting.
+    """
+    return "{dict_name}['{key}']".format(dict_name=dict_name, key=key)
+
+
+def _compile_patterns(patterns):
+    """
+    Split patterns into a tuple of exact names and a tuple of prefixes, or return None if patterns are undefined.
+    """
+    if patterns is None:
+        return None
+    names = tuple(pattern for pattern in patterns if not pattern.endswith("*"))
+    prefixes = tuple(pattern[:-1] for pattern in patterns if pattern.endswith("*"))
+    return names, prefixes
+
+
+def _matches(setting_name, compiled_patterns):
+    names, prefixes = compiled_patterns
+    return setting_name in names or setting_name.startswith(prefixes)
+
+
+# Cache of the boolean settings. The generation is incremented whenever a setting is modified.
+_cache = {"key": None, "boolean_settings": None, "generation": 0}
+_cache_lock = threading.Lock()
+
+
+@receiver(setting_changed)
+def _clear_boolean_settings(**kwargs):
+    """
+    Drop the cached boolean settings whenever a setting is modified, e.g: in tests.
+    """
+    with _cache_lock:
+        _cache["generation"] += 1
+        _cache["key"] = None
+        _cache["boolean_settings"] = None
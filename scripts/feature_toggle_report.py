@@ -2,11 +2,20 @@ import os
 import re
 import yaml
 import logging
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 
-from scripts.ida_toggles import IDA, add_toggle_state_to_idas, add_toggle_annotations_to_idas
+from scripts.ida_toggles import (
+    IDA,
+    add_toggle_state_to_idas,
+    add_toggle_annotations_to_idas,
+    get_annotation_files,
+    get_toggle_state_files,
+    load_annotation_groups,
+    load_toggle_items,
+)
 from scripts.toggles import ToggleTypes
 from scripts.renderers import CsvRenderer
 
@@ -47,7 +56,22 @@ logging.basicConfig(level=logging.INFO)
     default=None,
     help='alternative method to do configuration, the command-line options will have priority',
     )
-def main(annotations_dir, toggle_data_dir, output_file_path, env, toggle_type, verbose_report, configuration):
+@click.option(
+    '--jobs',
+    type=click.IntRange(min=1),
+    default=1,
+    help='Number of processes used to parse the toggle state and annotation files',
+    )
+@click.option(
+    '--annotation-cache-dir',
+    type=click.Path(file_okay=False),
+    default=None,
+    help='Directory where parsed annotation files are cached, such that unchanged files are not parsed again',
+    )
+def main(
+    annotations_dir, toggle_data_dir, output_file_path, env, toggle_type, verbose_report, configuration, jobs,
+    annotation_cache_dir,
+):
     """
     Script to process annotation and state data for toggles and output it a report.
 
@@ -98,18 +122,57 @@ def main(annotations_dir, toggle_data_dir, output_file_path, env, toggle_type, v
         else:
             raise Exception(f'Directory at {toggle_data_dir} does not match required structure, see readme for more info')
 
-    idas = {}
+    # if an env is specified in requested_envs, filter out everyother env
+    # if no env is specified, assume all envs are valid
+    selected_env_data_paths = []
     for env_data_path, env_name in env_data_paths:
-        # if an env is specified in requested_envs, filter out everyother env
-        # if no env is specified, assume all envs are valid
         if requested_envs and env_name not in requested_envs:
             LOGGER.debug(f"Skip reading toggle state data for {env_name} env")
             continue
+        selected_env_data_paths.append((env_data_path, env_name))
 
-        # add data for each ida
-        add_toggle_state_to_idas(idas, env_data_path, configuration.get("ida", defaultdict(dict)), env_name=env_name)
-
-        add_toggle_annotations_to_idas(idas, annotations_dir, configuration.get("ida", defaultdict(dict)))
+    # parse files, in parallel if requested; each annotation file is parsed only once, although its
+    # annotations are added again after the state data of each env, as they may create new toggles
+    idas = {}
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 and selected_env_data_paths else None
+    try:
+        annotation_paths = []
+        if selected_env_data_paths:
+            annotation_paths = [path for path, _ in get_annotation_files(annotations_dir)]
+        if executor is None:
+            # dumps are parsed when they are merged, so that a single dump is in memory at a time
+            load_state_file = None
+            loaded_annotation_files = {
+                path: load_annotation_groups(path, annotation_cache_dir) for path in annotation_paths
+            }
+        else:
+            # annotation files are usually the largest, so they are submitted first
+            annotation_futures = [
+                executor.submit(load_annotation_groups, path, annotation_cache_dir) for path in annotation_paths
+            ]
+            state_paths = [
+                path for env_data_path, _ in selected_env_data_paths
+                for path, _ in get_toggle_state_files(env_data_path)
+            ]
+            load_state_file = OrderedFileLoader(executor, load_toggle_items, state_paths, window=2 * jobs)
+            loaded_annotation_files = {
+                path: future.result() for path, future in zip(annotation_paths, annotation_futures)
+            }
+
+        # merge data in files order, such that the report does not depend on the number of jobs
+        for env_data_path, env_name in selected_env_data_paths:
+            # add data for each ida
+            add_toggle_state_to_idas(
+                idas, env_data_path, configuration.get("ida", defaultdict(dict)), env_name=env_name,
+                load_toggle_items=load_state_file,
+            )
+            add_toggle_annotations_to_idas(
+                idas, annotations_dir, configuration.get("ida", defaultdict(dict)),
+                loaded_files=loaded_annotation_files,
+            )
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
 
     toggle_data = []
     if verbose_report:
@@ -126,5 +189,38 @@ def main(annotations_dir, toggle_data_dir, output_file_path, env, toggle_type, v
     renderer.render_csv_report(toggle_data, output_file_path, toggle_type_filter, partial_header)
 
 
+class OrderedFileLoader:
+    """
+    Load files in worker processes, and return their contents in the order of the given paths.
+
+    At most `window` files are loaded ahead of the file that is requested, and
+    the contents of a file are dropped by the loader once they are returned,
+    so that memory usage does not depend on the number of files.
+    """
+
+    def __init__(self, executor, load, paths, window):
+        self.executor = executor
+        self.load = load
+        self.paths = iter(paths)
+        self.pending = deque()
+        for _ in range(window):
+            self._submit_next()
+
+    def __call__(self, path):
+        """
+        Return the contents of the file at `path`, which must be the next file in order.
+        """
+        expected_path, future = self.pending.popleft()
+        if path != expected_path:
+            raise ValueError(f'Files must be loaded in order: expected {expected_path}, got {path}')
+        self._submit_next()
+        return future.result()
+
+    def _submit_next(self):
+        path = next(self.paths, None)
+        if path is not None:
+            self.pending.append((path, self.executor.submit(self.load, path)))
+
+
 if __name__ == '__main__':
     main()
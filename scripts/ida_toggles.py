@@ -4,19 +4,35 @@ Code to represent an independently deployed application and its associated toggl
 """
 
 import collections
+import hashlib
 import io
 import json
 import logging
 import os
+import pickle
 import re
+import tempfile
 import yaml
 from enum import Enum
 
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
 from scripts.toggles import Toggle, ToggleAnnotation, ToggleState, ToggleTypes
 
 LOGGER = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+TOGGLE_TOKEN_PATTERN = re.compile(r'.. toggle_(.*):')
+
+# The libyaml loader is much faster than the pure-Python one, when available
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Incremented whenever the format of cached annotation groups changes
+ANNOTATION_CACHE_VERSION = 1
+
 
 class IDA:
     """ Represents an independently deployed application. """
@@ -46,16 +62,15 @@ class IDA:
         Given the path to a file containing the SQL dump for a
         feature toggle type in an IDA, parse out the information relevant
         to each toggle and add it to this IDA.
+
+        If the ijson streaming parser is installed, the file is parsed one
+        toggle at a time, so that memory usage does not depend on the size
+        of the file.
         """
-        with open(state_data_path) as data_file:
-            try:
-                state_data = json.loads(data_file.read())
-            except:
-                LOGGER.error(
-                f'Loading json file at: {state_data_path} failed, check toggle data in file is formatted correctly'
-                )
-                raise
-        self._add_toggle_data(state_data, env_name)
+        if ijson is None:
+            self._add_toggle_data(load_toggle_state_file(state_data_path), env_name)
+        else:
+            self._add_toggle_items(iter_toggle_state_file(state_data_path), env_name)
 
     def _add_toggle_data(self, state_data, env_name):
         """
@@ -65,12 +80,29 @@ class IDA:
         Arguments:
             state_data: dict with structure: {toggle_types_1:[toggle_dicts], toggle_types_2:[toggles_dicts]}
         """
-        for toggle_type, toggles_data in state_data.items():
-            toggle_type = ToggleTypes.get_internally_consistent_toggle_type(toggle_type)
+        self._add_toggle_items(
+            (
+                (toggle_type, toggle_data)
+                for toggle_type, toggles_data in state_data.items()
+                for toggle_data in toggles_data
+            ),
+            env_name,
+        )
 
-            for toggle_data in toggles_data:
-                toggle_name = toggle_data.get('name')
-                toggle = self._get_or_create_toggle_and_state(toggle_type, toggle_name, toggle_data, env_name)
+    def _add_toggle_items(self, toggle_items, env_name):
+        """
+        Add toggles state data to toggles, like `_add_toggle_data`.
+        Arguments:
+            toggle_items: iterable of (toggle_type, toggle_dict) tuples
+        """
+        internal_toggle_types = {}
+        for toggle_type, toggle_data in toggle_items:
+            if toggle_type not in internal_toggle_types:
+                internal_toggle_types[toggle_type] = ToggleTypes.get_internally_consistent_toggle_type(toggle_type)
+            toggle_name = toggle_data.get('name')
+            self._get_or_create_toggle_and_state(
+                internal_toggle_types[toggle_type], toggle_name, toggle_data, env_name
+            )
 
         LOGGER.info(
             f'Finished collecting toggle state for {self.name}'
@@ -104,16 +136,20 @@ class IDA:
 
         return toggle
 
-    def add_annotations(self):
+    def add_annotations(self, annotation_groups=None):
         """
         Read the code annotation file specified at `annotation_report_path`,
         adding the annotations to the Toggles in this IDA.
+
+        Arguments:
+            annotation_groups: grouped annotations of the annotation file, if
+                it was already loaded (see `load_annotation_groups`).
         """
         if not self.annotation_report_path:
             return
-        with open(self.annotation_report_path, 'r') as annotation_file:
-            annotation_contents = yaml.safe_load(annotation_file.read())
-            self._add_annotation_data_to_toggle_state(annotation_contents)
+        if annotation_groups is None:
+            annotation_groups = load_annotation_groups(self.annotation_report_path)
+        self._add_annotation_groups(annotation_groups)
         LOGGER.info(
             f'Finished collecting annotations for {self.name}'
         )
@@ -136,6 +172,16 @@ class IDA:
         If a toggle has already been added, add the annotation data. If not,
         create a new Toggle for this IDA and add the annotation data.
         """
+        self._add_annotation_groups(group_annotation_file(annotation_file_contents))
+
+    def _add_annotation_groups(self, annotation_groups_by_file):
+        """
+        Add annotation data to the toggles in this IDA, like
+        `_add_annotation_data_to_toggle_state`.
+        Arguments:
+            annotation_groups_by_file: list of (source_file, annotation_groups)
+                tuples, as returned by `group_annotation_file`
+        """
         def _get_annotation_data(annotation_token, annotations):
             """
             Given a list of annotations (dictionaries), get the
@@ -151,30 +197,12 @@ class IDA:
                     break
             return data
 
-        def group_annotations(annotations):
-            """
-            Given a list of code annotations, split them into individual lists
-            based on their 'report_group_id'.
-            """
-            groups = []
-            for i in {a['report_group_id'] for a in annotations}:
-                group = list(filter(
-                    lambda a: a['report_group_id'] == i, annotations
-                ))
-                groups.append(group)
-            return groups
-
-        def clean_token(token_string):
-            return re.search(r'.. toggle_(.*):', token_string).group(1)
-
-        for source_file, annotations in annotation_file_contents.items():
+        for source_file, annotation_groups in annotation_groups_by_file:
             LOGGER.info(
                 'Collecting annotation groups for {} in {}'.format(
                     self.name, source_file
                 )
             )
-
-            annotation_groups = group_annotations(annotations)
             LOGGER.info(
                 'Collected annotation groups: {}'.format(len(annotation_groups))
             )
@@ -219,19 +247,218 @@ class IDA:
                 toggle.annotations = toggle_annotation
 
 
-def add_toggle_state_to_idas(idas, state_data_path, idas_configuration=None, env_name=None):
+def clean_token(token_string):
+    return TOGGLE_TOKEN_PATTERN.search(token_string).group(1)
+
+
+def group_annotations(annotations):
+    """
+    Given a list of code annotations, split them into individual lists
+    based on their 'report_group_id', in a single pass. Annotations keep
+    their order within each group.
+    """
+    groups = {}
+    for annotation in annotations:
+        group = groups.get(annotation['report_group_id'])
+        if group is None:
+            group = groups[annotation['report_group_id']] = []
+        group.append(annotation)
+    # Groups have always been returned in the iteration order of the set of
+    # group ids. Adding the ids to a set one by one, in order of first
+    # appearance, produces the same set as adding the id of every annotation.
+    return [groups[group_id] for group_id in set(iter(groups))]
+
+
+def group_annotation_file(annotation_file_contents):
+    """
+    Given the contents of a code annotations report file, return a list of
+    (source_file, annotation_groups) tuples.
+    """
+    return [
+        (source_file, group_annotations(annotations))
+        for source_file, annotations in annotation_file_contents.items()
+    ]
+
+
+def load_toggle_state_file(state_data_path):
+    """
+    Read and parse a file containing the SQL dump for a feature toggle type
+    in an IDA.
+    """
+    with open(state_data_path) as data_file:
+        try:
+            return json.loads(data_file.read())
+        except:
+            LOGGER.error(
+            f'Loading json file at: {state_data_path} failed, check toggle data in file is formatted correctly'
+            )
+            raise
+
+
+def load_toggle_items(state_data_path):
+    """
+    Read and parse a file containing the SQL dump for a feature toggle type
+    in an IDA, and return the list of its (toggle_type, toggle_dict) tuples,
+    as consumed by `IDA._add_toggle_items`. Only this list needs to be sent
+    back by worker processes, not the parsed file.
+
+    The file is streamed with ijson when it is installed, like in
+    `IDA.add_toggle_data`, so that the parsed file is never in memory.
+    """
+    if ijson is not None:
+        return list(iter_toggle_state_file(state_data_path))
+    return [
+        (toggle_type, toggle_data)
+        for toggle_type, toggles_data in load_toggle_state_file(state_data_path).items()
+        for toggle_data in toggles_data
+    ]
+
+
+def iter_toggle_state_file(state_data_path):
+    """
+    Parse a file containing the SQL dump for a feature toggle type in an IDA
+    incrementally, with ijson, and yield (toggle_type, toggle_dict) tuples.
+    A single toggle dict is in memory at a time.
+    """
+    with open(state_data_path, 'rb') as data_file:
+        try:
+            toggle_type = None
+            builder = None
+            depth = 0
+            for _prefix, event, value in ijson.parse(data_file, use_float=True):
+                if event in ('end_map', 'end_array'):
+                    depth -= 1
+                if depth == 1 and event == 'map_key':
+                    # {toggle_type: [toggle_dicts]}
+                    toggle_type = value
+                elif depth >= 2:
+                    if builder is None:
+                        builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                    if depth == 2 and event not in ('start_map', 'start_array'):
+                        # end of a toggle dict
+                        yield toggle_type, builder.value
+                        builder = None
+                if event in ('start_map', 'start_array'):
+                    depth += 1
+        except ijson.JSONError:
+            LOGGER.error(
+            f'Loading json file at: {state_data_path} failed, check toggle data in file is formatted correctly'
+            )
+            raise
+
+
+def load_annotation_file(annotation_report_path):
+    """
+    Read and parse a code annotations report file.
+    """
+    with open(annotation_report_path, 'rb') as annotation_file:
+        return parse_annotation_report(annotation_file.read())
+
+
+def parse_annotation_report(content):
+    """
+    Parse the contents of a code annotations report file.
+    """
+    return yaml.load(content, Loader=YAML_LOADER)
+
+
+def load_annotation_groups(annotation_report_path, cache_dir=None):
+    """
+    Read a code annotations report file, and return its annotations grouped
+    by `group_annotation_file`.
+
+    If `cache_dir` is set, grouped annotations are cached in that directory,
+    and reused as long as the path, size, modification time and content hash
+    of the report file do not change, such that the report is not parsed
+    again. Cache files are pickled, so the cache directory must not be
+    writable by untrusted users.
+    """
+    with open(annotation_report_path, 'rb') as annotation_file:
+        file_stat = os.fstat(annotation_file.fileno())
+        content = annotation_file.read()
+    if cache_dir is None:
+        return group_annotation_file(parse_annotation_report(content))
+
+    absolute_path = os.path.abspath(annotation_report_path)
+    cache_key = {
+        'version': ANNOTATION_CACHE_VERSION,
+        'path': absolute_path,
+        'size': file_stat.st_size,
+        'mtime_ns': file_stat.st_mtime_ns,
+        'sha256': hashlib.sha256(content).hexdigest(),
+    }
+    cache_path = os.path.join(cache_dir, hashlib.sha256(absolute_path.encode()).hexdigest() + '.pickle')
+    cached = _read_annotation_cache(cache_path)
+    if isinstance(cached, dict) and cached.get('key') == cache_key:
+        LOGGER.info(f'Using cached annotations for {annotation_report_path}')
+        return cached['groups']
+
+    annotation_groups = group_annotation_file(parse_annotation_report(content))
+    _write_annotation_cache(cache_dir, cache_path, {'key': cache_key, 'groups': annotation_groups})
+    return annotation_groups
+
+
+def _read_annotation_cache(cache_path):
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except FileNotFoundError:
+        return None
+    except Exception:  # pylint: disable=broad-except
+        LOGGER.warning(f'Ignoring unreadable annotation cache file at: {cache_path}')
+        return None
+
+
+def _write_annotation_cache(cache_dir, cache_path, cached):
+    """
+    Write a cache file atomically, such that concurrent runs never read a partial file.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as cache_file:
+            pickle.dump(cached, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file.name, cache_path)
+    except OSError:
+        LOGGER.warning(f'Writing annotation cache file at: {cache_path} failed', exc_info=True)
+
+
+def get_toggle_state_files(state_data_path):
+    """
+    Return the list of (path, ida name) tuples of the SQL dump files in a
+    directory, in directory listing order.
+    """
+    ida_name_pattern = re.compile(r'(?P<ida>[a-z]*)_.*json')
+    return [
+        (os.path.join(state_data_path, f), ida_name_pattern.search(f).group('ida'))
+        for f in os.listdir(state_data_path) if ida_name_pattern.search(f)
+    ]
+
+
+def get_annotation_files(annotation_report_files_path):
+    """
+    Return the list of (path, ida name) tuples of the annotation reports in a
+    directory, in directory listing order.
+    """
+    ida_name_pattern = re.compile(r'(?P<ida>[a-z]*)[-_]annotations.ya?ml')
+    return [
+        (os.path.join(annotation_report_files_path, f), ida_name_pattern.search(f).group('ida'))
+        for f in os.listdir(annotation_report_files_path) if ida_name_pattern.search(f)
+    ]
+
+
+def add_toggle_state_to_idas(idas, state_data_path, idas_configuration=None, env_name=None, load_toggle_items=None):
     """
     Given a dictionary of IDAs to consider, and the path to a directory
     containing the SQL dumps for feature toggles in said IDAs, read each dump
     file, parsing and linking it's data into the IDA associated with it.
+
+    Arguments:
+        load_toggle_items: function that returns the toggle items of a dump
+            file, given its path (see `load_toggle_items`), e.g: to load files
+            in other processes. By default, each file is read and parsed here.
     """
-    ida_name_pattern = re.compile(r'(?P<ida>[a-z]*)_.*json')
-    sql_dump_files = [
-        f for f in os.listdir(state_data_path) if ida_name_pattern.search(f)
-    ]
-    for sql_dump_file in sql_dump_files:
-        sql_dump_file_path = os.path.join(state_data_path, sql_dump_file)
-        ida_name = ida_name_pattern.search(sql_dump_file).group('ida')
+    for sql_dump_file_path, ida_name in get_toggle_state_files(state_data_path):
         if ida_name not in idas:
             idas[ida_name] = IDA(ida_name, idas_configuration.get(ida_name, None))
         LOGGER.info(
@@ -239,27 +466,28 @@ def add_toggle_state_to_idas(idas, state_data_path, idas_configuration=None, env
                 sql_dump_file_path, ida_name
             )
         )
-        idas[ida_name].add_toggle_data(sql_dump_file_path, env_name=env_name)
+        if load_toggle_items is not None:
+            idas[ida_name]._add_toggle_items(load_toggle_items(sql_dump_file_path), env_name)
+        else:
+            idas[ida_name].add_toggle_data(sql_dump_file_path, env_name=env_name)
         LOGGER.info('=' * 100)
 
 
-def add_toggle_annotations_to_idas(idas, annotation_report_files_path, idas_configuration=None):
+def add_toggle_annotations_to_idas(idas, annotation_report_files_path, idas_configuration=None, loaded_files=None):
     """
     Given a dictionary of IDAs to consider, and the path to a directory
     containing the annotation reports for feature toggles in said IDAs, read
     each file, parsing and linking the annotation data to the toggle state
     data in the IDA.
+
+    Arguments:
+        loaded_files: dict of already loaded annotation groups (see
+            `load_annotation_groups`), indexed by path. Files that are not in
+            this dict are read and parsed.
     """
-    ida_name_pattern = re.compile(r'(?P<ida>[a-z]*)[-_]annotations.ya?ml')
-    annotation_files = [
-        f for f in os.listdir(annotation_report_files_path)
-        if ida_name_pattern.search(f)
-    ]
-    for annotation_file in annotation_files:
-        annotation_file_path = os.path.join(
-            annotation_report_files_path, annotation_file
-        )
-        ida_name = ida_name_pattern.search(annotation_file).group('ida')
+    loaded_files = loaded_files or {}
+    for annotation_file_path, ida_name in get_annotation_files(annotation_report_files_path):
+        annotation_file = os.path.basename(annotation_file_path)
         if ida_name not in idas:
             idas[ida_name] = IDA(ida_name, idas_configuration.get(ida_name, None))
         LOGGER.info(
@@ -268,5 +496,5 @@ def add_toggle_annotations_to_idas(idas, annotation_report_files_path, idas_conf
             )
         )
         idas[ida_name].annotation_report_path = annotation_file_path
-        idas[ida_name].add_annotations()
+        idas[ida_name].add_annotations(loaded_files.get(annotation_file_path))
         LOGGER.info('=' * 100)
@@ -47,3 +47,35 @@ def test_course_waffle_flag_handling(sample_ida):
     assert course_waffle_flag_toggle["state"]["num_courses_forced_off"] == 1
     assert course_waffle_flag_toggle["state"]["num_orgs_forced_on"] == 1
     assert course_waffle_flag_toggle["state"]["num_orgs_forced_off"] == 2
+
+def get_raw_states(ida):
+    return [
+        (toggle_type, toggle.name, [(state.env_name, dict(state._raw_state_data)) for state in toggle.states])
+        for toggle_type, toggles in ida.toggles.items()
+        for toggle in toggles.values()
+    ]
+
+def test_streaming_add_toggle_data(sample_ida):
+    """
+    Tests that parsing the json file incrementally creates the same toggles as parsing it at once
+    """
+    pytest.importorskip("ijson")
+    ida = IDA('my-ida')
+    ida.add_toggle_data("scripts/tests/toggle_data.json", "env")
+    assert get_raw_states(ida) == get_raw_states(sample_ida)
+
+def test_add_toggle_data_without_streaming_parser(sample_ida, monkeypatch):
+    """
+    Tests that the json file is parsed at once when ijson is not installed
+    """
+    monkeypatch.setattr("scripts.ida_toggles.ijson", None)
+    ida = IDA('my-ida')
+    ida.add_toggle_data("scripts/tests/toggle_data.json", "env")
+    assert get_raw_states(ida) == get_raw_states(sample_ida)
+
+def test_streaming_add_toggle_data_invalid_json(tmp_path):
+    ijson = pytest.importorskip("ijson")
+    data_path = tmp_path / "ida_waffle.json"
+    data_path.write_text('{"waffle_flags": [{"name": "some.flag"}')
+    with pytest.raises(ijson.JSONError):
+        IDA('my-ida').add_toggle_data(str(data_path), "env")
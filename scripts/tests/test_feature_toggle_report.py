@@ -0,0 +1,184 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+import yaml
+from click.testing import CliRunner
+
+from scripts import ida_toggles
+from scripts.feature_toggle_report import OrderedFileLoader, main
+
+
+def write_report_data(tmp_path):
+    """
+    Write the toggle state of two IDAs in two envs, and the annotations of one IDA.
+    """
+    annotations_dir = tmp_path / "annotations"
+    annotations_dir.mkdir()
+    toggle_data_dir = tmp_path / "toggle_data"
+    for env_name in ("prod", "stage"):
+        env_dir = toggle_data_dir / f"{env_name}_env"
+        env_dir.mkdir(parents=True)
+        for ida_name in ("lms", "discovery"):
+            state_data = {
+                "waffle_flags": [
+                    {
+                        "name": f"{ida_name}.flag{i}",
+                        "everyone": i % 2 == 0 if env_name == "prod" else None,
+                        "created": "2020-01-01 00:00:00+00:00",
+                        "modified": "2020-01-02 00:00:00+00:00",
+                    }
+                    for i in range(5)
+                ],
+                "waffle_switches": [{"name": f"{ida_name}.switch", "is_active": env_name == "prod"}],
+            }
+            (env_dir / f"{ida_name}_waffle.json").write_text(json.dumps(state_data))
+    annotations = {
+        "lms/module.py": [
+            {
+                "annotation_data": name,
+                "annotation_token": ".. toggle_name:",
+                "filename": "lms/module.py",
+                "found_by": "python",
+                "line_number": 10 * group_id,
+                "report_group_id": group_id,
+            }
+            for group_id, name in enumerate(["lms.flag1", "lms.annotated_only"], start=1)
+        ] + [
+            {
+                "annotation_data": ["WaffleFlag"],
+                "annotation_token": ".. toggle_implementation:",
+                "filename": "lms/module.py",
+                "found_by": "python",
+                "line_number": 10 * group_id + 1,
+                "report_group_id": group_id,
+            }
+            for group_id in (1, 2)
+        ]
+    }
+    (annotations_dir / "lms_annotations.yml").write_text(yaml.safe_dump(annotations))
+    return annotations_dir, toggle_data_dir
+
+
+def test_parallel_report_is_identical_to_serial_report(tmp_path):
+    annotations_dir, toggle_data_dir = write_report_data(tmp_path)
+    reports = {}
+    for options in ([], ["--verbose-report"]):
+        for jobs in ("1", "2"):
+            output_path = tmp_path / "report.csv"
+            result = CliRunner().invoke(
+                main, [str(annotations_dir), str(toggle_data_dir), str(output_path), "--jobs", jobs] + options
+            )
+            assert result.exit_code == 0, result.output
+            reports[(tuple(options), jobs)] = output_path.read_text()
+    assert reports[((), "1")] == reports[((), "2")]
+    assert reports[(("--verbose-report",), "1")] == reports[(("--verbose-report",), "2")]
+    assert "lms.annotated_only" in reports[((), "1")]
+    assert "discovery.switch" in reports[((), "1")]
+
+
+def test_ordered_file_loader():
+    executor = ImmediateExecutor()
+    loader = OrderedFileLoader(executor, str.upper, ["a", "b", "c", "d"], window=2)
+    # only the first files are loaded ahead
+    assert executor.submitted == ["a", "b"]
+    assert loader("a") == "A"
+    assert executor.submitted == ["a", "b", "c"]
+    assert [loader(path) for path in ["b", "c", "d"]] == ["B", "C", "D"]
+    assert not loader.pending
+    with pytest.raises(ValueError):
+        OrderedFileLoader(executor, str.upper, ["a", "b"], window=2)("b")
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_load_toggle_items(tmp_path, monkeypatch, streaming):
+    _annotations_dir, toggle_data_dir = write_report_data(tmp_path)
+    path = toggle_data_dir / "prod_env" / "lms_waffle.json"
+    state_data = json.loads(path.read_text())
+    if streaming:
+        pytest.importorskip("ijson")
+        # the file must not be loaded at once
+        monkeypatch.setattr(ida_toggles, "load_toggle_state_file", None)
+    else:
+        monkeypatch.setattr(ida_toggles, "ijson", None)
+    toggle_items = ida_toggles.load_toggle_items(str(path))
+    assert toggle_items == [
+        (toggle_type, toggle_data) for toggle_type, toggles_data in state_data.items() for toggle_data in toggles_data
+    ]
+
+
+def test_annotation_files_are_parsed_once(tmp_path, monkeypatch):
+    annotations_dir, toggle_data_dir = write_report_data(tmp_path)
+    parse_annotation_report = CountingParser(monkeypatch)
+    result = CliRunner().invoke(main, [str(annotations_dir), str(toggle_data_dir), str(tmp_path / "report.csv")])
+    assert result.exit_code == 0, result.output
+    assert parse_annotation_report.calls == 1
+
+
+def test_annotation_cache(tmp_path, monkeypatch):
+    annotations_dir, toggle_data_dir = write_report_data(tmp_path)
+    parse_annotation_report = CountingParser(monkeypatch)
+    cache_dir = tmp_path / "cache"
+    reports = []
+    for _ in range(2):
+        output_path = tmp_path / "report.csv"
+        result = CliRunner().invoke(
+            main,
+            [str(annotations_dir), str(toggle_data_dir), str(output_path), "--annotation-cache-dir", str(cache_dir)],
+        )
+        assert result.exit_code == 0, result.output
+        reports.append(output_path.read_text())
+    assert parse_annotation_report.calls == 1
+    assert reports[0] == reports[1]
+
+    # Modified files are parsed again
+    annotations_path = annotations_dir / "lms_annotations.yml"
+    annotations_path.write_text(annotations_path.read_text().replace("lms.annotated_only", "lms.renamed"))
+    result = CliRunner().invoke(
+        main,
+        [str(annotations_dir), str(toggle_data_dir), str(output_path), "--annotation-cache-dir", str(cache_dir)],
+    )
+    assert result.exit_code == 0, result.output
+    assert parse_annotation_report.calls == 2
+    assert "lms.renamed" in output_path.read_text()
+
+
+def test_corrupted_annotation_cache(tmp_path):
+    annotations_dir, _toggle_data_dir = write_report_data(tmp_path)
+    annotations_path = str(annotations_dir / "lms_annotations.yml")
+    cache_dir = tmp_path / "cache"
+    expected = ida_toggles.load_annotation_groups(annotations_path, str(cache_dir))
+    for cache_path in cache_dir.iterdir():
+        cache_path.write_bytes(b"not a pickle")
+    assert ida_toggles.load_annotation_groups(annotations_path, str(cache_dir)) == expected
+    assert ida_toggles.load_annotation_groups(annotations_path) == expected
+
+
+class CountingParser:
+    """
+    Count the calls to the annotation report parser.
+    """
+
+    def __init__(self, monkeypatch):
+        self.calls = 0
+        self.parse_annotation_report = ida_toggles.parse_annotation_report
+        monkeypatch.setattr(ida_toggles, "parse_annotation_report", self)
+
+    def __call__(self, content):
+        self.calls += 1
+        return self.parse_annotation_report(content)
+
+
+class ImmediateExecutor:
+    """
+    Executor that runs functions as soon as they are submitted, and records their first argument.
+    """
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, path):
+        self.submitted.append(path)
+        future = Future()
+        future.set_result(fn(path))
+        return future
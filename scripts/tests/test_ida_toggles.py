@@ -1,6 +1,8 @@
+import random
+
 import pytest
 
-from scripts.ida_toggles import IDA
+from scripts.ida_toggles import IDA, clean_token, group_annotations
 from scripts.toggles import Toggle, ToggleState
 
 
@@ -146,3 +148,26 @@ def test_adding_annotation_data():
     assert annotation.report_group_id == 2
     assert annotation.line_range() == (761, 763)
     assert annotation._raw_annotation_data == expected_data
+
+
+@pytest.mark.parametrize("group_ids", [
+    list(range(1, 200)),
+    [5, 3, 3, 1, 5, 2, 4, 4],
+    [2 ** 40, 7, 2 ** 40 + 8, 7, 15, 2 ** 40],
+    [random.Random(seed).randrange(-10 ** 6, 10 ** 6) for seed in range(1000)],
+])
+def test_group_annotations_order(group_ids):
+    """
+    Groups should be returned in the same order as the former quadratic implementation.
+    """
+    annotations = [{'report_group_id': group_id, 'line_number': i} for i, group_id in enumerate(group_ids)]
+    expected = [
+        [a for a in annotations if a['report_group_id'] == group_id]
+        for group_id in {a['report_group_id'] for a in annotations}
+    ]
+    assert group_annotations(annotations) == expected
+
+
+def test_clean_token():
+    assert clean_token('.. toggle_implementation:') == 'implementation'
+    assert clean_token('.. toggle_use_cases:') == 'use_cases'